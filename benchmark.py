@@ -1,37 +1,93 @@
+import argparse
+import functools
+import json
+import platform
+import random
+import statistics
 import time
+import tracemalloc
+from datetime import datetime, timezone
+from itertools import accumulate
 from pathlib import Path
 from storage.datalakes.datalake_tria import Datalake
 from storage.datalakes.datalake_sql import DatalakeSQL
 from storage.datamarts.datamart_sqlite import DatamartSQLite
 from storage.datamarts.datamart_shelve import DatamartShelve
+from search.analysis import STOP_WORDS, WORD_RE
+from search.builder import build_index, build_segment
+from search.indexer import PositionalInvertedIndex, SimpleInvertedIndex
+from search.query_engine import QueryEngine
+from shared.metrics import METRICS
+from shared.repository import DocumentRepo
 import matplotlib.pyplot as plt
 
+SYLLABLES = ["ka", "lo", "ri", "men", "sa", "tor", "el", "an", "qu", "ve",
+             "dis", "ra", "ne", "po", "li", "mar", "gen", "tu", "ber", "on"]
 
-class StorageBenchmark:
-    def __init__(self):
-        self.results = []
-        self.items = 0
 
-    def generate_test_data(self, n=50):
-        data = [{
+def generate_corpus(n_books=100, words_per_book=20000, vocab_size=50000, zipf_s=1.07, seed=42):
+    """Gutenberg-shaped books whose words follow a Zipf law (rank r has weight 1 / r**zipf_s).
+
+    Stop words take the top ranks, as in English text. The same arguments always give the same corpus.
+    Returns the books and the vocabulary in rank order."""
+    rng = random.Random(seed)
+    vocab, seen = sorted(STOP_WORDS), set(STOP_WORDS)
+    while len(vocab) < vocab_size:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4)))
+        if word not in seen:
+            seen.add(word)
+            vocab.append(word)
+    cum_weights = list(accumulate(1 / r ** zipf_s for r in range(1, vocab_size + 1)))
+    books = []
+    for i in range(1, n_books + 1):
+        words = rng.choices(vocab, cum_weights=cum_weights, k=words_per_book)
+        body = "\n".join(" ".join(words[j:j + 12]) for j in range(0, len(words), 12))
+        header = f"Title: Book {i}\nAuthor: Author {i%5}\nLanguage: English"
+        books.append({
             "book_id": i,
             "raw_text": (
-                f"Title: Book {i}\nAuthor: Author {i%5}\nLanguage: English\n"
-                f"*** START OF THE PROJECT GUTENBERG EBOOK ***\n"
-                f"Content {i}\n*** END OF THE PROJECT GUTENBERG EBOOK ***"
+                f"{header}\n*** START OF THE PROJECT GUTENBERG EBOOK BOOK {i} ***\n"
+                f"{body}\n*** END OF THE PROJECT GUTENBERG EBOOK BOOK {i} ***"
             ),
-            "header": f"Title: Book {i}\nAuthor: Author {i%5}\nLanguage: English",
-            "body": f"Content {i}"
-        } for i in range(1, n + 1)]
+            "header": header,
+            "body": body
+        })
+    return books, vocab
+
+
+class StorageBenchmark:
+    CODECS = (None, "zlib", "lzma")
+    QUERY_TYPES = ("tfidf", "bm25", "cosine", "boolean", "or", "phrase", "near", "wildcard", "fuzzy")
+
+    def __init__(self, track_memory=True, seed=42):
+        self.results = []
+        self.latencies = []
+        self.items = 0
+        self.bytes_written = {}
+        self.config = {"seed": seed}
+        self.track_memory = track_memory
+        self.rng = random.Random(seed)
+        self.vocab = []
+
+    def generate_test_data(self, n=100, words_per_book=20000, vocab_size=50000, zipf_s=1.07):
+        data, self.vocab = generate_corpus(n, words_per_book, vocab_size, zipf_s, self.config["seed"])
         self.items = n
+        self.config.update(books=n, words_per_book=words_per_book, vocab_size=vocab_size, zipf_s=zipf_s)
         return data
 
-    def _time_it(self, name, func):
+    def _time_it(self, name, func, items=None):
+        # tracemalloc slows allocation-heavy code down, so peaks are only collected when asked for.
+        if self.track_memory:
+            tracemalloc.start()
         start = time.perf_counter()
         result = func()
         elapsed = time.perf_counter() - start
-        self.results.append((name, elapsed, result))
-        return elapsed
+        peak = None
+        if self.track_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.results.append({"name": name, "seconds": elapsed, "items": items or self.items, "peak_bytes": peak})
+        return result
 
     def run_datalake_benchmarks(self, test_data):
         print("Benchmarking Datalakes...")
@@ -41,22 +97,39 @@ class StorageBenchmark:
             lambda: [lake.save_raw(d["book_id"], d["raw_text"]) for d in test_data]
         )
 
-        lake_sql = DatalakeSQL("bench_datalake_sql/books.db")
-        try:
-            conn = lake_sql.conn
-            conn.execute("PRAGMA journal_mode=WAL;")
-            conn.execute("PRAGMA synchronous=NORMAL;")
-            conn.execute("PRAGMA temp_store=MEMORY;")
-            conn.execute("PRAGMA cache_size=-20000;")
-        except Exception:
-            pass
+        self._time_it(
+            "Datalake_File_scan",
+            lambda: sum(len(lake.read_body(body)) for _, _, body in lake.iter_books())
+        )
 
+        lake_sql = DatalakeSQL("bench_datalake_sql/books.db")
         self._time_it(
             "Datalake_SQL",
             lambda: [lake_sql.save_raw(d["book_id"], d["header"], d["body"]) for d in test_data]
         )
+        self._time_it("Datalake_SQL_scan", lambda: sum(len(row[2]) for row in lake_sql.iter_books()))
         lake_sql.conn.close()
 
+        lake_batch = DatalakeSQL("bench_datalake_sql/books_batch.db")
+        self._time_it("Datalake_SQL_Batch", lambda: lake_batch.save_many(test_data))
+        self._time_it("Datalake_SQL_Dedup", lambda: lake_batch.save_many(test_data))
+        lake_batch.conn.close()
+
+    def run_codec_benchmarks(self, test_data):
+        print("Benchmarking body codecs...")
+        for codec in self.CODECS:
+            name = codec or "plain"
+            lake = Datalake(root=f"bench_codec_{name}", codec=codec)
+            self._time_it(
+                f"Codec_{name}_write",
+                lambda: [lake.save_raw(d["book_id"], d["raw_text"]) for d in test_data]
+            )
+            self.bytes_written[name] = sum(p.stat().st_size for p in lake.root.rglob("*_body.txt*"))
+            self._time_it(
+                f"Codec_{name}_read",
+                lambda: sum(len(lake.read_body(body)) for _, _, body in lake.iter_books())
+            )
+
     def run_datamart_benchmarks(self, test_data):
         print("Benchmarking Datamarts...")
 
@@ -79,43 +152,126 @@ class StorageBenchmark:
         except Exception:
             pass
 
+        # The same number of new rows again, into the now populated catalog: upsert cost should not grow with it.
+        offset = max(m["book_id"] for m in metadata) + 1
+        more = [dict(m, book_id=m["book_id"] + offset) for m in metadata]
+
         self._time_it("Datamart_SQLite", lambda: dm_sql.upsert_many(metadata))
+        self._time_it("Datamart_SQLite_grow", lambda: dm_sql.upsert_many(more))
         dm_sql.close()
         dm_sh = DatamartShelve("bench_datamart_shelve.db")
         self._time_it("Datamart_Shelve", lambda: dm_sh.upsert_many(metadata))
+        self._time_it("Datamart_Shelve_grow", lambda: dm_sh.upsert_many(more))
         dm_sh.close()
 
+    def run_index_benchmarks(self, test_data, workers=None):
+        print("Benchmarking index builds...")
+        books = [(d["book_id"], d["body"]) for d in test_data]
+
+        def sequential(cls):
+            idx = cls()
+            for book_id, body in books:
+                idx.index_document(book_id, body)
+            return idx
+
+        pos = self._time_it("Index_Positional", lambda: sequential(PositionalInvertedIndex))
+        simple = self._time_it("Index_Simple", lambda: sequential(SimpleInvertedIndex))
+        self._time_it("Index_Parallel", lambda: build_index(books, workers))
+        self._time_it("Index_Segment", lambda: build_segment(books, "bench_index/index.seg", workers))
+        return pos, simple
+
+    def _queries(self, test_data, kind, n):
+        # Terms come from the middle of the Zipf curve (frequent enough to match, rare enough to rank);
+        # phrases are cut from the generated bodies so that they always match somewhere.
+        terms = self.vocab[len(STOP_WORDS):len(STOP_WORDS) + 2000]
+        queries = []
+        for _ in range(n):
+            a, b, c = self.rng.sample(terms, 3)
+            if kind == "or":
+                queries.append((f"{a} OR {b}", "tfidf"))
+            elif kind == "near":
+                queries.append((f"{a} NEAR/5 {b}", "tfidf"))
+            elif kind == "wildcard":
+                queries.append((f"{a[:3]}* {b}", "tfidf"))
+            elif kind == "fuzzy":
+                queries.append((f"{a}~1 {b}", "tfidf"))
+            elif kind == "phrase":
+                words = WORD_RE.findall(self.rng.choice(test_data)["body"][:20000])
+                start = self.rng.randrange(len(words) - 2)
+                queries.append((f'"{words[start]} {words[start + 1]}"', "tfidf"))
+            else:
+                queries.append((f"{a} {b} {c}", kind))
+        return queries
+
+    def run_query_benchmarks(self, test_data, pos, simple, n_queries=200):
+        print("Benchmarking queries...")
+        lake = Datalake(root="bench_datalake_files")
+        repo = DocumentRepo()
+        for book_id, _, body_path in lake.iter_books(latest_only=True):
+            repo.add(book_id, lake.read_body(body_path), source=functools.partial(lake.read_range, body_path))
+        engine = QueryEngine(pos, simple, repo, cache_size=0)
+        for kind in self.QUERY_TYPES:
+            timings = []
+            for q, method in self._queries(test_data, kind, n_queries):
+                start = time.perf_counter()
+                engine.search(q, method)
+                timings.append(time.perf_counter() - start)
+            cuts = statistics.quantiles(timings, n=100, method="inclusive")
+            self.latencies.append({
+                "name": f"Query_{kind}",
+                "count": len(timings),
+                "mean_ms": statistics.fmean(timings) * 1000,
+                "p50_ms": cuts[49] * 1000,
+                "p95_ms": cuts[94] * 1000,
+                "p99_ms": cuts[98] * 1000
+            })
+
     def print_results(self):
         print("\n" + "=" * 50)
         print("STORAGE BENCHMARK RESULTS")
         print("=" * 50)
         items = self.items or 1
 
-        for name, time_taken, _ in self.results:
+        for r in self.results:
+            items, time_taken = r["items"] or 1, r["seconds"]
             avg_ms = (time_taken * 1000) / items
             throughput = items / time_taken if time_taken > 0 else 0
-            print(f"{name:<18} | {time_taken:6.3f}s total | {avg_ms:6.2f} ms/item | {throughput:6.0f} items/s")
+            peak = f" | peak {r['peak_bytes'] / 2**20:7.1f} MiB" if r["peak_bytes"] is not None else ""
+            print(f"{r['name']:<22} | {time_taken:6.3f}s total | {avg_ms:6.2f} ms/item | "
+                  f"{throughput:6.0f} items/s{peak}")
 
-        datalakes = [r for r in self.results if "Datalake" in r[0]]
-        datamarts = [r for r in self.results if "Datamart" in r[0]]
+        datalakes = [r for r in self.results if "Datalake" in r["name"] and not r["name"].endswith("_scan")]
+        datamarts = [r for r in self.results if "Datamart" in r["name"]]
 
         if datalakes:
-            fastest_lake = min(datalakes, key=lambda x: x[1])
-            print(f"\nFastest Datalake: {fastest_lake[0]} ({fastest_lake[1]:.3f}s)")
+            fastest_lake = min(datalakes, key=lambda x: x["seconds"])
+            print(f"\nFastest Datalake: {fastest_lake['name']} ({fastest_lake['seconds']:.3f}s)")
 
         if datamarts:
-            fastest_mart = min(datamarts, key=lambda x: x[1])
-            print(f"Fastest Datamart: {fastest_mart[0]} ({fastest_mart[1]:.3f}s)")
+            fastest_mart = min(datamarts, key=lambda x: x["seconds"])
+            print(f"Fastest Datamart: {fastest_mart['name']} ({fastest_mart['seconds']:.3f}s)")
+
+        if self.latencies:
+            print("\nQuery latency:")
+            for r in self.latencies:
+                print(f"{r['name']:<18} | n={r['count']:<5d} | p50 {r['p50_ms']:7.2f} ms | "
+                      f"p95 {r['p95_ms']:7.2f} ms | p99 {r['p99_ms']:7.2f} ms")
+
+        if self.bytes_written:
+            plain = self.bytes_written.get("plain") or 1
+            print("\nBody bytes written:")
+            for name, size in self.bytes_written.items():
+                print(f"{name:<18} | {size:10d} bytes | ratio {plain / (size or 1):5.2f}x")
 
     def plot_results(self, outfile="bench.png"):
         if not self.results:
             print("No results to plot.")
             return
 
-        names = [r[0] for r in self.results]
-        times = [r[1] for r in self.results]
+        names = [r["name"] for r in self.results]
+        times = [r["seconds"] for r in self.results]
 
-        plt.figure(figsize=(9, 5))
+        plt.figure(figsize=(max(9, len(names) * 0.8), 5))
         bars = plt.bar(names, times, color='steelblue')
         for bar, t in zip(bars, times):
             plt.text(
@@ -126,17 +282,36 @@ class StorageBenchmark:
         plt.title("Storage Benchmark")
         plt.ylabel("Total time (s)")
         plt.xlabel("Storage Strategy")
+        plt.xticks(rotation=45, ha="right")
         plt.ylim(0, max(times) * 1.25)
         plt.tight_layout()
         plt.savefig(outfile)
         print(f"[PLOT] Saved results chart to {outfile}")
 
+    def write_json(self, outfile="bench.json"):
+        report = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": self.config,
+            "results": self.results,
+            "latencies": self.latencies,
+            "body_bytes": self.bytes_written
+        }
+        if METRICS.enabled:
+            report["metrics"] = METRICS.snapshot()
+        Path(outfile).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"[JSON] Saved results to {outfile}")
+
     def cleanup(self):
         paths = [
             "bench_datalake_files",
             "bench_datalake_sql",
             "bench_datamart.sqlite",
-            "bench_datamart_shelve.db"
+            "bench_index",
+            *[f"bench_codec_{codec or 'plain'}" for codec in self.CODECS],
+            # dbm backends add their own suffixes (.dat/.dir/.bak for dbm.dumb, .db for ndbm).
+            *[str(p) for p in Path().glob("bench_datamart_shelve.db*")]
         ]
         for path in paths:
             p = Path(path)
@@ -149,13 +324,38 @@ class StorageBenchmark:
 
 
 def main():
-    bench = StorageBenchmark()
+    parser = argparse.ArgumentParser(description="Benchmark storage, indexing and querying on a synthetic corpus.")
+    parser.add_argument("--books", type=int, default=100)
+    parser.add_argument("--words", type=int, default=20000, help="words per book")
+    parser.add_argument("--vocab", type=int, default=50000)
+    parser.add_argument("--zipf", type=float, default=1.07, help="Zipf exponent of the vocabulary")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--queries", type=int, default=200, help="queries per query type")
+    parser.add_argument("--workers", type=int, help="processes for the parallel index builds")
+    parser.add_argument("--json", default="bench.json")
+    parser.add_argument("--plot", default="bench.png")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc peak tracking")
+    parser.add_argument("--metrics", help="record storage/index/query metrics; written to the JSON report "
+                                          "and, in Prometheus text format, to this file")
+    args = parser.parse_args()
+    if args.metrics:
+        METRICS.enable()
+
+    bench = StorageBenchmark(track_memory=not args.no_memory, seed=args.seed)
     try:
-        test_data = bench.generate_test_data(200)
+        test_data = bench.generate_test_data(args.books, args.words, args.vocab, args.zipf)
+        bench.config.update(queries=args.queries, workers=args.workers)
         bench.run_datalake_benchmarks(test_data)
+        bench.run_codec_benchmarks(test_data)
         bench.run_datamart_benchmarks(test_data)
+        pos, simple = bench.run_index_benchmarks(test_data, args.workers)
+        bench.run_query_benchmarks(test_data, pos, simple, args.queries)
         bench.print_results()
-        bench.plot_results("bench.png")
+        bench.write_json(args.json)
+        bench.plot_results(args.plot)
+        if args.metrics:
+            Path(args.metrics).write_text(METRICS.to_prometheus(), encoding="utf-8")
+            print(f"[METRICS] Saved Prometheus metrics to {args.metrics}")
     finally:
         bench.cleanup()
 
@@ -1,11 +1,15 @@
 from storage.datalakes.datalake_tria import Datalake
 from storage.datalakes.datalake_sql import DatalakeSQL
-from utils.API import API
+from utils.API import API, LocalMirror
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import argparse
 import re
 
 START_RE = re.compile(r'\*\*\*\s*START OF (THIS|THE) PROJECT GUTENBERG EBOOK.*', re.IGNORECASE)
 END_RE   = re.compile(r'\*\*\*\s*END OF (THIS|THE) PROJECT GUTENBERG EBOOK.*', re.IGNORECASE)
 
+DEFAULT_BOOKS = [11, 84, 98, 1661, 2701, 1342, 1952, 4300]
+
 datalake_tria = Datalake(root="datalake_tria")
 datalake_sql  = DatalakeSQL(db_path="datalake_sql/books.db")
 api = API()
@@ -21,17 +25,64 @@ def _split_header_body(raw_text: str) -> tuple[str, str, str]:
         return header, body, footer
     return "", t.strip(), ""
 
-def ingest_book(book_id: int):
-    raw = api.fetch_gutenberg_text(book_id)
+def _store(book_id: int, raw: str | None) -> bool:
     if not raw:
         print(f"[WARN] Book {book_id}: no descargado como texto plano.")
-        return
+        return False
 
     info_tria = datalake_tria.save_raw(book_id, raw)
     header, body, footer = _split_header_body(raw)
-    datalake_sql.save_raw(book_id, header, body)
-    print(f"[INFO] Book {book_id} -> FS(OK) SQL(OK) [{info_tria['date']}/{info_tria['hour']}]")
+    info_sql = datalake_sql.save_raw(book_id, header, body)
+    fs = "OK" if info_tria["changed"] else "SAME"
+    sql = "OK" if info_sql["changed"] else "SAME"
+    print(f"[INFO] Book {book_id} -> FS({fs}) SQL({sql}) [{info_tria['date']}/{info_tria['hour']}]")
+    return info_tria["changed"] or info_sql["changed"]
+
+def _collect(book_id: int, future) -> bool:
+    # One failed download or write must not abort the whole batch: log it and move on.
+    try:
+        return _store(book_id, future.result())
+    except Exception as e:
+        print(f"[ERROR] Book {book_id}: {e!r}; se omite.")
+        return False
+
+def ingest_book(book_id: int, source=None) -> bool:
+    """True when the stored text changed, i.e. the book needs re-indexing."""
+    return _store(book_id, (source or api).fetch_gutenberg_text(book_id))
+
+def ingest_many(book_ids, source=None, workers: int = 8):
+    """Downloads up to `workers` books at once; writes stay on this thread because the SQLite
+    connection is not shared across threads. At most 2 * workers downloads are queued at a time.
+    Books whose download or write fails are logged and skipped. Returns the ids whose stored text changed."""
+    source = source or api
+    changed = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        for book_id in book_ids:
+            pending[pool.submit(source.fetch_gutenberg_text, book_id)] = book_id
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    book_id = pending.pop(future)
+                    if _collect(book_id, future):
+                        changed.append(book_id)
+        for future in wait(pending).done:
+            if _collect(pending[future], future):
+                changed.append(pending[future])
+    return changed
 
 if __name__ == "__main__":
-    for book_id in [11, 84, 98, 1661, 2701, 1342, 1952, 4300]:
-        ingest_book(book_id)
+    parser = argparse.ArgumentParser(description="Ingest Project Gutenberg books into both datalakes.")
+    parser.add_argument("book_ids", nargs="*", type=int, default=DEFAULT_BOOKS)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--mirror", help="read <id>.txt files from this directory instead of gutenberg.org")
+    parser.add_argument("--rate", type=float, help="max requests per second per host")
+    args = parser.parse_args()
+
+    if args.mirror:
+        source = LocalMirror(args.mirror)
+    else:
+        source = API(max_connections=args.workers, rate_limit=args.rate)
+    changed = ingest_many(args.book_ids, source, workers=args.workers)
+    print(f"[INFO] {len(changed)} of {len(args.book_ids)} books changed: {sorted(changed)}")
+    source.close()
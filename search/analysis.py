@@ -0,0 +1,139 @@
+import re
+import unicodedata
+from itertools import compress, count
+
+WORD_RE = re.compile(r"\w+")
+_TAIL_RE = re.compile(r"\S+$")
+
+STOP_WORDS = frozenset({
+    "the", "is", "a", "an", "and", "or", "of", "to", "in", "that", "it", "this", "for",
+    "on", "with", "as", "by", "be", "are", "was", "were", "has", "have", "but", "not",
+    "these", "those", "i", "you"
+})
+
+
+def s_stem(word):
+    """Harman's S-stemmer: strips English plurals only, so it rarely conflates unrelated words."""
+    if len(word) > 3 and word.endswith("ies") and not word.endswith(("eies", "aies")):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("es") and not word.endswith(("aes", "ees", "oes")):
+        return word[:-1]
+    if len(word) > 2 and word.endswith("s") and not word.endswith(("us", "ss")):
+        return word[:-1]
+    return word
+
+
+STEMMERS = {"s": s_stem}
+
+
+def fold_accents(word):
+    return "".join(c for c in unicodedata.normalize("NFKD", word) if not unicodedata.combining(c))
+
+
+class _TermCache(dict):
+    # word -> term (None for stop words); misses fall through to the analyzer and are remembered.
+    def __init__(self, analyzer):
+        super().__init__()
+        self.analyzer = analyzer
+
+    def __missing__(self, word):
+        if len(self) >= self.analyzer.cache_size:
+            self.clear()
+        term = self[word] = self.analyzer._normalize(word)
+        return term
+
+
+class Analyzer:
+    """Text -> (position, term) pipeline shared by indexing and querying.
+
+    Words are matched on lowercased text and numbered before stop words are dropped, so positions line up
+    with the original word order (phrase offsets and snippets depend on this). Each distinct word goes
+    through normalization, the stop list and the stemmer once; the result is cached. With ngrams > 1,
+    word shingles of adjacent terms ("white whale") are emitted at the position of their first word."""
+
+    def __init__(self, stopwords=STOP_WORDS, stemmer=None, ngrams=1, fold=False, cache_size=500_000):
+        self.stopwords = frozenset(stopwords)
+        self.stemmer = STEMMERS[stemmer] if isinstance(stemmer, str) else stemmer
+        self.ngrams = ngrams
+        self.fold = fold
+        self.cache_size = cache_size
+        self._cache = _TermCache(self)
+
+    def __getstate__(self):
+        # Sent to builder worker processes; the cache is rebuilt there rather than pickled.
+        state = self.__dict__.copy()
+        del state["_cache"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache = _TermCache(self)
+
+    def _normalize(self, word):
+        if self.fold:
+            word = fold_accents(word)
+        if word in self.stopwords:
+            return None
+        return self.stemmer(word) if self.stemmer else word
+
+    def term(self, word):
+        """Indexed form of a single word, or None when it is a stop word."""
+        return self._cache[word.lower()]
+
+    def _words(self, text):
+        # Yields the words of `text` one list per chunk. Chunks are lowercased one at a time and whatever
+        # follows their last whitespace is carried, unlowered, into the next, so the full lowercased body is
+        # never built. Cutting at whitespace rather than at the last word matters: lower() looks at the
+        # neighbouring letters (a final "Σ" becomes "ς"), and no such context reaches across whitespace.
+        if isinstance(text, str):
+            yield WORD_RE.findall(text.lower())
+            return
+        carry = ""
+        for chunk in text:
+            buf = carry + chunk
+            tail = _TAIL_RE.search(buf)
+            carry = buf[tail.start():] if tail else ""
+            yield WORD_RE.findall((buf[:tail.start()] if tail else buf).lower())
+        if carry:
+            yield WORD_RE.findall(carry.lower())
+
+    def tokens(self, text):
+        """(position, term) for every non-stop word of `text`, a string or an iterable of string chunks."""
+        lookup = self._cache.__getitem__
+        pairs, base = [], 0
+        for words in self._words(text):
+            terms = list(map(lookup, words))
+            pairs.extend(zip(compress(count(base), terms), filter(None, terms)))
+            base += len(words)
+        return pairs
+
+    def analyze(self, text):
+        pairs = self.tokens(text)
+        if self.ngrams <= 1:
+            return pairs
+        out = []
+        for i, (pos, term) in enumerate(pairs):
+            out.append((pos, term))
+            for n in range(2, self.ngrams + 1):
+                start = i - n + 1
+                if start < 0 or pairs[start][0] != pos - n + 1:
+                    break
+                out.append((pairs[start][0], " ".join(t for _, t in pairs[start:i + 1])))
+        out.sort(key=lambda pair: pair[0])
+        return out
+
+    def analyze_many(self, texts):
+        return [self.analyze(text) for text in texts]
+
+    def terms(self, text):
+        if self.ngrams > 1:
+            return [term for _, term in self.analyze(text)]
+        lookup = self._cache.__getitem__
+        return [term for words in self._words(text) for term in filter(None, map(lookup, words))]
+
+    def phrase_terms(self, text):
+        """(offset, term) pairs of a phrase; stop words are dropped but still count towards the offsets."""
+        return self.tokens(text)
+
+
+ANALYZER = Analyzer()
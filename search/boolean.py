@@ -0,0 +1,395 @@
+import heapq
+import re
+from bisect import bisect_left
+
+from search.analysis import ANALYZER
+from search.phrase import phrase_counter
+from search.postings import END
+from shared.metrics import METRICS
+
+TOKEN_RE = re.compile(r'''
+    "(?P<phrase>[^"]*)"(?:~(?P<slop>\d+))?
+  | (?P<open>\()
+  | (?P<close>\))
+  | (?P<field>\w+):(?=[^\s)])
+  | (?P<neg>-)(?=[^\s)-])
+  | (?P<word>[^\s()"]+)
+''', re.VERBOSE)
+
+
+# --- parsing: query text -> tuples ("term", field, word), ("phrase", field, text, slop), ("and", nodes),
+# ("or", nodes), ("not", node). NOT binds tighter than AND (explicit or implied by adjacency), AND than OR.
+
+class _Parser:
+    def __init__(self, q, fields):
+        # lastgroup would name "slop" for a phrase with a slop.
+        self.tokens = [("phrase" if m["phrase"] is not None else m.lastgroup, m) for m in TOKEN_RE.finditer(q)]
+        self.fields = fields
+        self.i = 0
+
+    def _peek(self):
+        return self.tokens[self.i][0] if self.i < len(self.tokens) else None
+
+    def _op(self, name):
+        return self._peek() == "word" and self.tokens[self.i][1]["word"] == name
+
+    def query(self, field):
+        nodes = []
+        while self.i < len(self.tokens):
+            nodes.append(self.disjunction(field))
+            if self._peek() == "close":
+                self.i += 1  # unbalanced ")"
+        return _join("and", nodes)
+
+    def disjunction(self, field):
+        nodes = [self.conjunction(field)]
+        while self._op("OR"):
+            self.i += 1
+            nodes.append(self.conjunction(field))
+        return _join("or", nodes)
+
+    def conjunction(self, field):
+        nodes = []
+        while self._peek() not in (None, "close") and not self._op("OR"):
+            if self._op("AND"):
+                self.i += 1
+                continue
+            nodes.append(self.unary(field))
+        return _join("and", nodes)
+
+    def unary(self, field):
+        if self._op("NOT") or self._peek() == "neg":
+            self.i += 1
+            node = self.unary(field)
+            return ("not", node) if node is not None else None
+        return self.primary(field)
+
+    def primary(self, field):
+        kind = self._peek()
+        if kind is None or kind == "close":
+            return None
+        m = self.tokens[self.i][1]
+        self.i += 1
+        if kind == "open":
+            node = self.disjunction(field)
+            if self._peek() == "close":
+                self.i += 1
+            return node
+        if kind == "phrase":
+            return ("phrase", field, m["phrase"], int(m["slop"] or 0))
+        if kind == "field":
+            name = m["field"].lower()
+            if name in self.fields:
+                return self.unary(name)
+            # Not a field we index: "name:" is just another word.
+            return _join("and", [("term", field, m["field"]), self.unary(field)])
+        return ("term", field, m["word"])
+
+
+def _join(op, nodes):
+    nodes = [n for n in nodes if n is not None]
+    if not nodes:
+        return None
+    return nodes[0] if len(nodes) == 1 else (op, nodes)
+
+
+def parse(q, fields=("body",), default="body"):
+    """Syntax tree of a query, or None when it has no terms."""
+    return _Parser(q, fields).query(default)
+
+
+# --- cursors: each exposes `doc`, `df`, `next()` and `advance(target)` like the index posting cursors.
+
+class _DocList:
+    """Cursor over a sorted list of doc ids."""
+
+    def __init__(self, docs):
+        self._docs = docs
+        self.df = len(docs)
+        self._i = -1
+        self.doc = -1
+
+    def _load(self):
+        self.doc = self._docs[self._i] if self._i < self.df else END
+        return self.doc
+
+    def next(self):
+        self._i += 1
+        return self._load()
+
+    def advance(self, target):
+        if self.doc >= target:
+            return self.doc
+        self._i = bisect_left(self._docs, target, self._i + 1)
+        return self._load()
+
+
+class _AndCursor:
+    """Leapfrog intersection driven by the first (rarest) cursor, skipping documents held by any excluded one."""
+
+    def __init__(self, cursors, excluded=()):
+        self._cursors = cursors
+        self._excluded = excluded
+        self.df = cursors[0].df
+        self.doc = -1
+
+    def _align(self, target):
+        cursors = self._cursors
+        while target != END:
+            for c in cursors:
+                if c.advance(target) != target:
+                    target = c.doc
+                    break
+            else:
+                if not any(x.advance(target) == target for x in self._excluded):
+                    break
+                target = cursors[0].next()
+        self.doc = target
+        return target
+
+    def next(self):
+        return self._align(self._cursors[0].next())
+
+    def advance(self, target):
+        if self.doc >= target:
+            return self.doc
+        return self._align(self._cursors[0].advance(target))
+
+
+class _OrCursor:
+    """Union of cursors, merged through a heap of their current documents."""
+
+    def __init__(self, cursors):
+        self._cursors = cursors
+        self._heap = None
+        self.df = sum(c.df for c in cursors)
+        self.doc = -1
+
+    def _start(self, move):
+        self._heap = [(move(c), i) for i, c in enumerate(self._cursors)]
+        heapq.heapify(self._heap)
+
+    def next(self):
+        if self._heap is None:
+            self._start(lambda c: c.next())
+        elif self.doc != END:
+            heap, doc = self._heap, self.doc
+            while heap[0][0] == doc:
+                i = heap[0][1]
+                heapq.heapreplace(heap, (self._cursors[i].next(), i))
+        self.doc = self._heap[0][0]
+        return self.doc
+
+    def advance(self, target):
+        if self.doc >= target:
+            return self.doc
+        if self._heap is None:
+            self._start(lambda c: c.advance(target))
+        else:
+            heap = self._heap
+            while heap[0][0] < target:
+                i = heap[0][1]
+                heapq.heapreplace(heap, (self._cursors[i].advance(target), i))
+        self.doc = self._heap[0][0]
+        return self.doc
+
+
+class _PhraseCursor:
+    """Documents holding every term of a phrase, checked against the term positions as they are reached."""
+
+    def __init__(self, cursors, terms, count):
+        self._cursors = cursors
+        self._terms = terms
+        self._count = count
+        self._inner = _AndCursor(sorted(cursors.values(), key=lambda c: c.df))
+        self.df = self._inner.df
+        self.doc = -1
+
+    def _check(self, doc):
+        while doc != END:
+            positions = {term: c.positions() for term, c in self._cursors.items()}
+            if self._count([positions[t] for t in self._terms]):
+                break
+            doc = self._inner.next()
+        self.doc = doc
+        return doc
+
+    def next(self):
+        return self._check(self._inner.next())
+
+    def advance(self, target):
+        if self.doc >= target:
+            return self.doc
+        return self._check(self._inner.advance(target))
+
+
+# --- plan: syntax tree -> nodes with a cost (an upper bound on their matches, from document frequencies)
+# and a cursor() opening the streams that evaluate them.
+
+class _Empty:
+    cost = 0
+
+    def cursor(self):
+        return _DocList([])
+
+
+EMPTY = _Empty()
+
+
+class _All:
+    def __init__(self, index):
+        self.index = index
+        self.cost = index.doc_count
+
+    def cursor(self):
+        return _DocList(sorted(self.index.doc_ids()))
+
+
+class _Term:
+    def __init__(self, index, term):
+        self.index = index
+        self.term = term
+        self.cost = index.doc_freq(term)
+
+    def cursor(self):
+        return self.index.postings(self.term) or _DocList([])
+
+
+class _Phrase:
+    def __init__(self, index, pairs, slop):
+        self.index = index
+        self.terms = [term for _, term in pairs]
+        self.count = phrase_counter([offset for offset, _ in pairs], slop)
+        self.cost = min(index.doc_freq(t) for t in self.terms)
+
+    def cursor(self):
+        cursors = {t: self.index.postings(t) for t in self.terms}
+        if any(c is None for c in cursors.values()):
+            return _DocList([])
+        return _PhraseCursor(cursors, self.terms, self.count)
+
+
+class _And:
+    def __init__(self, include, exclude):
+        self.include = sorted(include, key=lambda n: n.cost)
+        self.exclude = exclude
+        self.cost = self.include[0].cost
+
+    def cursor(self):
+        return _AndCursor([n.cursor() for n in self.include], [n.cursor() for n in self.exclude])
+
+
+class _Or:
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.cost = sum(n.cost for n in nodes)
+
+    def cursor(self):
+        return _OrCursor([n.cursor() for n in self.nodes])
+
+
+class Planner:
+    """Compiles a syntax tree against per-field indexes (QueryEngine.fields()).
+
+    Conjunctions are ordered by ascending cost so the rarest operand drives the intersection, and a branch
+    whose cost is 0 is pruned before any posting list is opened: an empty operand empties its conjunction
+    and drops out of its disjunction. `terms` collects the non-negated body terms, for highlighting.
+
+    `expand(field, word)` may return the terms a wildcard or fuzzy word stands for (None for plain words);
+    they are ORed together."""
+
+    def __init__(self, fields, default="body", expand=None):
+        self.fields = fields
+        self.default = default
+        self.expand = expand
+        self.terms = []
+
+    def _analyzer(self, field):
+        return getattr(self.fields[field], "analyzer", ANALYZER)
+
+    def _union(self, nodes):
+        nodes = [n for n in nodes if n.cost]
+        if not nodes:
+            return EMPTY
+        return nodes[0] if len(nodes) == 1 else _Or(nodes)
+
+    def compile(self, node, negated=False):
+        if node is None:
+            return None
+        op = node[0]
+        if op == "term" and self.expand is not None:
+            expansion = self.expand(node[1], node[2])
+            if expansion is not None:
+                if node[1] == self.default and not negated:
+                    self.terms.extend(expansion)
+                index = self.fields[node[1]]
+                return self._union([_Term(index, t) for t in expansion])
+        if op == "term" or op == "phrase":
+            field = node[1]
+            index = self.fields[field]
+            pairs = self._analyzer(field).phrase_terms(node[2])
+            if not pairs:
+                return None  # only stop words
+            if field == self.default and not negated:
+                self.terms.extend(term for _, term in pairs)
+            if len(pairs) == 1:
+                return _Term(index, pairs[0][1])
+            return _Phrase(index, pairs, node[3] if op == "phrase" else 0)
+        if op == "not":
+            child = self.compile(node[1], not negated)
+            if child is None:
+                return None
+            return _And([_All(self.fields[self.default])], [child]) if child.cost else _All(self.fields[self.default])
+        if op == "or":
+            nodes = [n for n in (self.compile(c, negated) for c in node[1]) if n is not None]
+            return self._union(nodes) if nodes else None
+        include, exclude = [], []
+        for child in node[1]:
+            if child[0] == "not":
+                n = self.compile(child[1], not negated)
+                if n is not None and n.cost:
+                    exclude.append(n)
+                continue
+            n = self.compile(child, negated)
+            if n is None:
+                continue
+            if not n.cost:
+                return EMPTY
+            include.append(n)
+        if not include:
+            if not exclude:
+                return None
+            include.append(_All(self.fields[self.default]))
+        if len(include) == 1 and not exclude:
+            return include[0]
+        return _And(include, exclude)
+
+
+def evaluate(plan):
+    """Matching doc ids in ascending order."""
+    if plan is None or not plan.cost:
+        return []
+    cursor = plan.cursor()
+    docs = []
+    doc = cursor.next()
+    while doc != END:
+        docs.append(doc)
+        doc = cursor.next()
+    METRICS.inc("docs_matched_total", len(docs))
+    return docs
+
+
+def boolean_search(fields, q, default="body", expand=None):
+    """(doc ids, body terms) for a query such as `whale AND (ship OR boat) -"white whale" header:melville`.
+
+    Words and "phrases" (with an optional ~slop) combine with AND, OR, NOT (also written as a leading -)
+    and parentheses; adjacent operands are ANDed. `field:` restricts the operand that follows it to that
+    field's index. Stop words are dropped, and a word the analyzer splits into several terms matches as a
+    phrase. See Planner for `expand`."""
+    planner = Planner(fields, default, expand)
+    with METRICS.stage("tokenize"):
+        tree = parse(q, tuple(fields), default)
+    with METRICS.stage("lookup"):
+        plan = planner.compile(tree)
+    with METRICS.stage("match"):
+        return evaluate(plan), planner.terms
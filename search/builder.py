@@ -0,0 +1,140 @@
+import heapq
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import groupby, islice
+from operator import itemgetter
+from pathlib import Path
+
+from search.indexer import SimpleInvertedIndex, PositionalInvertedIndex
+from search.postings import END, pack_lists
+from search.segment import Segment, SegmentWriter
+from storage.datalakes import codec as body_codec
+
+MERGE_FAN_IN = 32
+
+
+def iter_sql_books(lake):
+    for book_id, _, body, _ in lake.iter_books():
+        yield book_id, body or ""
+
+
+def iter_file_books(lake):
+    # The file lake keeps every ingested version; only the most recent body of each book is indexed.
+    for book_id, _, body_path in lake.iter_books(latest_only=True):
+        yield book_id, Path(body_path)
+
+
+def _batches(books, batch_size):
+    books = iter(books)
+    while batch := list(islice(books, batch_size)):
+        yield batch
+
+
+def _read(text):
+    # Bodies on disk are streamed chunk by chunk into the analyzer instead of being read whole.
+    if isinstance(text, Path):
+        return body_codec.iter_file(text)
+    return text
+
+
+def _index_batch(batch, positional=True, analyzer=None):
+    idx = PositionalInvertedIndex(analyzer) if positional else SimpleInvertedIndex(analyzer)
+    for doc_id, text in batch:
+        idx.index_document(doc_id, _read(text))
+    return idx
+
+
+def _partial_run(batch, positional, analyzer):
+    # The batch's posting lists travel back packed into flat arrays, positions still encoded.
+    idx = _index_batch(batch, positional, analyzer)
+    return pack_lists(idx.index.items()), idx.doc_stats
+
+
+def _segment_run(batch, path, analyzer):
+    _index_batch(batch, analyzer=analyzer).flush(path)
+    return path
+
+
+def _pool_map(fn, tasks, workers):
+    """Like Executor.map, but keeps at most 2 * workers tasks in flight so the input stays streamed."""
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as pool:
+        pending = set()
+        for args in tasks:
+            pending.add(pool.submit(fn, *args))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in wait(pending).done:
+            yield future.result()
+
+
+def build_index(books, workers=None, batch_size=32, positional=True, analyzer=None):
+    """Index (doc_id, text) pairs across a process pool into partial indexes, appending each one to the
+    result as soon as it is done. Batches hold distinct documents, so a term's lists from two batches are
+    concatenated without decoding; a list whose batches finished out of doc id order is reordered entry by
+    entry at the end, still without decoding positions."""
+    final = PositionalInvertedIndex(analyzer) if positional else SimpleInvertedIndex(analyzer)
+    tasks = ((batch, positional, analyzer) for batch in _batches(books, batch_size))
+    for packed, doc_stats in _pool_map(_partial_run, tasks, workers):
+        final.add_run(packed, doc_stats)
+    final.settle()
+    return final
+
+
+def _run_terms(index, seq):
+    for term in index.terms():
+        yield term, seq
+
+
+def _run_postings(cursor, seq, deleted=None):
+    while cursor.next() != END:
+        if deleted is None or cursor.doc not in deleted:
+            yield cursor.doc, seq, cursor.positions()
+
+
+def _latest(postings):
+    for _, versions in groupby(postings, key=itemgetter(0)):
+        *_, (doc_id, _, positions) = versions
+        yield doc_id, positions
+
+
+def merge_into(add, sources):
+    """K-way merge of positional indexes into `add(term, postings)`.
+
+    `sources` holds (index, deleted) pairs; deleted documents are dropped and on duplicate doc ids the later
+    source wins."""
+    streams = [_run_terms(index, seq) for seq, (index, _) in enumerate(sources)]
+    for term, group in groupby(heapq.merge(*streams), key=itemgetter(0)):
+        runs = [_run_postings(sources[seq][0].postings(term), seq, sources[seq][1]) for _, seq in group]
+        add(term, _latest(heapq.merge(*runs)))
+
+
+def merge_segments(paths, out):
+    """K-way merge of sorted segment runs; on duplicate doc ids the later run wins."""
+    segments = [Segment(p) for p in paths]
+    try:
+        with SegmentWriter(out) as writer:
+            merge_into(writer.add, [(seg, None) for seg in segments])
+    finally:
+        for seg in segments:
+            seg.close()
+    return out
+
+
+def build_segment(books, path, workers=None, batch_size=32, analyzer=None):
+    """Like build_index, but every shard is flushed as an on-disk run and the runs are merged into `path`."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="runs-", dir=Path(path).parent) as tmp:
+        tasks = ((batch, os.path.join(tmp, f"run-{seq:06d}.seg"), analyzer)
+                 for seq, batch in enumerate(_batches(books, batch_size)))
+        runs = sorted(_pool_map(_segment_run, tasks, workers))
+        level = 0
+        while len(runs) > MERGE_FAN_IN:
+            runs = [merge_segments(runs[i:i + MERGE_FAN_IN], os.path.join(tmp, f"merge-{level}-{i:06d}.seg"))
+                    for i in range(0, len(runs), MERGE_FAN_IN)]
+            level += 1
+        merge_segments(runs, path)
+    return path
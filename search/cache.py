@@ -0,0 +1,69 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+OPERATORS = frozenset({"AND", "OR", "NOT", "NEAR"})
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_query(q):
+    # Terms are lowercased by the tokenizer anyway; AND, OR, NOT and NEAR/k stay as typed since they are operators.
+    return _WORD_RE.sub(lambda m: m[0] if m[0] in OPERATORS else m[0].lower(), " ".join(q.split()))
+
+
+class QueryCache:
+    """LRU cache of search results with an optional TTL.
+
+    Entries remember the index generation they were computed against and are dropped on lookup when it
+    no longer matches. Memory is bounded by `maxsize` entries and results longer than `max_hits` are not
+    stored at all."""
+
+    def __init__(self, maxsize=1024, ttl=None, max_hits=1000):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_hits = max_hits
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                gen, expires, value = entry
+                if gen == generation and (expires is None or expires > time.monotonic()):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, generation, value):
+        if self.maxsize <= 0 or len(value) > self.max_hits:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (generation, expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0
+        }
@@ -1,126 +1,283 @@
-import re
 from collections import defaultdict, Counter
-import math
 
-STOP_WORDS = {"the", "a", "an", "is", "are", "of", "and", "to", "in", "on", "for", "with", "that"}
+from search import phrase, ranking
+from search.analysis import ANALYZER
+from search.postings import ArrayPostings, DocStats, PostingList, intersect
+from search.segment import SegmentWriter
+from shared.metrics import METRICS
 
 class SimpleInvertedIndex:
-    
-    def __init__(self):
-        self.index = defaultdict(Counter)
 
+    def __init__(self, analyzer=None):
+        self.analyzer = analyzer or ANALYZER
+        self.index = {}
+        self.doc_stats = DocStats()
+        self.generation = 0
+        self._terms = None
+
+    @property
+    def doc_count(self):
+        return len(self.doc_stats)
+
+    @property
+    def avg_doc_len(self):
+        return self.doc_stats.avg_length
+
+    def doc_len(self, doc_id):
+        return self.doc_stats.length(doc_id)
+
+    def doc_norm(self, doc_id):
+        return self.doc_stats.norm(doc_id)
+
+    def has_doc(self, doc_id):
+        return doc_id in self.doc_stats
+
+    def doc_ids(self):
+        return iter(self.doc_stats)
+
+    def terms(self):
+        # The sorted vocabulary is kept until a term is added or dropped.
+        if self._terms is None:
+            self._terms = sorted(self.index)
+        return iter(self._terms)
+
+    @METRICS.timed("index_document_seconds")
     def index_document(self, doc_id, text):
-        words = re.findall(r"\w+", text.lower())
-        for word in words:
-            if word not in STOP_WORDS:
-                self.index[word][doc_id] += 1
+        for word, tf in Counter(self.analyzer.terms(text)).items():
+            self.add_postings(word, [(doc_id, tf)])
+        self.doc_stats.add(doc_id)
+        METRICS.inc("docs_indexed_total")
+
+    def delete_document(self, doc_id):
+        # Postings are keyed by term, so removal walks the vocabulary; LiveIndex keeps this to a small delta.
+        if doc_id not in self.doc_stats:
+            return False
+        for term in [t for t, plist in self.index.items() if plist.remove(doc_id) and not plist.docs]:
+            del self.index[term]
+            self._terms = None
+        self.doc_stats.remove(doc_id)
+        self.generation += 1
+        return True
+
+    def update_document(self, doc_id, text):
+        self.delete_document(doc_id)
+        self.index_document(doc_id, text)
+
+    def add_postings(self, term, postings):
+        plist = self.index.get(term)
+        if plist is None:
+            plist = PostingList()
+        for doc_id, tf in postings:
+            plist.append(doc_id, tf)
+            self.doc_stats.add(doc_id, tf)
+        if plist.docs and term not in self.index:
+            self.index[term] = plist
+            self._terms = None
+        self.generation += 1
+
+    def settle(self):
+        # Folds pending out-of-order appends and caches the vocabulary, so later reads change nothing.
+        for plist in self.index.values():
+            plist.settle()
+        self.terms()
+
+    def add_run(self, packed, doc_stats):
+        # Postings of other documents, indexed elsewhere and packed (see builder.build_index), appended
+        # still encoded.
+        terms, ends, _, max_tfs, docs, tfs, _, _ = packed
+        start = 0
+        for term, end, max_tf in zip(terms, ends, max_tfs):
+            plist = self.index.get(term)
+            if plist is None:
+                plist = self.index[term] = PostingList()
+                self._terms = None
+            plist.extend(docs[start:end], tfs[start:end], max_tf)
+            start = end
+        self.doc_stats.update(doc_stats)
+        self.generation += 1
+
+    def doc_freq(self, term):
+        plist = self.index.get(term)
+        return len(plist) if plist is not None else 0
+
+    def iter_postings(self, term):
+        plist = self.index.get(term)
+        return plist.items() if plist is not None else iter(())
+
+    def postings(self, term):
+        plist = self.index.get(term)
+        return ArrayPostings(plist) if plist is not None else None
 
     def boolean_or(self, terms):
         result = set()
         for term in terms:
             if term in self.index:
-                result.update(self.index[term].keys())
+                result.update(self.index.get(term).doc_ids())
         return result
 
     def boolean_and(self, terms):
-        sets = [set(self.index[t].keys()) for t in terms if t in self.index]
-        if not sets:
-            return set()
-        return set.intersection(*sets)
+        cursors = [c for c in (self.postings(t) for t in terms) if c is not None]
+        return set(intersect(cursors))
 
     def tf_idf_score(self, terms, topk=10):
-        doc_scores = Counter()
-        N = len({doc for docs in self.index.values() for doc in docs})
-        for term in terms:
-            if term not in self.index:
-                continue
-            df = len(self.index[term])
-            idf = math.log((N + 1) / (df + 1)) + 1
-            for doc_id, tf in self.index[term].items():
-                doc_scores[doc_id] += tf * idf
-        return doc_scores.most_common(topk)
+        return ranking.tf_idf_score(self, terms, topk)
 
     def stats(self):
-        total_terms = sum(sum(docs.values()) for docs in self.index.values())
-        unique_docs = {doc for docs in self.index.values() for doc in docs}
         return {
-            "docs_indexed": len(unique_docs),
+            "docs_indexed": self.doc_count,
             "unique_terms": len(self.index),
-            "total_occurrences": total_terms
+            "total_occurrences": self.doc_stats.total
         }
 
     def debug_print(self, limit=10):
         print(f"\n=== DEBUG: Primeras {limit} palabras en el índice simple ===")
-        for i, (word, docs) in enumerate(self.index.items()):
+        for i, (word, plist) in enumerate(self.index.items()):
             if i >= limit:
                 break
-            print(f"{word} -> {dict(docs)}")
+            print(f"{word} -> {dict(plist.items())}")
 
 
 class PositionalInvertedIndex:
-    
-    def __init__(self):
-        self.index = defaultdict(lambda: defaultdict(list))
 
+    def __init__(self, analyzer=None):
+        self.analyzer = analyzer or ANALYZER
+        self.index = {}
+        self.doc_stats = DocStats()
+        self.generation = 0
+        self._terms = None
+
+    @property
+    def doc_count(self):
+        return len(self.doc_stats)
+
+    @property
+    def avg_doc_len(self):
+        return self.doc_stats.avg_length
+
+    def doc_len(self, doc_id):
+        return self.doc_stats.length(doc_id)
+
+    def doc_norm(self, doc_id):
+        return self.doc_stats.norm(doc_id)
+
+    def has_doc(self, doc_id):
+        return doc_id in self.doc_stats
+
+    def doc_ids(self):
+        return iter(self.doc_stats)
+
+    def terms(self):
+        # The sorted vocabulary is kept until a term is added or dropped.
+        if self._terms is None:
+            self._terms = sorted(self.index)
+        return iter(self._terms)
+
+    @METRICS.timed("index_document_seconds")
     def index_document(self, doc_id, text):
-        words = re.findall(r"\w+", text.lower())
-        for pos, word in enumerate(words):
-            if word not in STOP_WORDS:
-                self.index[word][doc_id].append(pos)
+        positions = defaultdict(list)
+        for pos, word in self.analyzer.analyze(text):
+            positions[word].append(pos)
+        for word, plist in positions.items():
+            self.add_postings(word, [(doc_id, plist)])
+        self.doc_stats.add(doc_id)
+        METRICS.inc("docs_indexed_total")
+
+    def delete_document(self, doc_id):
+        # Postings are keyed by term, so removal walks the vocabulary; LiveIndex keeps this to a small delta.
+        if doc_id not in self.doc_stats:
+            return False
+        for term in [t for t, plist in self.index.items() if plist.remove(doc_id) and not plist.docs]:
+            del self.index[term]
+            self._terms = None
+        self.doc_stats.remove(doc_id)
+        self.generation += 1
+        return True
+
+    def update_document(self, doc_id, text):
+        self.delete_document(doc_id)
+        self.index_document(doc_id, text)
+
+    def add_postings(self, term, postings):
+        plist = self.index.get(term)
+        if plist is None:
+            plist = PostingList(positional=True)
+        for doc_id, positions in postings:
+            plist.append(doc_id, len(positions), positions)
+            self.doc_stats.add(doc_id, len(positions))
+        if plist.docs and term not in self.index:
+            self.index[term] = plist
+            self._terms = None
+        self.generation += 1
+
+    def settle(self):
+        # Folds pending out-of-order appends and caches the vocabulary, so later reads change nothing.
+        for plist in self.index.values():
+            plist.settle()
+        self.terms()
+
+    def add_run(self, packed, doc_stats):
+        # Postings of other documents, indexed elsewhere and packed (see builder.build_index), appended
+        # still encoded.
+        terms, ends, blob_ends, max_tfs, docs, tfs, offsets, blob = packed
+        start = blob_start = 0
+        for term, end, blob_end, max_tf in zip(terms, ends, blob_ends, max_tfs):
+            plist = self.index.get(term)
+            if plist is None:
+                plist = self.index[term] = PostingList(positional=True)
+                self._terms = None
+            plist.extend(docs[start:end], tfs[start:end], max_tf, offsets[start:end], blob[blob_start:blob_end])
+            start, blob_start = end, blob_end
+        self.doc_stats.update(doc_stats)
+        self.generation += 1
+
+    def doc_freq(self, term):
+        plist = self.index.get(term)
+        return len(plist) if plist is not None else 0
+
+    def iter_postings(self, term):
+        plist = self.index.get(term)
+        return plist.items() if plist is not None else iter(())
+
+    def postings(self, term):
+        plist = self.index.get(term)
+        return ArrayPostings(plist) if plist is not None else None
 
     def boolean_or(self, terms):
         result = set()
         for term in terms:
             if term in self.index:
-                result.update(self.index[term].keys())
+                result.update(self.index.get(term).doc_ids())
         return result
 
     def boolean_and(self, terms):
-        sets = [set(self.index[t].keys()) for t in terms if t in self.index]
-        if not sets:
-            return set()
-        return set.intersection(*sets)
+        cursors = [c for c in (self.postings(t) for t in terms) if c is not None]
+        return set(intersect(cursors))
 
     def tf_idf_score(self, terms, topk=10):
-        doc_scores = Counter()
-        N = len({doc for docs in self.index.values() for doc in docs})
-        for term in terms:
-            if term not in self.index:
-                continue
-            df = len(self.index[term])
-            idf = math.log((N + 1) / (df + 1)) + 1
-            for doc_id, positions in self.index[term].items():
-                tf = len(positions)
-                doc_scores[doc_id] += tf * idf
-        return doc_scores.most_common(topk)
-
-    def phrase_search(self, phrase):
-        words = re.findall(r"\w+", phrase.lower())
-        if not words:
-            return []
-        if any(word not in self.index for word in words):
-            return []
-
-        first_word_docs = self.index[words[0]]
-        results = Counter()
-        for doc_id, first_positions in first_word_docs.items():
-            for pos in first_positions:
-                if all((pos + i) in self.index[words[i]].get(doc_id, []) for i in range(1, len(words))):
-                    results[doc_id] += 1
-        return results.most_common()
+        return ranking.tf_idf_score(self, terms, topk)
+
+    def phrase_search(self, text, slop=0):
+        return phrase.phrase_search(self, text, slop)
+
+    def proximity_search(self, terms, k):
+        return phrase.near_search(self, terms, k)
+
+    def flush(self, path):
+        with SegmentWriter(path) as writer:
+            for term in self.terms():
+                writer.add(term, self.iter_postings(term))
+        return path
 
     def stats(self):
-        total_positions = sum(len(pos_list) for docs in self.index.values() for pos_list in docs.values())
-        unique_docs = {doc for docs in self.index.values() for doc in docs}
         return {
-            "docs_indexed": len(unique_docs),
+            "docs_indexed": self.doc_count,
             "unique_terms": len(self.index),
-            "total_occurrences": total_positions
+            "total_occurrences": self.doc_stats.total
         }
 
     def debug_print(self, limit=5):
         print(f"\n=== DEBUG: Primeras {limit} palabras en el índice posicional ===")
-        for i, (word, docs) in enumerate(self.index.items()):
+        for i, (word, plist) in enumerate(self.index.items()):
             if i >= limit:
                 break
-            print(f"{word} -> {{ {', '.join(f'{doc}: {positions[:5]}' for doc, positions in docs.items())} }}")
+            print(f"{word} -> {{ {', '.join(f'{doc}: {positions[:5]}' for doc, positions in plist.items())} }}")
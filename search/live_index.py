@@ -0,0 +1,231 @@
+import heapq
+import threading
+from itertools import groupby
+from pathlib import Path
+
+from search import phrase, ranking
+from search.analysis import ANALYZER
+from search.builder import merge_into
+from search.indexer import PositionalInvertedIndex
+from search.postings import END, Bitmap, LivePostings, intersect
+from search.segment import Segment, SegmentWriter
+
+
+class LiveIndex:
+    """A base index (segment or in-memory) kept fresh by an in-memory delta and a deletion bitmap.
+
+    Updates and deletes never touch the base: the old copy is tombstoned and the new text goes into the
+    delta. compact() freezes the delta and folds it into a new base on a background thread while queries
+    keep reading base + frozen delta + new delta."""
+
+    def __init__(self, base=None, directory=None, max_delta_docs=1000, analyzer=None):
+        self.analyzer = analyzer or getattr(base, "analyzer", None) or ANALYZER
+        self.base = base if base is not None else PositionalInvertedIndex(self.analyzer)
+        self.directory = Path(directory) if directory else None
+        self.max_delta_docs = max_delta_docs
+        self.delta = PositionalInvertedIndex(self.analyzer)
+        self.deleted = Bitmap()
+        self.generation = 0
+        self._frozen = None
+        self._base_deleted = Bitmap()
+        self._dead_len = 0
+        self._compactor = None
+        self.compaction_error = None
+        self._owned = set()
+        self._lock = threading.RLock()
+
+    def _sources(self):
+        sources = [(self.base, (self._base_deleted, self.deleted))]
+        if self._frozen is not None:
+            sources.append((self._frozen, (self.deleted,)))
+        sources.append((self.delta, ()))
+        return sources
+
+    def _owner(self, doc_id):
+        for index, deleted in reversed(self._sources()):
+            if index.has_doc(doc_id) and not any(doc_id in d for d in deleted):
+                return index
+        return None
+
+    def has_doc(self, doc_id):
+        with self._lock:
+            return self._owner(doc_id) is not None
+
+    def _delete(self, doc_id):
+        owner = self._owner(doc_id)
+        if owner is None:
+            return False
+        if owner is self.delta:
+            self.delta.delete_document(doc_id)
+        else:
+            self.deleted.add(doc_id)
+            self._dead_len += owner.doc_len(doc_id)
+        return True
+
+    def delete_document(self, doc_id):
+        with self._lock:
+            found = self._delete(doc_id)
+            if found:
+                self.generation += 1
+            return found
+
+    def update_document(self, doc_id, text):
+        with self._lock:
+            self._delete(doc_id)
+            self.delta.index_document(doc_id, text)
+            self.generation += 1
+            full = self.delta.doc_count >= self.max_delta_docs
+        if full:
+            self.compact()
+
+    index_document = update_document
+
+    def compact(self, wait=False):
+        with self._lock:
+            # A frozen delta is only cleared once its compaction has landed or been rolled back.
+            if self._frozen is None and (self._compactor is None or not self._compactor.is_alive()):
+                if not self.delta.doc_count and not len(self.deleted):
+                    return None
+                self._frozen, self.delta = self.delta, PositionalInvertedIndex(self.analyzer)
+                self._base_deleted, self.deleted = self.deleted, Bitmap()
+                # The compactor reads the frozen delta and the base without the lock; settle them now so
+                # that queries reading them meanwhile never reorder their posting lists under it.
+                for index in (self.base, self._frozen):
+                    if isinstance(index, PositionalInvertedIndex):
+                        index.settle()
+                self._compactor = threading.Thread(target=self._compact, name="index-compaction", daemon=True)
+                self._compactor.start()
+            thread = self._compactor
+        if wait:
+            thread.join()
+        return thread
+
+    def _compact(self):
+        try:
+            self._merge_frozen()
+        except Exception as e:
+            self._restore()
+            self.compaction_error = repr(e)
+        else:
+            self.compaction_error = None
+
+    def _restore(self):
+        # The merge failed: fold the frozen delta back into the live one, minus the documents replaced or
+        # deleted since, and keep only the tombstones that still hide a base document.
+        with self._lock:
+            delta = PositionalInvertedIndex(self.analyzer)
+            merge_into(delta.add_postings, [(self._frozen, self.deleted), (self.delta, None)])
+            deleted = Bitmap()
+            for doc_id in (*self._base_deleted, *self.deleted):
+                if self.base.has_doc(doc_id):
+                    deleted.add(doc_id)
+            self.delta, self.deleted, self._frozen, self._base_deleted = delta, deleted, None, Bitmap()
+            self._dead_len = sum(self.base.doc_len(d) for d in deleted)
+            self.generation += 1
+
+    def _merge_frozen(self):
+        sources = [(self.base, self._base_deleted), (self._frozen, None)]
+        if self.directory is not None:
+            path = self.directory / f"segment-{self.generation:08d}.seg"
+            with SegmentWriter(path) as writer:
+                merge_into(writer.add, sources)
+            merged = Segment(path)
+            self._owned.add(merged.path)
+        else:
+            merged = PositionalInvertedIndex(self.analyzer)
+            merge_into(merged.add_postings, sources)
+        with self._lock:
+            old = self.base
+            dead_len = sum(old.doc_len(d) for d in self._base_deleted)
+            self.base, self._frozen, self._base_deleted = merged, None, Bitmap()
+            self._dead_len = max(self._dead_len - dead_len, 0)
+            self.generation += 1
+        # Readers may still hold cursors on the old map, so the file is unlinked but never closed here.
+        if isinstance(old, Segment) and old.path in self._owned:
+            self._owned.discard(old.path)
+            old.path.unlink(missing_ok=True)
+
+    @property
+    def doc_count(self):
+        with self._lock:
+            return (sum(index.doc_count for index, _ in self._sources())
+                    - len(self._base_deleted) - len(self.deleted))
+
+    @property
+    def avg_doc_len(self):
+        with self._lock:
+            total = sum(index.avg_doc_len * index.doc_count for index, _ in self._sources()) - self._dead_len
+            count = self.doc_count
+            return total / count if count else 0.0
+
+    def doc_len(self, doc_id):
+        owner = self._owner(doc_id)
+        return owner.doc_len(doc_id) if owner is not None else 0
+
+    def doc_norm(self, doc_id):
+        owner = self._owner(doc_id)
+        return owner.doc_norm(doc_id) if owner is not None else 0.0
+
+    def doc_ids(self):
+        with self._lock:
+            return [d for index, deleted in self._sources() for d in index.doc_ids()
+                    if not any(d in b for b in deleted)]
+
+    def doc_freq(self, term):
+        return sum(index.doc_freq(term) for index, _ in self._sources())
+
+    def terms(self):
+        streams = [index.terms() for index, _ in self._sources()]
+        return (term for term, _ in groupby(heapq.merge(*streams)))
+
+    def postings(self, term):
+        parts = []
+        for index, deleted in self._sources():
+            cursor = index.postings(term)
+            if cursor is not None:
+                parts.append((cursor, deleted))
+        if not parts:
+            return None
+        cursor = LivePostings(parts)
+        # Tombstoned postings still count towards df until compaction; never let it exceed N.
+        cursor.df = min(cursor.df, self.doc_count)
+        return cursor
+
+    def boolean_or(self, terms):
+        result = set()
+        with self._lock:
+            for term in terms:
+                cursor = self.postings(term)
+                if cursor is not None:
+                    while cursor.next() != END:
+                        result.add(cursor.doc)
+        return result
+
+    def boolean_and(self, terms):
+        with self._lock:
+            cursors = [c for c in (self.postings(t) for t in terms) if c is not None]
+            return set(intersect(cursors))
+
+    def tf_idf_score(self, terms, topk=10):
+        with self._lock:
+            return ranking.tf_idf_score(self, terms, topk)
+
+    def phrase_search(self, text, slop=0):
+        with self._lock:
+            return phrase.phrase_search(self, text, slop)
+
+    def proximity_search(self, terms, k):
+        with self._lock:
+            return phrase.near_search(self, terms, k)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "docs_indexed": self.doc_count,
+                "unique_terms": sum(1 for _ in self.terms()),
+                "total_occurrences": round(self.avg_doc_len * self.doc_count),
+                "delta_docs": self.delta.doc_count,
+                "deleted_docs": len(self.deleted) + len(self._base_deleted),
+                "generation": self.generation,
+                "compaction_error": self.compaction_error
+            }
@@ -0,0 +1,119 @@
+import heapq
+from bisect import bisect_left
+from collections import Counter
+
+from search.analysis import ANALYZER
+from search.postings import intersect
+from shared.metrics import METRICS
+
+
+def gallop(seq, target, lo=0):
+    """Index of the first element >= target at or after `lo`, probing 1, 2, 4, ... ahead before bisecting."""
+    n, step, hi = len(seq), 1, lo
+    while hi < n and seq[hi] < target:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect_left(seq, target, lo, min(hi, n))
+
+
+def count_exact(lists, offsets):
+    """Occurrences of the phrase, anchored on the shortest position list."""
+    rare = min(range(len(lists)), key=lambda i: len(lists[i]))
+    cursor = [0] * len(lists)
+    count = 0
+    for p in lists[rare]:
+        start = p - offsets[rare]
+        for i, seq in enumerate(lists):
+            if i == rare:
+                continue
+            want = start + offsets[i]
+            j = cursor[i] = gallop(seq, want, cursor[i])
+            if j == len(seq):
+                return count
+            if seq[j] != want:
+                break
+        else:
+            count += 1
+    return count
+
+
+def count_sloppy(lists, offsets, slop):
+    """In-order occurrences whose span differs from the phrase span by at most `slop` positions."""
+    expected = offsets[-1] - offsets[0]
+    cursor = [0] * len(lists)
+    count = 0
+    for p in lists[0]:
+        prev = p
+        for i in range(1, len(lists)):
+            j = cursor[i] = gallop(lists[i], prev + 1, cursor[i])
+            if j == len(lists[i]):
+                return count
+            prev = lists[i][j]
+        if abs(prev - p - expected) <= slop:
+            count += 1
+    return count
+
+
+def count_near(lists, k):
+    """Windows of at most `k` positions holding every term, in any order."""
+    heap = [(seq[0], i, 0) for i, seq in enumerate(lists)]
+    heapq.heapify(heap)
+    hi = max(seq[0] for seq in lists)
+    count = 0
+    while True:
+        lo, i, j = heap[0]
+        if hi - lo <= k:
+            count += 1
+        j += 1
+        if j == len(lists[i]):
+            return count
+        nxt = lists[i][j]
+        hi = max(hi, nxt)
+        heapq.heapreplace(heap, (nxt, i, j))
+
+
+def phrase_counter(offsets, slop=0):
+    """Counts the occurrences of a phrase, given the position lists of its terms at these offsets."""
+    if len(offsets) == 1:
+        return lambda lists: len(lists[0])
+    if slop:
+        return lambda lists: count_sloppy(lists, offsets, slop)
+    return lambda lists: count_exact(lists, offsets)
+
+
+def _matches(index, terms, count):
+    cursors = {}
+    for term in terms:
+        if term not in cursors:
+            cursor = index.postings(term)
+            if cursor is None:
+                return []
+            cursors[term] = cursor
+    if METRICS.active:
+        METRICS.inc("postings_scanned_total", sum(getattr(c, "_n", c.df) for c in cursors.values()))
+    results, checked = Counter(), 0
+    for doc_id in intersect(list(cursors.values())):
+        checked += 1
+        positions = {term: c.positions() for term, c in cursors.items()}
+        if n := count([positions[t] for t in terms]):
+            results[doc_id] = n
+    METRICS.inc("docs_scored_total", checked)
+    return results.most_common()
+
+
+@METRICS.timed("phrase_search_seconds")
+def phrase_search(index, phrase, slop=0):
+    pairs = getattr(index, "analyzer", ANALYZER).phrase_terms(phrase)
+    if not pairs:
+        return []
+    terms = [term for _, term in pairs]
+    return _matches(index, terms, phrase_counter([offset for offset, _ in pairs], slop))
+
+
+@METRICS.timed("near_search_seconds")
+def near_search(index, terms, k):
+    terms = list(dict.fromkeys(terms))
+    if not terms:
+        return []
+    return _matches(index, terms, lambda lists: count_near(lists, k))
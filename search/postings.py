@@ -0,0 +1,359 @@
+import math
+from array import array
+from bisect import bisect_left
+
+END = float("inf")
+
+
+def encode_varint(value, out):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(buf, off):
+    result = shift = 0
+    while True:
+        b = buf[off]
+        off += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, off
+        shift += 7
+
+
+def intersect(cursors):
+    """Leapfrog intersection over posting cursors exposing `doc`, `next()` and `advance(target)`."""
+    if not cursors:
+        return
+    cursors = sorted(cursors, key=lambda c: c.df)
+    for c in cursors:
+        c.next()
+    target = max(c.doc for c in cursors)
+    while target != END:
+        for c in cursors:
+            if c.advance(target) != target:
+                target = c.doc
+                break
+        else:
+            yield target
+            target = cursors[0].next()
+
+
+def encode_positions(positions, out):
+    prev = 0
+    for pos in positions:
+        encode_varint(pos - prev, out)
+        prev = pos
+
+
+def decode_positions(buf, off, count):
+    positions, prev = [], 0
+    for _ in range(count):
+        delta, off = decode_varint(buf, off)
+        prev += delta
+        positions.append(prev)
+    return positions
+
+
+class PostingList:
+    """Postings of one term in flat arrays: sorted doc ids, term frequencies and, for positional lists,
+    per-document offsets into a bytearray of delta/varint-encoded positions.
+
+    Appends are cheap; a doc id that arrives out of order or twice only marks the list dirty, and the next
+    read sorts it and folds duplicates together (tfs are summed, positions merged)."""
+
+    __slots__ = ("docs", "tfs", "offsets", "blob", "max_tf", "dirty")
+
+    def __init__(self, positional=False):
+        self.docs = array("I")
+        self.tfs = array("I")
+        self.offsets = array("I") if positional else None
+        self.blob = bytearray() if positional else None
+        self.max_tf = 0
+        self.dirty = False
+
+    def __len__(self):
+        self.settle()
+        return len(self.docs)
+
+    def append(self, doc_id, tf, positions=None):
+        if self.docs and doc_id <= self.docs[-1]:
+            self.dirty = True
+        self.docs.append(doc_id)
+        self.tfs.append(tf)
+        if self.blob is not None:
+            self.offsets.append(len(self.blob))
+            encode_positions(positions, self.blob)
+        self.max_tf = max(self.max_tf, tf)
+
+    def doc_ids(self):
+        self.settle()
+        return self.docs
+
+    def positions(self, i):
+        return decode_positions(self.blob, self.offsets[i], self.tfs[i])
+
+    def items(self):
+        """(doc_id, tf) pairs, or (doc_id, positions) for positional lists, in doc id order."""
+        self.settle()
+        if self.blob is None:
+            return zip(self.docs, self.tfs)
+        return ((doc_id, self.positions(i)) for i, doc_id in enumerate(self.docs))
+
+    def extend(self, docs, tfs, max_tf, offsets=None, blob=None):
+        """Appends encoded postings as they are: doc id and tf arrays and, for positional lists, offsets
+        into `blob` of each document's encoded positions. An empty list takes the arrays over as they are."""
+        if not docs:
+            return
+        if not self.docs:
+            self.docs, self.tfs, self.max_tf = docs, tfs, max_tf
+            if self.blob is not None:
+                self.offsets, self.blob = offsets, blob
+            return
+        if docs[0] <= self.docs[-1]:
+            self.dirty = True
+        if self.blob is not None:
+            if self.blob:
+                offsets = map(len(self.blob).__add__, offsets)
+            self.offsets += array("I", offsets)
+            self.blob += blob
+        self.docs += docs
+        self.tfs += tfs
+        self.max_tf = max(self.max_tf, max_tf)
+
+    def settle(self):
+        if not self.dirty:
+            return
+        order = sorted(range(len(self.docs)), key=self.docs.__getitem__)
+        docs = array("I", (self.docs[i] for i in order))
+        if all(a != b for a, b in zip(docs, docs[1:])):
+            # Runs of distinct documents out of order (e.g. concatenated with extend): reorder whole
+            # entries, moving each one's encoded positions as they are.
+            self.tfs = array("I", (self.tfs[i] for i in order))
+            if self.blob is not None:
+                ends = self.offsets[1:] + array("I", [len(self.blob)])
+                blob, offsets = bytearray(), array("I")
+                for i in order:
+                    offsets.append(len(blob))
+                    blob += self.blob[self.offsets[i]:ends[i]]
+                self.offsets, self.blob = offsets, blob
+            self.docs, self.dirty = docs, False
+            return
+        merged = {}
+        for i, doc_id in enumerate(self.docs):
+            if self.blob is None:
+                merged[doc_id] = merged.get(doc_id, 0) + self.tfs[i]
+            else:
+                merged.setdefault(doc_id, []).extend(self.positions(i))
+        self.docs, self.tfs, self.max_tf, self.dirty = array("I"), array("I"), 0, False
+        if self.blob is not None:
+            self.offsets, self.blob = array("I"), bytearray()
+        for doc_id in sorted(merged):
+            value = merged[doc_id]
+            if self.blob is None:
+                self.append(doc_id, value)
+            else:
+                self.append(doc_id, len(value), sorted(value))
+
+    def remove(self, doc_id):
+        self.settle()
+        i = bisect_left(self.docs, doc_id)
+        if i == len(self.docs) or self.docs[i] != doc_id:
+            return False
+        tf = self.tfs[i]
+        del self.docs[i]
+        del self.tfs[i]
+        if self.blob is not None:
+            start = self.offsets[i]
+            end = self.offsets[i + 1] if i + 1 < len(self.offsets) else len(self.blob)
+            del self.blob[start:end]
+            del self.offsets[i]
+            for j in range(i, len(self.offsets)):
+                self.offsets[j] -= end - start
+        if tf == self.max_tf:
+            self.max_tf = max(self.tfs, default=0)
+        return True
+
+
+def pack_lists(items):
+    """Packs (term, PostingList) pairs into a few flat arrays, cheap to pickle between processes: the
+    terms, each one's end in the concatenated doc id/tf/offset arrays and in the concatenated position
+    blob, and each one's max tf. Offsets stay relative to their own list's part of the blob."""
+    terms, ends, blob_ends, max_tfs = [], array("I"), array("Q"), array("I")
+    docs, tfs, offsets, blob = array("I"), array("I"), array("I"), bytearray()
+    for term, plist in items:
+        plist.settle()
+        terms.append(term)
+        docs += plist.docs
+        tfs += plist.tfs
+        ends.append(len(docs))
+        max_tfs.append(plist.max_tf)
+        if plist.blob is not None:
+            offsets += plist.offsets
+            blob += plist.blob
+        blob_ends.append(len(blob))
+    return terms, ends, blob_ends, max_tfs, docs, tfs, offsets, blob
+
+
+class ArrayPostings:
+    """Cursor over a PostingList; `advance` bisects the doc id array."""
+
+    def __init__(self, plist):
+        plist.settle()
+        self._n = self.df = len(plist.docs)
+        self.max_tf = plist.max_tf
+        self._list = plist
+        self._i = -1
+        self.doc, self.tf = -1, 0
+
+    def _load(self):
+        if self._i >= self._n:
+            self.doc = END
+            return END
+        self.doc = self._list.docs[self._i]
+        self.tf = self._list.tfs[self._i]
+        return self.doc
+
+    def next(self):
+        self._i += 1
+        return self._load()
+
+    def advance(self, target):
+        if self.doc >= target:
+            return self.doc
+        self._i = bisect_left(self._list.docs, target, self._i + 1)
+        return self._load()
+
+    def positions(self):
+        return self._list.positions(self._i)
+
+
+class DocStats:
+    """Per-document token length and squared lnc norm, kept in flat arrays addressed by a doc_id -> slot map."""
+
+    def __init__(self):
+        self.slots = {}
+        self.lengths = array("I")
+        self.norms = array("d")
+        self.total = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.slots
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def add(self, doc_id, tf=0):
+        slot = self.slots.get(doc_id)
+        if slot is None:
+            slot = self.slots[doc_id] = len(self.lengths)
+            self.lengths.append(0)
+            self.norms.append(0.0)
+        if tf:
+            self.lengths[slot] += tf
+            self.norms[slot] += (1 + math.log(tf)) ** 2
+            self.total += tf
+
+    def update(self, other):
+        """Adds the documents of another DocStats; a document in both adds up, as if indexed in two parts."""
+        for doc_id, slot in other.slots.items():
+            mine = self.slots.get(doc_id)
+            if mine is None:
+                mine = self.slots[doc_id] = len(self.lengths)
+                self.lengths.append(0)
+                self.norms.append(0.0)
+            self.lengths[mine] += other.lengths[slot]
+            self.norms[mine] += other.norms[slot]
+        self.total += other.total
+
+    def length(self, doc_id):
+        slot = self.slots.get(doc_id)
+        return 0 if slot is None else self.lengths[slot]
+
+    def norm(self, doc_id):
+        slot = self.slots.get(doc_id)
+        return 0.0 if slot is None else math.sqrt(self.norms[slot])
+
+    @property
+    def avg_length(self):
+        return self.total / len(self.slots) if self.slots else 0.0
+
+    def remove(self, doc_id):
+        slot = self.slots.pop(doc_id, None)
+        if slot is not None:
+            self.total -= self.lengths[slot]
+            self.lengths[slot] = 0
+            self.norms[slot] = 0.0
+
+
+class Bitmap:
+    """Growable bitset over non-negative integer doc ids."""
+
+    def __init__(self):
+        self._bits = bytearray()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, n):
+        byte = n >> 3
+        return byte < len(self._bits) and bool(self._bits[byte] & (1 << (n & 7)))
+
+    def __iter__(self):
+        for byte, value in enumerate(self._bits):
+            if value:
+                for bit in range(8):
+                    if value & (1 << bit):
+                        yield (byte << 3) | bit
+
+    def add(self, n):
+        byte = n >> 3
+        if byte >= len(self._bits):
+            self._bits.extend(bytes(byte - len(self._bits) + 1))
+        if not self._bits[byte] & (1 << (n & 7)):
+            self._bits[byte] |= 1 << (n & 7)
+            self._count += 1
+
+
+class LivePostings:
+    """Merges cursors over disjoint document sets, hiding documents marked in their deletion bitmaps."""
+
+    def __init__(self, parts):
+        self._parts = parts
+        self.df = sum(c.df for c, _ in parts)
+        self.max_tf = max(c.max_tf for c, _ in parts)
+        self._cur = None
+        self.doc, self.tf = -1, 0
+
+    def _settle(self):
+        best = None
+        for c, deleted in self._parts:
+            while c.doc != END and any(c.doc in d for d in deleted):
+                c.next()
+            if best is None or c.doc < best.doc:
+                best = c
+        self._cur = best
+        self.doc, self.tf = best.doc, best.tf
+        return self.doc
+
+    def next(self):
+        for c, _ in self._parts:
+            if c.doc == self.doc:
+                c.next()
+        return self._settle()
+
+    def advance(self, target):
+        if self.doc >= target:
+            return self.doc
+        for c, _ in self._parts:
+            c.advance(target)
+        return self._settle()
+
+    def positions(self):
+        return self._cur.positions()
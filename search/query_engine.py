@@ -1,31 +1,148 @@
 import re
-from repository import tokenize
+from search import ranking, snippets
+from search.analysis import ANALYZER
+from search.boolean import boolean_search
+from search.vocabulary import MAX_EXPANSIONS, Vocabulary, is_pattern
+from shared.metrics import METRICS
+from search.cache import QueryCache, normalize_query
+
+PHRASE_RE = re.compile(r'^"([^"]*)"(?:~(\d+))?$')
+NEAR_RE = re.compile(r'\s+NEAR/(\d+)\s+')
+# Field names are matched in any case, as boolean.parse does; operators only in capitals. Queries that
+# normalize_query maps to one cache key must land in the same branch.
+BOOLEAN_RE = re.compile(r'\b(?:AND|OR|NOT)\b|[()"]|(?:^|\s)-\S|\b(?i:body|header):\S')
+
+def query_kind(q, method='tfidf'):
+    """Which branch of QueryEngine.search answers `q`: phrase, near, boolean or ranked."""
+    q = q.strip()
+    if PHRASE_RE.match(q):
+        return "phrase"
+    if NEAR_RE.search(q):
+        return "near"
+    if method == 'boolean' or BOOLEAN_RE.search(q):
+        return "boolean"
+    return "ranked"
 
 class QueryEngine:
-    def __init__(self, pos_idx, simple_idx, repo):
+    def __init__(self, pos_idx, simple_idx, repo, header_idx=None, cache_size=1024, cache_ttl=None, analyzer=None,
+                 max_expansions=MAX_EXPANSIONS):
+        self.analyzer = analyzer or getattr(pos_idx, "analyzer", ANALYZER)
         self.pos = pos_idx
         self.simple = simple_idx
         self.repo = repo
+        self.header = header_idx
+        self.cache = QueryCache(cache_size, cache_ttl)
+        self.max_expansions = max_expansions
+        self._vocabularies = {}
 
-    def search(self, q, method='tfidf', topk=10):
-        q = q.strip()
+    def generation(self):
+        # Any write to an index bumps its generation, which invalidates everything cached before it.
+        return tuple(getattr(idx, "generation", 0) for idx in (self.pos, self.simple, self.header))
+
+    def _hit(self, doc_id, terms, score=None, matches=None):
+        hit = {"doc_id": doc_id}
+        if score is not None:
+            hit["score"] = score
+        if matches is not None:
+            hit["matches"] = matches
+        with METRICS.stage("snippet"):
+            hit["text"] = snippets.snippet(self.repo, self.pos, doc_id, terms, analyzer=self.analyzer)
+        return hit
+
+    def stats(self):
+        return self.pos.stats()
+
+    def fields(self):
+        fields = {"body": self.pos}
+        if self.header is not None:
+            fields["header"] = self.header
+        return fields
+
+    def vocabulary(self, field="body"):
+        """Vocabulary of a field's index, rebuilt once the index has changed."""
+        idx = self.fields()[field]
+        generation = getattr(idx, "generation", 0)
+        cached = self._vocabularies.get(field)
+        if cached is None or cached[0] != generation:
+            cached = self._vocabularies[field] = (generation, Vocabulary(idx.terms()))
+        return cached[1]
 
-        if m := re.match(r'^"(.*)"$', q):
-            return [{"doc_id": d, "text": self.repo.get(d)[:300]} for d, _ in self.pos.phrase_search(m[1])]
+    def expand(self, field, word):
+        """Terms of `field` a wildcard or fuzzy query word stands for; None for any other word, and for a
+        pattern nothing matches, which is then read as the plain word it spells."""
+        if not is_pattern(word):
+            return None
+        return self.vocabulary(field).expand(word, self.analyzer, self.max_expansions) or None
 
-        if " OR " in q:
-            terms = [w for t in q.split(" OR ") for w in tokenize(t)]
-            return [{"doc_id": d, "text": self.repo.get(d)[:300]} for d in self.simple.boolean_or(terms)]
+    def query_terms(self, q):
+        """Analyzed terms of a ranked query, wildcard and fuzzy words replaced by their expansions."""
+        words = q.split()
+        if not any(map(is_pattern, words)):
+            return self.analyzer.terms(q)
+        terms = []
+        for word in words:
+            expansion = self.expand("body", word)
+            terms.extend(self.analyzer.terms(word) if expansion is None else expansion)
+        return terms
 
-        terms = tokenize(q)
-        if method == 'boolean':
-            docs = self.pos.boolean_and(terms)
-            docs = [(d, 0) for d in docs]
+    def term_stats(self, terms):
+        """Per field: document count, total length and the df of each of `terms`. Summed over partitions,
+        these are the `stats` that make ranked search on one partition use corpus-wide idf."""
+        terms = set(terms)
+        return {
+            name: {
+                "doc_count": idx.doc_count,
+                "total_len": round(idx.avg_doc_len * idx.doc_count),
+                "df": {t: idx.doc_freq(t) for t in terms}
+            }
+            for name, idx in self.fields().items()
+        }
+
+    @METRICS.timed("query_seconds")
+    def search(self, q, method='tfidf', topk=10, stats=None):
+        """Hits for `q`. Wrap the call in METRICS.trace() to see the time spent per stage (tokenize, lookup,
+        score or match, snippet) and the postings it scanned."""
+        METRICS.inc("queries_total")
+        if stats is not None:
+            # Scores depend on the caller's statistics, so these bypass the cache.
+            return self._search(q, method, topk, stats)
+        key = (normalize_query(q), method, topk)
+        generation = self.generation()
+        hits = self.cache.get(key, generation)
+        if hits is None:
+            hits = self._search(q, method, topk)
+            self.cache.put(key, generation, hits)
         else:
-            docs = self.pos.tf_idf_score(terms, topk=topk)
+            METRICS.inc("query_cache_hits_total")
+        return [dict(hit) for hit in hits]
+
+    def _search(self, q, method, topk, stats=None):
+        q = q.strip()
+        kind = query_kind(q, method)
+
+        if kind == "phrase":
+            m = PHRASE_RE.match(q)
+            with METRICS.stage("match"):
+                hits = self.pos.phrase_search(m[1], slop=int(m[2] or 0))
+            return [self._hit(d, self.analyzer.terms(m[1]), matches=n) for d, n in hits]
+
+        if kind == "near":
+            with METRICS.stage("tokenize"):
+                parts = NEAR_RE.split(q)
+                terms = [w for t in parts[::2] for w in self.analyzer.terms(t)]
+            with METRICS.stage("match"):
+                hits = self.pos.proximity_search(terms, max(int(k) for k in parts[1::2]))
+            return [self._hit(d, terms, matches=n) for d, n in hits]
+
+        if kind == "boolean":
+            # Query language (AND/OR/NOT, parentheses, phrases, field:); see boolean.boolean_search.
+            docs, terms = boolean_search(self.fields(), q, expand=self.expand)
+            return [self._hit(d, terms) for d in docs]
 
-        return [
-            {"doc_id": d, "text": self.repo.get(d)[:300]} if method == 'boolean'
-            else {"doc_id": d, "score": s, "text": self.repo.get(d)[:300]}
-            for d, s in docs
-        ]
+        with METRICS.stage("tokenize"):
+            terms = self.query_terms(q)
+        fields = self.fields()
+        if stats is not None:
+            fields = {name: ranking.GlobalView(idx, stats[name]) for name, idx in fields.items()}
+        docs = ranking.rank(fields, terms, topk, method)
+        return [self._hit(d, terms, s) for d, s in docs]
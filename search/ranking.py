@@ -0,0 +1,265 @@
+import heapq
+import math
+from collections import Counter
+
+from search.postings import END
+from shared.metrics import METRICS
+
+
+def idf(N, df):
+    return math.log((N + 1) / (df + 1)) + 1
+
+
+def bm25_idf(N, df):
+    return math.log(1 + (N - df + 0.5) / (df + 0.5))
+
+
+class _TfIdfTerm:
+    __slots__ = ("cursor", "weight", "upper_bound")
+
+    def __init__(self, cursor, weight):
+        self.cursor = cursor
+        self.weight = weight
+        self.upper_bound = cursor.max_tf * weight
+
+    def score(self):
+        return self.cursor.tf * self.weight
+
+
+class _BM25Term:
+    __slots__ = ("cursor", "weight", "upper_bound", "k1", "b", "index", "avg_len")
+
+    def __init__(self, cursor, weight, k1, b, index):
+        self.cursor, self.weight, self.k1, self.b, self.index = cursor, weight, k1, b, index
+        self.avg_len = index.avg_doc_len or 1.0
+        # The saturation curve is steepest for the shortest possible document (length 0).
+        self.upper_bound = weight * (k1 + 1) * cursor.max_tf / (cursor.max_tf + k1 * (1 - b))
+
+    def score(self):
+        tf = self.cursor.tf
+        norm = self.k1 * (1 - self.b + self.b * self.index.doc_len(self.cursor.doc) / self.avg_len)
+        return self.weight * tf * (self.k1 + 1) / (tf + norm)
+
+
+class _CosineTerm:
+    __slots__ = ("cursor", "weight", "upper_bound", "index")
+
+    def __init__(self, cursor, weight, index):
+        self.cursor, self.weight, self.index = cursor, weight, index
+        # A document's own lnc component never exceeds its norm, so each term adds at most its query weight.
+        self.upper_bound = weight
+
+    def score(self):
+        norm = self.index.doc_norm(self.cursor.doc)
+        return self.weight * (1 + math.log(self.cursor.tf)) / norm if norm else 0.0
+
+
+class _FieldPostings:
+    """Union cursor over one term's postings in several field indexes."""
+
+    def __init__(self, cursors):
+        self.cursors = cursors
+        self.df = max(c.df for c in cursors.values())
+        self.doc = -1
+
+    def next(self):
+        for c in self.cursors.values():
+            if c.doc == self.doc:
+                c.next()
+        self.doc = min(c.doc for c in self.cursors.values())
+        return self.doc
+
+    def advance(self, target):
+        if self.doc >= target:
+            return self.doc
+        for c in self.cursors.values():
+            c.advance(target)
+        self.doc = min(c.doc for c in self.cursors.values())
+        return self.doc
+
+
+class _BM25FTerm:
+    __slots__ = ("cursor", "weight", "upper_bound", "k1", "fields")
+
+    def __init__(self, cursor, weight, k1, fields):
+        self.cursor, self.weight, self.k1 = cursor, weight, k1
+        self.fields = [(name, boost, b, index, index.avg_doc_len or 1.0) for name, boost, b, index in fields]
+        self.upper_bound = weight * (k1 + 1)
+
+    def score(self):
+        doc, tf = self.cursor.doc, 0.0
+        for name, boost, b, index, avg_len in self.fields:
+            c = self.cursor.cursors[name]
+            if c.doc == doc:
+                tf += boost * c.tf / (1 - b + b * index.doc_len(doc) / avg_len)
+        return self.weight * tf * (self.k1 + 1) / (tf + self.k1)
+
+
+class TfIdf:
+    """Raw tf * idf, the historical scoring of tf_idf_score."""
+    name = "tfidf"
+
+    def term(self, fields, term, qtf):
+        index = fields["body"]
+        cursor = index.postings(term)
+        if cursor is None:
+            return None
+        return _TfIdfTerm(cursor, qtf * idf(index.doc_count, cursor.df))
+
+
+class BM25:
+    name = "bm25"
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1, self.b = k1, b
+
+    def term(self, fields, term, qtf):
+        index = fields["body"]
+        cursor = index.postings(term)
+        if cursor is None:
+            return None
+        return _BM25Term(cursor, qtf * bm25_idf(index.doc_count, cursor.df), self.k1, self.b, index)
+
+
+class BM25F:
+    """BM25F over several field indexes (e.g. header and body) sharing one saturation.
+
+    idf is taken from the largest document frequency seen across the fields."""
+    name = "bm25f"
+
+    def __init__(self, weights=None, k1=1.2, b=0.75):
+        self.weights = weights or {"header": 2.0, "body": 1.0}
+        self.k1, self.b = k1, b
+
+    def term(self, fields, term, qtf):
+        cursors, used = {}, []
+        for name, index in fields.items():
+            cursor = index.postings(term)
+            if cursor is not None:
+                cursors[name] = cursor
+                used.append((name, self.weights.get(name, 1.0), self.b, index))
+        if not cursors:
+            return None
+        union = _FieldPostings(cursors)
+        N = max(index.doc_count for index in fields.values())
+        return _BM25FTerm(union, qtf * bm25_idf(N, union.df), self.k1, used)
+
+
+class TfIdfCosine:
+    """lnc.ltc cosine: log-tf document vectors normalised by their stored norm, log-tf * idf query."""
+    name = "cosine"
+
+    def query_weights(self, index, terms):
+        weights = {}
+        for term, qtf in Counter(terms).items():
+            df = index.doc_freq(term)
+            if df:
+                weights[term] = (1 + math.log(qtf)) * idf(index.doc_count, df)
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {term: w / norm for term, w in weights.items()}
+
+    def term(self, fields, term, weight):
+        cursor = fields["body"].postings(term)
+        return None if cursor is None else _CosineTerm(cursor, weight, fields["body"])
+
+
+class GlobalView:
+    """An index partition seen through corpus-wide statistics.
+
+    doc_count, avg_doc_len and document frequencies come from `stats` ({"doc_count", "total_len", "df"}
+    summed over every partition), so idf and length normalisation match a single index over the whole
+    corpus; postings and per-document values stay local."""
+
+    def __init__(self, index, stats):
+        self.index = index
+        self.doc_count = stats["doc_count"]
+        self.avg_doc_len = stats["total_len"] / stats["doc_count"] if stats["doc_count"] else 0.0
+        self.df = stats["df"]
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def doc_freq(self, term):
+        return self.df.get(term, 0)
+
+    def postings(self, term):
+        cursor = self.index.postings(term)
+        if cursor is not None:
+            cursor.df = self.df.get(term, cursor.df)
+        return cursor
+
+
+SCORERS = {cls.name: cls for cls in (TfIdf, BM25, BM25F, TfIdfCosine)}
+
+
+def get_scorer(method):
+    if method in SCORERS:
+        return SCORERS[method]()
+    if hasattr(method, "term"):
+        return method
+    raise ValueError(f"Unknown scoring method: {method!r}")
+
+
+def wand(scorers, topk=10):
+    """WAND dynamic pruning: a document is only scored once the upper bounds of the
+    terms positioned on or before it can beat the current k-th best score."""
+    if topk <= 0:
+        return []
+    heap, threshold, scored = [], 0.0, 0
+    for s in scorers:
+        s.cursor.next()
+    scorers = [s for s in scorers if s.cursor.doc != END]
+    while scorers:
+        scorers.sort(key=lambda s: s.cursor.doc)
+        bound, pivot = 0.0, None
+        for i, s in enumerate(scorers):
+            bound += s.upper_bound
+            if bound > threshold:
+                pivot = i
+                break
+        if pivot is None:
+            break
+        pivot_doc = scorers[pivot].cursor.doc
+        if scorers[0].cursor.doc == pivot_doc:
+            score = 0.0
+            scored += 1
+            for s in scorers:
+                if s.cursor.doc != pivot_doc:
+                    break
+                score += s.score()
+                s.cursor.next()
+            if len(heap) < topk:
+                heapq.heappush(heap, (score, -pivot_doc))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, -pivot_doc))
+            if len(heap) == topk:
+                threshold = heap[0][0]
+        else:
+            for s in scorers[:pivot]:
+                s.cursor.advance(pivot_doc)
+        scorers = [s for s in scorers if s.cursor.doc != END]
+    METRICS.inc("docs_scored_total", scored)
+    return [(-doc, score) for score, doc in sorted(heap, reverse=True)]
+
+
+def rank(fields, terms, topk=10, scorer="tfidf"):
+    """Top-k documents for `terms`; `fields` is an index or a {field name: index} mapping with a "body" entry."""
+    scorer = get_scorer(scorer)
+    if not isinstance(fields, dict):
+        fields = {"body": fields}
+    with METRICS.stage("lookup"):
+        if hasattr(scorer, "query_weights"):
+            weights = scorer.query_weights(fields["body"], terms)
+        else:
+            weights = Counter(terms)
+        scorers = [s for s in (scorer.term(fields, t, w) for t, w in weights.items()) if s is not None]
+    if METRICS.active:
+        # Length of the posting lists opened: an upper bound on the entries WAND reads.
+        METRICS.inc("postings_scanned_total", sum(getattr(s.cursor, "_n", s.cursor.df) for s in scorers))
+    with METRICS.stage("score"):
+        return wand(scorers, topk)
+
+
+@METRICS.timed("tf_idf_score_seconds")
+def tf_idf_score(index, terms, topk=10):
+    return rank(index, terms, topk, TfIdf())
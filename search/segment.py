@@ -0,0 +1,294 @@
+import math
+import mmap
+import os
+import struct
+from bisect import bisect_left
+from collections import Counter
+from pathlib import Path
+
+from search import phrase, ranking
+from search.postings import END, encode_varint, decode_varint, intersect
+
+# Layout: header | per-term [skip table | doc stream | position stream] | doc table | term table | term blob
+# Doc stream entries are varint(doc delta), varint(tf), varint(bytes of positions); positions are varint deltas.
+MAGIC = b"DSLJSEG1"
+BLOCK_SIZE = 128
+
+_HEADER = struct.Struct("<8sIIQQQQ")    # magic, n_terms, n_docs, total_len, docs_off, terms_off, blob_off
+_DOC = struct.Struct("<QId")            # doc_id, length, lnc norm
+_TERM = struct.Struct("<QIIIIQQ")       # blob_off, term_len, df, max_tf, n_blocks, skip_off, cf
+_SKIP = struct.Struct("<QQQI")          # last_doc, docs_off, pos_off, max_tf
+
+
+class SegmentWriter:
+    """Streams sorted terms into a write-once segment file; the file only appears once closed."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp = self.path.with_name(self.path.name + ".tmp")
+        self._out = open(self._tmp, "wb")
+        self._out.write(bytes(_HEADER.size))
+        self._off = _HEADER.size
+        self._terms = []
+        self._blob = bytearray()
+        self._doc_len = Counter()
+        self._doc_norm = Counter()
+        self._last_term = None
+
+    def add(self, term, postings):
+        """`postings` is an iterable of (doc_id, positions) sorted by doc_id."""
+        if self._last_term is not None and term <= self._last_term:
+            raise ValueError(f"terms must be added in sorted order: {term!r} after {self._last_term!r}")
+        docs, pos, skips = bytearray(), bytearray(), []
+        prev = df = cf = max_tf = block_tf = 0
+        for doc_id, positions in postings:
+            if df % BLOCK_SIZE == 0:
+                if df:
+                    skips[-1][0] = prev
+                    skips[-1][3] = block_tf
+                skips.append([0, len(docs), len(pos), 0])
+                block_tf = 0
+            start, last = len(pos), 0
+            for p in positions:
+                encode_varint(p - last, pos)
+                last = p
+            tf = len(positions)
+            encode_varint(doc_id - prev, docs)
+            encode_varint(tf, docs)
+            encode_varint(len(pos) - start, docs)
+            prev = doc_id
+            self._doc_len[doc_id] += tf
+            self._doc_norm[doc_id] += (1 + math.log(tf)) ** 2
+            df += 1
+            cf += tf
+            max_tf = max(max_tf, tf)
+            block_tf = max(block_tf, tf)
+        if not df:
+            return
+        skips[-1][0] = prev
+        skips[-1][3] = block_tf
+
+        skip_off = self._off
+        docs_off = skip_off + len(skips) * _SKIP.size
+        pos_off = docs_off + len(docs)
+        table = bytearray()
+        for last_doc, d, p, tf in skips:
+            table += _SKIP.pack(last_doc, docs_off + d, pos_off + p, tf)
+        self._out.write(table)
+        self._out.write(docs)
+        self._out.write(pos)
+        self._off = pos_off + len(pos)
+
+        encoded = term.encode("utf-8")
+        self._terms.append((len(self._blob), len(encoded), df, max_tf, len(skips), skip_off, cf))
+        self._blob += encoded
+        self._last_term = term
+
+    def close(self):
+        docs_off = self._off
+        for doc_id in sorted(self._doc_len):
+            self._out.write(_DOC.pack(doc_id, self._doc_len[doc_id], math.sqrt(self._doc_norm[doc_id])))
+        terms_off = docs_off + len(self._doc_len) * _DOC.size
+        for entry in self._terms:
+            self._out.write(_TERM.pack(*entry))
+        blob_off = terms_off + len(self._terms) * _TERM.size
+        self._out.write(self._blob)
+        self._out.seek(0)
+        self._out.write(_HEADER.pack(MAGIC, len(self._terms), len(self._doc_len),
+                                     sum(self._doc_len.values()), docs_off, terms_off, blob_off))
+        self._out.close()
+        os.replace(self._tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._out.close()
+            self._tmp.unlink(missing_ok=True)
+
+
+class SegmentPostings:
+    """Forward-only cursor over one term's postings, decoded straight from the mapped file."""
+
+    def __init__(self, buf, df, max_tf, n_blocks, skip_off):
+        # df is a scoring statistic (callers may overwrite it, e.g. with a corpus-wide value); _n bounds the walk.
+        self._n = self.df = df
+        self.max_tf = max_tf
+        self._buf = buf
+        self._skips = [_SKIP.unpack_from(buf, skip_off + i * _SKIP.size) for i in range(n_blocks)]
+        self._last_docs = [s[0] for s in self._skips]
+        self._i = 0
+        self._off, self._next_pos = self._skips[0][1], self._skips[0][2]
+        self._pos = self._next_pos
+        self.doc, self.tf = -1, 0
+
+    def next(self):
+        if self._i >= self._n:
+            self.doc = END
+            return END
+        buf, off = self._buf, self._off
+        delta, off = decode_varint(buf, off)
+        self.tf, off = decode_varint(buf, off)
+        size, self._off = decode_varint(buf, off)
+        self.doc = max(self.doc, 0) + delta
+        self._pos, self._next_pos = self._next_pos, self._next_pos + size
+        self._i += 1
+        return self.doc
+
+    def advance(self, target):
+        if self.doc >= target:
+            return self.doc
+        block = bisect_left(self._last_docs, target, max(self._i - 1, 0) // BLOCK_SIZE)
+        if block >= len(self._skips):
+            self._i = self._n
+            self.doc = END
+            return END
+        if block * BLOCK_SIZE > self._i:
+            _, self._off, self._next_pos, _ = self._skips[block]
+            self._i = block * BLOCK_SIZE
+            self.doc = self._last_docs[block - 1]
+        while self.doc < target:
+            self.next()
+        return self.doc
+
+    def block_max_tf(self):
+        return self._skips[max(self._i - 1, 0) // BLOCK_SIZE][3]
+
+    def positions(self):
+        buf, off, last, out = self._buf, self._pos, 0, []
+        for _ in range(self.tf):
+            delta, off = decode_varint(buf, off)
+            last += delta
+            out.append(last)
+        return out
+
+
+class Segment:
+    """Read-only, mmap-backed view of a segment written by SegmentWriter."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.n_terms, self.n_docs, self.total_len,
+         self._docs_off, self._terms_off, self._blob_off) = _HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{self.path}: not a segment file")
+
+    def close(self):
+        self._buf.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _term_entry(self, i):
+        return _TERM.unpack_from(self._buf, self._terms_off + i * _TERM.size)
+
+    def _term_at(self, i):
+        blob_off, length = self._term_entry(i)[:2]
+        start = self._blob_off + blob_off
+        return self._buf[start:start + length]
+
+    def _lookup(self, term):
+        key = term.encode("utf-8")
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_terms and self._term_at(lo) == key:
+            return self._term_entry(lo)
+        return None
+
+    @property
+    def doc_count(self):
+        return self.n_docs
+
+    def __contains__(self, term):
+        return self._lookup(term) is not None
+
+    def terms(self):
+        for i in range(self.n_terms):
+            yield self._term_at(i).decode("utf-8")
+
+    def postings(self, term):
+        entry = self._lookup(term)
+        if entry is None:
+            return None
+        _, _, df, max_tf, n_blocks, skip_off, _ = entry
+        return SegmentPostings(self._buf, df, max_tf, n_blocks, skip_off)
+
+    def doc_freq(self, term):
+        entry = self._lookup(term)
+        return entry[2] if entry else 0
+
+    @property
+    def avg_doc_len(self):
+        return self.total_len / self.n_docs if self.n_docs else 0.0
+
+    def _doc_entry(self, doc_id):
+        lo, hi = 0, self.n_docs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if _DOC.unpack_from(self._buf, self._docs_off + mid * _DOC.size)[0] < doc_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_docs:
+            entry = _DOC.unpack_from(self._buf, self._docs_off + lo * _DOC.size)
+            if entry[0] == doc_id:
+                return entry
+        return (doc_id, 0, 0.0)
+
+    def has_doc(self, doc_id):
+        return self._doc_entry(doc_id)[1] > 0
+
+    def doc_len(self, doc_id):
+        return self._doc_entry(doc_id)[1]
+
+    def doc_norm(self, doc_id):
+        return self._doc_entry(doc_id)[2]
+
+    def doc_ids(self):
+        for i in range(self.n_docs):
+            yield _DOC.unpack_from(self._buf, self._docs_off + i * _DOC.size)[0]
+
+    def boolean_or(self, terms):
+        result = set()
+        for term in terms:
+            cursor = self.postings(term)
+            if cursor is not None:
+                while cursor.next() != END:
+                    result.add(cursor.doc)
+        return result
+
+    def boolean_and(self, terms):
+        cursors = [c for c in (self.postings(t) for t in terms) if c is not None]
+        return set(intersect(cursors))
+
+    def tf_idf_score(self, terms, topk=10):
+        return ranking.tf_idf_score(self, terms, topk)
+
+    def phrase_search(self, text, slop=0):
+        return phrase.phrase_search(self, text, slop)
+
+    def proximity_search(self, terms, k):
+        return phrase.near_search(self, terms, k)
+
+    def stats(self):
+        return {
+            "docs_indexed": self.n_docs,
+            "unique_terms": self.n_terms,
+            "total_occurrences": self.total_len
+        }
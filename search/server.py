@@ -0,0 +1,344 @@
+import argparse
+import contextlib
+import functools
+import json
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlsplit
+
+from search.builder import build_index, build_segment, iter_file_books
+from search.query_engine import QueryEngine
+from search.segment import Segment
+from search.sharding import ShardedSearch
+from shared.metrics import METRICS
+from shared.repository import DocumentRepo
+from storage.datalakes.datalake_tria import Datalake
+
+
+def load_engine(lake_root="datalake_tria", segment=None, rebuild=False, shards=None, workers=None,
+                cache_size=1024, cache_ttl=None):
+    """Search engine over the latest body of every book in a file datalake.
+
+    By default the indexes are built in memory with `workers` processes. With `segment`, the body index is
+    that segment file, mmapped, and only built when it is missing or `rebuild` is set; the new file replaces
+    the old one atomically, so engines still reading the old one are unaffected. With `shards`, the books
+    are spread over a ShardedSearch instead, which ranks on several processes at once."""
+    lake = Datalake(root=lake_root)
+    books = list(iter_file_books(lake))
+    if shards:
+        engine = ShardedSearch(shards, cache_size=cache_size, cache_ttl=cache_ttl)
+        engine.add_documents(books)
+        return engine
+    if segment:
+        if rebuild or not Path(segment).exists():
+            build_segment(books, segment, workers)
+        pos = Segment(segment)
+    else:
+        pos = build_index(books, workers)
+    repo = DocumentRepo()
+    for book_id, body_path in books:
+        repo.add(book_id, lake.read_body(body_path), source=functools.partial(lake.read_range, body_path))
+    # QueryEngine answers everything from the positional index; it needs no separate simple one.
+    return QueryEngine(pos, pos, repo, cache_size=cache_size, cache_ttl=cache_ttl)
+
+
+def _retire(engine):
+    # Releases what an engine holds open: shard processes or segment mmaps.
+    if hasattr(engine, "close"):
+        engine.close()
+        return
+    for idx in {id(i): i for i in (engine.pos, engine.simple, engine.header) if i is not None}.values():
+        if hasattr(idx, "close"):
+            idx.close()
+
+
+class Overloaded(RuntimeError):
+    """More searches are queued than the service accepts."""
+
+
+class SearchService:
+    """A warm engine answering searches on a pool of worker threads, replaceable while it serves.
+
+    Each search pins the engine that is current when it starts and runs to completion on it; swap() only
+    changes the engine later searches get, and an old engine is retired once its last pinned search ends,
+    so a swap never fails or drops a request. At most `max_pending` searches are queued or running; past
+    that, search() raises Overloaded instead of letting the backlog (and its latency) grow.
+
+    Threads overlap snippet reads and cache hits; CPU-bound ranking runs in parallel only with a
+    ShardedSearch engine, whose shards are processes."""
+
+    def __init__(self, engine, loader=None, workers=8, max_pending=64):
+        self.loader = loader
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="search")
+        self.started = time.time()
+        self.generation = 1
+        self.last_reload = None
+        self.reload_error = None
+        self._engine = engine
+        self._pins = {}
+        self._pending = 0
+        self._reloading = False
+        self._counts = {"requests": 0, "errors": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _pin(self):
+        with self._lock:
+            engine = self._engine
+            self._pins[engine] = self._pins.get(engine, 0) + 1
+        try:
+            yield engine
+        finally:
+            with self._lock:
+                self._pins[engine] -= 1
+                idle = not self._pins[engine]
+                if idle:
+                    del self._pins[engine]
+                retire = idle and engine is not self._engine
+            if retire:
+                _retire(engine)
+
+    def swap(self, engine):
+        """Makes `engine` serve every search that starts from now on."""
+        with self._lock:
+            old, self._engine = self._engine, engine
+            self.generation += 1
+            retire = old not in self._pins
+        if retire:
+            _retire(old)
+
+    def reload(self, wait=False):
+        """Builds a new engine with the loader on a background thread and swaps it in when it is ready;
+        searches keep being answered by the current one meanwhile. False when a reload is already running."""
+        if self.loader is None:
+            raise ValueError("this service has no loader to reload from")
+        with self._lock:
+            if self._reloading:
+                return False
+            self._reloading = True
+
+        def run():
+            try:
+                self.swap(self.loader())
+                self.last_reload, self.reload_error = time.time(), None
+            except Exception as e:
+                self.reload_error = repr(e)
+            finally:
+                self._reloading = False
+
+        thread = threading.Thread(target=run, name="reload", daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+        return True
+
+    def _run(self, q, method, topk, trace):
+        try:
+            with self._pin() as engine:
+                start = time.perf_counter()
+                with METRICS.trace() if trace else contextlib.nullcontext() as spans:
+                    hits = engine.search(q, method, topk)
+                result = {"hits": hits, "took_ms": (time.perf_counter() - start) * 1000}
+                if trace:
+                    result["trace"] = spans.as_dict()
+                return result
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def search(self, q, method="tfidf", topk=10, trace=False):
+        """{"hits", "took_ms"} for `q`, computed on a worker thread; with `trace`, also the per-stage
+        timings and counters of this search (see METRICS.trace)."""
+        with self._lock:
+            self._counts["requests"] += 1
+            if self._pending >= self.max_pending:
+                self._counts["rejected"] += 1
+                raise Overloaded(f"{self._pending} searches pending")
+            self._pending += 1
+        queued = False
+        try:
+            future = self.pool.submit(self._run, q, method, topk, trace)
+            queued = True
+            return future.result()
+        except Exception:
+            with self._lock:
+                self._counts["errors"] += 1
+            raise
+        finally:
+            # A search that never reached the pool (it was shut down) has no _run to release its slot.
+            if not queued:
+                with self._lock:
+                    self._pending -= 1
+
+    def health(self):
+        with self._pin() as engine:
+            docs = engine.stats()["docs_indexed"]
+        return {"status": "ok", "generation": self.generation, "docs": docs, "reloading": self._reloading}
+
+    def stats(self):
+        with self._pin() as engine:
+            index, cache = engine.stats(), engine.cache.stats()
+        with self._lock:
+            counts = dict(self._counts, pending=self._pending, in_flight=sum(self._pins.values()))
+        return {
+            "uptime_s": time.time() - self.started,
+            "generation": self.generation,
+            "reloading": self._reloading,
+            "last_reload": self.last_reload,
+            "reload_error": self.reload_error,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "requests": counts,
+            "index": index,
+            "cache": cache,
+            "metrics": METRICS.snapshot() if METRICS.active else None
+        }
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        _retire(self._engine)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """JSON API: GET|POST /search (q, method, topk or k, trace), GET /health, GET /stats, GET /metrics
+    (Prometheus text) and POST /reload. POST parameters may be sent as a JSON object body."""
+
+    server_version = "DSearch/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def address_string(self):
+        # Unix socket peers have no (host, port) address.
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        self._route("GET", url.path, {k: v[-1] for k, v in parse_qs(url.query).items()})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send(HTTPStatus.BAD_REQUEST, {"error": "body is not JSON"})
+        if not isinstance(body, dict):
+            return self._send(HTTPStatus.BAD_REQUEST, {"error": "body must be a JSON object"})
+        self._route("POST", url.path, {**params, **body})
+
+    def _route(self, verb, path, params):
+        service = self.server.service
+        try:
+            if path == "/search":
+                q = params.get("q")
+                if not q or not isinstance(q, str):
+                    return self._send(HTTPStatus.BAD_REQUEST, {"error": "missing q"})
+                topk = int(params.get("topk", params.get("k", 10)))
+                trace = str(params.get("trace", "")).lower() in ("1", "true")
+                result = service.search(q, params.get("method", "tfidf"), topk, trace)
+                return self._send(HTTPStatus.OK, {"query": q, **result})
+            if path == "/health":
+                return self._send(HTTPStatus.OK, service.health())
+            if path == "/stats":
+                return self._send(HTTPStatus.OK, service.stats())
+            if path == "/metrics":
+                return self._send(HTTPStatus.OK, METRICS.to_prometheus().encode(), "text/plain; version=0.0.4")
+            if path == "/reload":
+                if verb != "POST":
+                    return self._send(HTTPStatus.METHOD_NOT_ALLOWED, {"error": "use POST"})
+                started = service.reload()
+                return self._send(HTTPStatus.ACCEPTED if started else HTTPStatus.CONFLICT,
+                                  {"reloading": True, "started": started, "generation": service.generation})
+            return self._send(HTTPStatus.NOT_FOUND, {"error": f"no route {path}"})
+        except Overloaded as e:
+            return self._send(HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)})
+        except ValueError as e:
+            return self._send(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+        except Exception as e:
+            return self._send(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": repr(e)})
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service, host="127.0.0.1", port=8765, socket_path=None, verbose=False):
+    """HTTP server for `service` on host:port (port 0 picks a free one), or on a Unix socket at
+    `socket_path`. Call serve_forever() to run it."""
+    if socket_path:
+        Path(socket_path).unlink(missing_ok=True)
+        server = _UnixHTTPServer(socket_path, _Handler)
+    else:
+        server = _HTTPServer((host, port), _Handler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve searches over a file datalake from a warm index.")
+    parser.add_argument("--lake", default="datalake_tria", help="root of the file datalake")
+    parser.add_argument("--segment", help="serve this on-disk segment, built if missing; rebuilt on reload")
+    parser.add_argument("--shards", type=int, help="rank on this many shard processes")
+    parser.add_argument("--build-workers", type=int, help="processes for the index builds")
+    parser.add_argument("--threads", type=int, default=8, help="search worker threads")
+    parser.add_argument("--max-pending", type=int, default=64, help="queued searches before answering 503")
+    parser.add_argument("--cache-size", type=int, default=1024)
+    parser.add_argument("--cache-ttl", type=float)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", help="listen on this Unix socket instead of host:port")
+    parser.add_argument("--metrics", action="store_true", help="record metrics for /metrics and /stats")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    if args.metrics:
+        METRICS.enable()
+    load = functools.partial(load_engine, args.lake, args.segment, shards=args.shards, workers=args.build_workers,
+                             cache_size=args.cache_size, cache_ttl=args.cache_ttl)
+    start = time.perf_counter()
+    service = SearchService(load(), functools.partial(load, rebuild=True), args.threads, args.max_pending)
+    server = make_server(service, args.host, args.port, args.socket, args.verbose)
+    # SIGHUP reloads, like POST /reload; SIGTERM stops serving and cleans up like Ctrl-C. shutdown() waits
+    # for serve_forever, which runs on this thread, so it is called from another.
+    signal.signal(signal.SIGHUP, lambda *_: service.reload())
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    where = args.socket or "http://%s:%d" % server.server_address[:2]
+    print(f"Index loaded in {time.perf_counter() - start:.1f}s; serving on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if args.socket:
+            Path(args.socket).unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import functools
+import heapq
+import multiprocessing
+import os
+import threading
+from pathlib import Path
+
+from search.analysis import ANALYZER
+from search.cache import QueryCache, normalize_query
+from search.indexer import PositionalInvertedIndex
+from search.query_engine import QueryEngine, query_kind
+from shared.repository import DocumentRepo
+from storage.datalakes import codec as body_codec
+
+
+class _Shard:
+    """One partition, living in its own worker process: indexes, document repo and a local QueryEngine."""
+
+    def __init__(self, analyzer):
+        self.pos = PositionalInvertedIndex(analyzer)
+        self.repo = DocumentRepo()
+        # The engine answers every query kind from the positional index alone.
+        self.engine = QueryEngine(self.pos, self.pos, self.repo, cache_size=0, analyzer=analyzer)
+
+    def add(self, docs):
+        for doc_id, text in docs:
+            source = None
+            if isinstance(text, Path):
+                # Bodies on disk are indexed from the file and re-read by byte range for snippets.
+                source = functools.partial(body_codec.read_range, text)
+                text = body_codec.read_text(text)
+            self.pos.update_document(doc_id, text)
+            self.repo.add(doc_id, text, source=source)
+        return len(docs)
+
+    def delete(self, doc_id):
+        return self.pos.delete_document(doc_id)
+
+    def term_stats(self, q):
+        # Wildcard and fuzzy words expand against this shard's vocabulary; a term another shard does not
+        # have contributes nothing to its df there, so the summed stats still cover every expansion.
+        return self.engine.term_stats(self.engine.query_terms(q))
+
+    def search(self, q, method, topk, stats):
+        return self.engine.search(q, method, topk, stats=stats)
+
+    def stats(self):
+        return self.pos.stats()
+
+
+def _serve(conn, analyzer):
+    shard = _Shard(analyzer)
+    while True:
+        op, args = conn.recv()
+        if op == "close":
+            break
+        try:
+            conn.send((True, getattr(shard, op)(*args)))
+        except Exception as e:
+            conn.send((False, e))
+    conn.close()
+
+
+def _merge_stats(parts):
+    merged = {}
+    for part in parts:
+        for name, s in part.items():
+            m = merged.setdefault(name, {"doc_count": 0, "total_len": 0, "df": {}})
+            m["doc_count"] += s["doc_count"]
+            m["total_len"] += s["total_len"]
+            for term, df in s["df"].items():
+                m["df"][term] = m["df"].get(term, 0) + df
+    return merged
+
+
+class ShardedSearch:
+    """Documents partitioned by book_id over `n_shards` worker processes and searched scatter-gather.
+
+    Ranked queries take two round trips: every shard first reports its document count, total length and
+    the df of each query term; the sums are then sent back with the query so each shard scores with
+    corpus-wide idf and average length (see ranking.GlobalView). A document lives on exactly one shard,
+    so merging the per-shard top-k gives the global top-k. Other query kinds are fanned out once and
+    their hits concatenated.
+
+    Shards work in parallel on each query; queries themselves go through the pipes one at a time."""
+
+    def __init__(self, n_shards=None, analyzer=None, cache_size=1024, cache_ttl=None):
+        self.n_shards = n_shards or os.cpu_count() or 1
+        self.analyzer = analyzer or ANALYZER
+        self.cache = QueryCache(cache_size, cache_ttl)
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._conns, self._procs = [], []
+        for i in range(self.n_shards):
+            parent, child = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=_serve, args=(child, self.analyzer), name=f"shard-{i}", daemon=True)
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(proc)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def shard_of(self, doc_id):
+        return doc_id % self.n_shards
+
+    def _recv(self, shard):
+        ok, value = self._conns[shard].recv()
+        if not ok:
+            raise value
+        return value
+
+    def _call(self, calls):
+        # Sends every request before waiting on any reply, so the shards work concurrently.
+        with self._lock:
+            for shard, op, args in calls:
+                self._conns[shard].send((op, args))
+            replies = [self._conns[shard].recv() for shard, _, _ in calls]
+        for ok, value in replies:
+            if not ok:
+                raise value
+        return [value for _, value in replies]
+
+    def _broadcast(self, op, *args):
+        return self._call([(shard, op, args) for shard in range(self.n_shards)])
+
+    def add_documents(self, docs, batch_size=32):
+        """Indexes (doc_id, text) pairs, text being a string or a Path to a datalake body; a document that
+        is already indexed is replaced. Each shard has at most two batches queued at a time."""
+        batches = [[] for _ in range(self.n_shards)]
+        pending = [0] * self.n_shards
+        added = 0
+
+        def send(shard):
+            nonlocal added
+            if pending[shard] >= 2:
+                added += self._recv(shard)
+                pending[shard] -= 1
+            self._conns[shard].send(("add", (batches[shard],)))
+            batches[shard] = []
+            pending[shard] += 1
+
+        with self._lock:
+            try:
+                for doc_id, text in docs:
+                    shard = self.shard_of(doc_id)
+                    batches[shard].append((doc_id, text))
+                    if len(batches[shard]) >= batch_size:
+                        send(shard)
+                for shard in range(self.n_shards):
+                    if batches[shard]:
+                        send(shard)
+            finally:
+                for shard in range(self.n_shards):
+                    while pending[shard]:
+                        pending[shard] -= 1
+                        added += self._recv(shard)
+                self.generation += 1
+        return added
+
+    def delete_document(self, doc_id):
+        deleted, = self._call([(self.shard_of(doc_id), "delete", (doc_id,))])
+        self.generation += 1
+        return deleted
+
+    def search(self, q, method='tfidf', topk=10):
+        key = (normalize_query(q), method, topk)
+        generation = self.generation
+        hits = self.cache.get(key, generation)
+        if hits is None:
+            hits = self._search(q, method, topk)
+            self.cache.put(key, generation, hits)
+        return [dict(hit) for hit in hits]
+
+    def _search(self, q, method, topk):
+        kind = query_kind(q, method)
+        if kind != "ranked":
+            parts = self._broadcast("search", q, method, topk, None)
+            hits = [hit for part in parts for hit in part]
+            if kind in ("phrase", "near"):
+                return sorted(hits, key=lambda h: (-h["matches"], h["doc_id"]))
+            return sorted(hits, key=lambda h: h["doc_id"])
+        stats = _merge_stats(self._broadcast("term_stats", q))
+        parts = self._broadcast("search", q, method, topk, stats)
+        return heapq.nsmallest(topk, (hit for part in parts for hit in part), key=lambda h: (-h["score"], h["doc_id"]))
+
+    def stats(self):
+        parts = self._broadcast("stats")
+        return {
+            "shards": self.n_shards,
+            "docs_indexed": sum(p["docs_indexed"] for p in parts),
+            "total_occurrences": sum(p["total_occurrences"] for p in parts),
+            "per_shard": parts
+        }
+
+    def close(self):
+        for conn in self._conns:
+            try:
+                conn.send(("close", ()))
+            except (BrokenPipeError, OSError):
+                pass
+        for proc in self._procs:
+            proc.join(timeout=5)
+        for conn in self._conns:
+            conn.close()
+        self._conns, self._procs = [], []
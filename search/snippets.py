@@ -0,0 +1,62 @@
+from collections import Counter
+
+from search.analysis import ANALYZER
+
+WIDTH = 30
+MARK = ("**", "**")
+
+
+def _hits(index, doc_id, terms):
+    hits = []
+    for term in set(terms):
+        cursor = index.postings(term)
+        if cursor is not None and cursor.advance(doc_id) == doc_id:
+            hits.extend((pos, term) for pos in cursor.positions())
+    hits.sort()
+    return hits
+
+
+def best_window(index, doc_id, terms, width=WIDTH):
+    """(first, last) word positions of the `width`-word window with the most distinct query terms, then the
+    most occurrences, with the matches centred in it. None when no query term occurs in the document."""
+    hits = _hits(index, doc_id, terms)
+    if not hits:
+        return None
+    best, counts, lo = None, Counter(), 0
+    for hi, (pos, term) in enumerate(hits):
+        counts[term] += 1
+        while pos - hits[lo][0] >= width:
+            counts[hits[lo][1]] -= 1
+            if not counts[hits[lo][1]]:
+                del counts[hits[lo][1]]
+            lo += 1
+        key = (len(counts), hi - lo + 1)
+        if best is None or key > best[0]:
+            best = (key, hits[lo][0], pos)
+    _, first, last = best
+    first = max(0, first - (width - (last - first + 1)) // 2)
+    return first, first + width - 1
+
+
+def snippet(repo, index, doc_id, terms, width=WIDTH, mark=MARK, analyzer=None):
+    """Passage of about `width` words around the best cluster of query terms, with the terms wrapped in `mark`.
+
+    Only the words of the window are read from `repo` (see DocumentRepo.read_tokens)."""
+    first, last = best_window(index, doc_id, terms, width) or (0, width - 1)
+    text, spans = repo.read_tokens(doc_id, first, last)
+    if not spans:
+        return ""
+    analyzer = analyzer or ANALYZER
+    terms = set(terms)
+    out, prev = [], spans[0][0]
+    for start, end in spans:
+        word = text[start:end]
+        out.append(text[prev:start])
+        out.append(f"{mark[0]}{word}{mark[1]}" if analyzer.term(word) in terms else word)
+        prev = end
+    passage = " ".join("".join(out).split())
+    if first > 0:
+        passage = "... " + passage
+    if len(spans) == last - first + 1:
+        passage += " ..."
+    return passage
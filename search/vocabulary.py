@@ -0,0 +1,162 @@
+import re
+from array import array
+from bisect import bisect_left
+
+WILDCARD_RE = re.compile(r"^[\w*?]*[*?][\w*?]*$")
+FUZZY_RE = re.compile(r"^(\w+)~(\d)?$")
+MAX_EXPANSIONS = 64
+# A wildcard pattern needs this many literal characters; `*` alone would stand for arbitrary terms.
+MIN_LITERALS = 2
+# A literal head matching at most this many terms is scanned directly, without the auxiliary indexes.
+SMALL_RANGE = 4096
+
+
+def _strip(word):
+    # A trailing "?" ends a question ("who is ishmael?"); only a "?" inside a word stands for a character.
+    return word.rstrip("?")
+
+
+def is_pattern(word):
+    word = _strip(word)
+    return bool(WILDCARD_RE.match(word) or FUZZY_RE.match(word))
+
+
+def auto_edits(word):
+    """Edits allowed for `word~` without an explicit distance: none up to 2 letters, 1 up to 5, else 2."""
+    return 0 if len(word) <= 2 else 1 if len(word) <= 5 else 2
+
+
+def _span(seq, prefix, lo=0, hi=None):
+    # [lo, hi) range of the sorted `seq` whose items start with `prefix`.
+    hi = len(seq) if hi is None else hi
+    if not prefix:
+        return lo, hi
+    return bisect_left(seq, prefix, lo, hi), bisect_left(seq, prefix[:-1] + chr(ord(prefix[-1]) + 1), lo, hi)
+
+
+class Vocabulary:
+    """Pattern lookups over an index's sorted term list.
+
+    A prefix is a bisected range of the list. A wildcard pattern (* and ?) is answered from the smallest
+    candidate set available: the range of its literal head, the range of its literal tail in a sorted list
+    of reversed terms, or the shortest k-gram list of its literal parts; candidates are then checked
+    against the pattern. Fuzzy lookups walk the list as an implicit trie, carrying a row of the edit
+    distance table and abandoning every prefix already more than `max_edits` away. The reversed list and
+    the k-gram index are built on first use."""
+
+    def __init__(self, terms, k=3):
+        self.terms = terms if isinstance(terms, list) else list(terms)
+        self.k = k
+        self._reversed = None
+        self._grams = None
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        i = bisect_left(self.terms, term)
+        return i < len(self.terms) and self.terms[i] == term
+
+    def _reversed_terms(self):
+        if self._reversed is None:
+            order = sorted(range(len(self.terms)), key=lambda i: self.terms[i][::-1])
+            self._reversed = ([self.terms[i][::-1] for i in order], array("I", order))
+        return self._reversed
+
+    def _gram_index(self):
+        # k-gram -> ascending ids of the terms containing it; "^" and "$" mark the start and end of a term.
+        if self._grams is None:
+            k, grams = self.k, {}
+            for i, term in enumerate(self.terms):
+                marked = f"^{term}$"
+                for gram in {marked[j:j + k] for j in range(len(marked) - k + 1)}:
+                    ids = grams.get(gram)
+                    if ids is None:
+                        ids = grams[gram] = array("I")
+                    ids.append(i)
+            self._grams = grams
+        return self._grams
+
+    def prefix(self, prefix, limit=MAX_EXPANSIONS):
+        lo, hi = _span(self.terms, prefix)
+        return self.terms[lo:min(hi, lo + limit)]
+
+    def _candidates(self, parts):
+        terms = self.terms
+        lo, hi = _span(terms, parts[0])
+        if parts[0] and hi - lo <= SMALL_RANGE:
+            return terms[lo:hi]
+        best, candidates = hi - lo, lambda: (terms[i] for i in range(lo, hi))
+        if parts[-1]:
+            rev, order = self._reversed_terms()
+            rlo, rhi = _span(rev, parts[-1][::-1])
+            if rhi - rlo < best:
+                best, candidates = rhi - rlo, lambda: (terms[i] for i in order[rlo:rhi])
+        marked = [f"^{parts[0]}", *parts[1:-1], f"{parts[-1]}$"]
+        grams = {p[j:j + self.k] for p in marked for j in range(len(p) - self.k + 1)}
+        if grams:
+            index = self._gram_index()
+            ids = min((index.get(g, ()) for g in grams), key=len)
+            if len(ids) < best:
+                candidates = lambda: (terms[i] for i in ids)
+        return candidates()
+
+    def wildcard(self, pattern, limit=MAX_EXPANSIONS):
+        """Terms matching `pattern`, where * stands for any run of characters and ? for one; at most `limit`
+        of them, sorted. Raises ValueError for a pattern with fewer than MIN_LITERALS literal characters."""
+        parts = re.split(r"[*?]+", pattern)
+        if len(parts) == 1:
+            return [pattern] if pattern in self else []
+        if sum(map(len, parts)) < MIN_LITERALS:
+            raise ValueError(f"wildcard {pattern!r} needs at least {MIN_LITERALS} letters")
+        regex = re.compile("".join(".*" if c == "*" else "." if c == "?" else re.escape(c) for c in pattern))
+        out = []
+        for term in filter(regex.fullmatch, self._candidates(parts)):
+            out.append(term)
+            if len(out) >= limit:
+                break
+        return sorted(out)
+
+    def fuzzy(self, word, max_edits=None, limit=MAX_EXPANSIONS):
+        """(term, distance) for the terms within `max_edits` insertions, deletions or substitutions of
+        `word`, closest first."""
+        if max_edits is None:
+            max_edits = auto_edits(word)
+        terms, n, found = self.terms, len(word), []
+        # (prefix, lo, hi, row): terms[lo:hi] all start with prefix, row[j] = distance(prefix, word[:j]).
+        stack = [("", 0, len(terms), list(range(n + 1)))]
+        while stack:
+            prefix, lo, hi, row = stack.pop()
+            depth = len(prefix)
+            if lo < hi and len(terms[lo]) == depth:
+                # The prefix is itself a term; it sorts first in its range.
+                if row[n] <= max_edits:
+                    found.append((row[n], prefix))
+                lo += 1
+            while lo < hi:
+                c = terms[lo][depth]
+                end = bisect_left(terms, prefix + chr(ord(c) + 1), lo, hi)
+                new = [row[0] + 1]
+                for j in range(n):
+                    new.append(min(new[j] + 1, row[j + 1] + 1, row[j] + (word[j] != c)))
+                if min(new) <= max_edits:
+                    stack.append((prefix + c, lo, end, new))
+                lo = end
+        found.sort()
+        return [(term, d) for d, term in found[:limit]]
+
+    def expand(self, word, analyzer=None, limit=MAX_EXPANSIONS):
+        """Terms a wildcard (`whal*`, `*ness`, `wh?le`) or fuzzy (`whale~`, `whale~1`) query word stands for,
+        at most `limit` of them; None when `word` is neither. Fuzzy words are analyzed first, so they are
+        matched stemmed; wildcard patterns are matched against the indexed terms as typed. Trailing question
+        marks are ignored."""
+        word = _strip(word)
+        m = FUZZY_RE.match(word)
+        if m:
+            base = m[1].lower()
+            term = (analyzer.term(base) if analyzer is not None else None) or base
+            edits = auto_edits(term) if m[2] is None else int(m[2])
+            return [t for t, _ in self.fuzzy(term, edits, limit)]
+        if WILDCARD_RE.match(word):
+            return self.wildcard(word.lower(), limit)
+        return None
@@ -0,0 +1,278 @@
+import contextlib
+import contextvars
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from functools import wraps
+
+# Upper bounds, in seconds, of the latency histogram buckets; one more bucket catches everything above.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_TRACE = contextvars.ContextVar("trace", default=None)
+
+
+class _Null:
+    # Handed out by timer()/stage() while nothing is recorded, so a disabled timer allocates nothing.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _Null()
+
+
+def _split(name):
+    # 'query_stage_seconds{stage="score"}' -> ('query_stage_seconds', 'stage="score"')
+    base, _, labels = name.partition("{")
+    return base, labels[:-1]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (None above the last bound, or with no
+        observations)."""
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return None
+
+    def as_dict(self):
+        cumulative, seen = {}, 0
+        for bound, n in zip(BUCKETS + ("+Inf",), self.counts):
+            seen += n
+            cumulative[str(bound)] = seen
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+class Trace:
+    """Where one operation's time went: seconds per stage, plus the counters recorded while it ran."""
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.start = time.perf_counter()
+        self.seconds = None
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, name, n):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self):
+        total = self.seconds if self.seconds is not None else time.perf_counter() - self.start
+        return {
+            "total_ms": total * 1000,
+            "stages_ms": {stage: s * 1000 for stage, s in self.stages.items()},
+            "counters": dict(self.counters)
+        }
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "stage", "start")
+
+    def __init__(self, metrics, name, stage):
+        self.metrics = metrics
+        self.name = name
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        trace = _TRACE.get()
+        if trace is not None:
+            trace.add(self.stage, elapsed)
+        if self.metrics.enabled:
+            self.metrics.observe(self.name, elapsed)
+        return False
+
+
+class Metrics:
+    """Process-wide counters and latency histograms, plus opt-in per-operation traces.
+
+    Nothing is recorded unless metrics are enabled (enable(), or SEARCH_METRICS=1 in the environment) or
+    a trace() is open somewhere; until then every call returns after testing `active`, so the hooks can
+    stay in hot paths. Metric names may carry Prometheus labels: 'datalake_bytes_read_total{lake="sql"}'."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.active = enabled
+        self.counters = {}
+        self.histograms = {}
+        self._tracing = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        self.active = self.enabled or self._tracing > 0
+
+    def enable(self, on=True):
+        with self._lock:
+            self.enabled = on
+            self._refresh()
+
+    def disable(self):
+        self.enable(False)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def inc(self, name, n=1):
+        if not self.active:
+            return
+        trace = _TRACE.get()
+        if trace is not None:
+            trace.count(name, n)
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = Histogram()
+            hist.observe(seconds)
+
+    def timer(self, name, stage=None):
+        """Context manager timing a block into histogram `name` (and into the open trace, as `stage`)."""
+        if not self.active:
+            return _NULL
+        return _Timer(self, name, stage or _split(name)[0])
+
+    def stage(self, stage):
+        """timer() for one stage of a query: tokenize, lookup, score, snippet..."""
+        if not self.active:
+            return _NULL
+        return _Timer(self, f'query_stage_seconds{{stage="{stage}"}}', stage)
+
+    def timed(self, name):
+        """Decorator form of timer()."""
+        def decorate(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.active:
+                    return func(*args, **kwargs)
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    @contextlib.contextmanager
+    def trace(self):
+        """Records the stages and counters of everything run in the block (on this thread) into a Trace."""
+        trace = Trace()
+        token = _TRACE.set(trace)
+        with self._lock:
+            self._tracing += 1
+            self._refresh()
+        try:
+            yield trace
+        finally:
+            trace.seconds = time.perf_counter() - trace.start
+            _TRACE.reset(token)
+            with self._lock:
+                self._tracing -= 1
+                self._refresh()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {name: h.as_dict() for name, h in self.histograms.items()}
+            }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self, prefix=""):
+        """Snapshot in the Prometheus text exposition format."""
+        snap, lines, typed = self.snapshot(), [], set()
+
+        def series(base, labels, extra=""):
+            labels = ",".join(x for x in (labels, extra) if x)
+            return f"{prefix}{base}{{{labels}}}" if labels else f"{prefix}{base}"
+
+        for name, value in sorted(snap["counters"].items()):
+            base, labels = _split(name)
+            if base not in typed:
+                typed.add(base)
+                lines.append(f"# TYPE {prefix}{base} counter")
+            lines.append(f"{series(base, labels)} {value}")
+        for name, hist in sorted(snap["histograms"].items()):
+            base, labels = _split(name)
+            if base not in typed:
+                typed.add(base)
+                lines.append(f"# TYPE {prefix}{base} histogram")
+            for bound, n in hist["buckets"].items():
+                le = f'le="{bound}"'
+                lines.append(f"{series(base + '_bucket', labels, le)} {n}")
+            lines.append(f"{series(base + '_sum', labels)} {hist['sum']}")
+            lines.append(f"{series(base + '_count', labels)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics(enabled=os.environ.get("SEARCH_METRICS") == "1")
+
+
+@contextlib.contextmanager
+def profile(path=None, sort="cumulative", limit=25, stream=None):
+    """cProfile around a block. The stats go to `path` (load them with pstats or snakeviz) or, without
+    one, the top `limit` functions are printed to `stream` (stdout by default)."""
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield prof
+    finally:
+        prof.disable()
+        if path:
+            prof.dump_stats(path)
+        else:
+            pstats.Stats(prof, stream=stream).sort_stats(sort).print_stats(limit)
+
+
+@contextlib.contextmanager
+def trace_memory(limit=10, frames=1):
+    """tracemalloc around a block. Yields a dict that holds, once the block exits, the bytes still allocated
+    ("current"), the peak and the `limit` source lines that allocated most."""
+    report = {}
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(frames)
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    try:
+        yield report
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        stats = tracemalloc.take_snapshot().compare_to(before, "lineno")[:limit]
+        if started:
+            tracemalloc.stop()
+        report.update(current=current, peak=peak, top=[str(s) for s in stats])
@@ -1,23 +1,71 @@
-import re
+from array import array
 
-STOP_WORDS = {
-    'the','is','a','an','and','or','of','to','in','that','it','this','for',
-    'on','with','as','by','be','are','was','were','has','have','but','not',
-    'these','those','i','you'
-}
+from search.analysis import ANALYZER, STOP_WORDS, WORD_RE
+
+CHECKPOINT = 64
 
 def tokenize(text):
-    return [w for w in re.findall(r"\w+", text.lower()) if w not in STOP_WORDS]
+    # Same analyzer the indexes use, so query terms always match indexed terms.
+    return ANALYZER.terms(text)
+
+def token_checkpoints(text, in_bytes=True):
+    # Offset of every CHECKPOINT-th word (UTF-8 bytes, or characters), counting words the way the indexer
+    # numbers positions.
+    marks, off, prev = array("I"), 0, 0
+    for i, m in enumerate(WORD_RE.finditer(text)):
+        if i % CHECKPOINT == 0:
+            off += len(text[prev:m.start()].encode("utf-8", errors="ignore")) if in_bytes else m.start() - prev
+            prev = m.start()
+            marks.append(off)
+    return marks
 
 class DocumentRepo:
+    """Document texts by id.
+
+    A document added with a `source` -- a callable returning the UTF-8 bytes [start, end) of its stored
+    body, e.g. functools.partial(datalake.read_range, body_path) -- is not kept in memory; only a sparse
+    table of word offsets is, and read_tokens() fetches just the bytes around the requested words.
+    `text` must then be the body exactly as the source returns it."""
+
     def __init__(self):
         self.docs, self.meta = {}, {}
+        self.sources, self.checkpoints = {}, {}
 
-    def add(self, doc_id, text, meta=None):
-        self.docs[doc_id], self.meta[doc_id] = text, meta or {}
+    def add(self, doc_id, text, meta=None, source=None):
+        self.meta[doc_id] = meta or {}
+        if source is None:
+            self.docs[doc_id] = text
+        else:
+            self.sources[doc_id] = source
+        self.checkpoints[doc_id] = token_checkpoints(text, in_bytes=source is not None)
 
     def get(self, doc_id):
+        if doc_id in self.sources:
+            return self.sources[doc_id](0, None).decode("utf-8", errors="ignore")
         return self.docs.get(doc_id)
 
     def all_docs(self):
-        return self.docs.items()
+        for doc_id in self.meta:
+            yield doc_id, self.get(doc_id)
+
+    def read_tokens(self, doc_id, first, last):
+        """Text covering words first..last (0-based positions) and the (start, end) span of each of those
+        words within it."""
+        marks = self.checkpoints.get(doc_id)
+        if not marks:
+            return "", []
+        block = min(first // CHECKPOINT, len(marks) - 1)
+        stop = last // CHECKPOINT + 1
+        start, end = marks[block], marks[stop] if stop < len(marks) else None
+        if doc_id in self.sources:
+            text = self.sources[doc_id](start, end).decode("utf-8", errors="ignore")
+        else:
+            text = self.docs[doc_id][start:end]
+        base = block * CHECKPOINT
+        spans = []
+        for i, m in enumerate(WORD_RE.finditer(text), base):
+            if i > last:
+                break
+            if i >= first:
+                spans.append(m.span())
+        return text, spans
@@ -0,0 +1,117 @@
+import codecs
+import io
+import lzma
+import struct
+import zlib
+from pathlib import Path
+
+from shared.metrics import METRICS
+
+# Framed layout: MAGIC | codec id (1 byte) | frames of (compressed len u32, raw len u32, payload).
+# Frames are compressed independently, so a reader can decode one chunk at a time.
+MAGIC = b"DSLZ"
+CHUNK_SIZE = 256 * 1024
+_FRAME = struct.Struct("<II")
+
+CODECS = {
+    "zlib": (1, lambda b: zlib.compress(b, 6), zlib.decompress),
+    "lzma": (2, lzma.compress, lzma.decompress),
+}
+_BY_ID = {cid: decompress for cid, _, decompress in CODECS.values()}
+
+
+def is_compressed_path(path) -> bool:
+    """Whether a body file is framed, from its name: compressed bodies are written as <id>_body.txt.<codec>."""
+    return Path(path).suffix[1:] in CODECS
+
+
+def _decompressor(head):
+    if len(head) < 5 or bytes(head[:4]) != MAGIC or head[4] not in _BY_ID:
+        raise ValueError("not a framed body")
+    return _BY_ID[head[4]]
+
+
+def encode(text: str, codec: str = "zlib", chunk_size: int = CHUNK_SIZE) -> bytes:
+    cid, compress, _ = CODECS[codec]
+    raw = text.encode("utf-8", errors="ignore")
+    out = bytearray(MAGIC)
+    out.append(cid)
+    for start in range(0, len(raw), chunk_size):
+        chunk = raw[start:start + chunk_size]
+        payload = compress(chunk)
+        out += _FRAME.pack(len(payload), len(chunk))
+        out += payload
+    return bytes(out)
+
+
+def iter_chunks(data):
+    """Yields the decoded text of a framed body frame by frame; multi-byte characters split across frames
+    are stitched back."""
+    yield from _iter_frames(io.BytesIO(data))
+
+
+def decode(data) -> str:
+    """Text of a stored body: a framed body given as bytes, or plain text given as str."""
+    return data if isinstance(data, str) else "".join(iter_chunks(data))
+
+
+def read_text(path) -> str:
+    data = Path(path).read_bytes()
+    METRICS.inc('datalake_bytes_read_total{lake="file"}', len(data))
+    if is_compressed_path(path):
+        return decode(data)
+    return data.decode("utf-8", errors="ignore")
+
+
+def _iter_frames(f, count_reads=False):
+    decompress = _decompressor(f.read(5))
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    while frame := f.read(_FRAME.size):
+        size, _ = _FRAME.unpack(frame)
+        if count_reads:
+            METRICS.inc('datalake_bytes_read_total{lake="file"}', size)
+        yield decoder.decode(decompress(f.read(size)))
+    if tail := decoder.decode(b"", final=True):
+        yield tail
+
+
+def iter_file(path, chunk_size: int = CHUNK_SIZE):
+    """Streams a body file, compressed or plain, without holding the decoded text in memory."""
+    with open(path, "rb") as f:
+        if is_compressed_path(path):
+            yield from _iter_frames(f, count_reads=True)
+            return
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        while block := f.read(chunk_size):
+            METRICS.inc('datalake_bytes_read_total{lake="file"}', len(block))
+            yield decoder.decode(block)
+        if tail := decoder.decode(b"", final=True):
+            yield tail
+
+
+def read_framed_range(f, start, end=None):
+    """UTF-8 bytes [start, end) of the framed body readable from file object `f`, positioned at its start.
+    Only the frame headers and the frames overlapping the range are read; the others are seeked over."""
+    decompress = _decompressor(f.read(5))
+    out, raw_off = bytearray(), 0
+    while (end is None or raw_off < end) and (frame := f.read(_FRAME.size)):
+        size, raw_len = _FRAME.unpack(frame)
+        if raw_off + raw_len <= start:
+            f.seek(size, io.SEEK_CUR)
+        else:
+            chunk = decompress(f.read(size))
+            out += chunk[max(0, start - raw_off):None if end is None else end - raw_off]
+        raw_off += raw_len
+    return bytes(out)
+
+
+def read_range(path, start: int, end: int | None = None) -> bytes:
+    """UTF-8 bytes [start, end) of a body file; compressed files only decompress the frames overlapping the range."""
+    with open(path, "rb") as f:
+        if is_compressed_path(path):
+            data = read_framed_range(f, start, end)
+        else:
+            f.seek(start)
+            data = f.read() if end is None else f.read(max(0, end - start))
+    METRICS.inc('datalake_bytes_read_total{lake="file"}', len(data))
+    return data
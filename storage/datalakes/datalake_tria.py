@@ -1,22 +1,62 @@
+import os
 from pathlib import Path
 from datetime import datetime
+from shared.metrics import METRICS
+from . import codec as body_codec
+from .manifest import Manifest, content_hash
 
 START_MARKER = "*** START OF THE PROJECT GUTENBERG EBOOK"
 END_MARKER   = "*** END OF THE PROJECT GUTENBERG EBOOK"
 
 class Datalake:
-    def __init__(self, root: str = "datalake"):
+    def __init__(self, root: str = "datalake", codec: str | None = None):
         self.root = Path(root)
+        self.codec = codec
+        self.manifest = Manifest(str(self.root / "manifest.sqlite"))
+        if self.manifest.is_empty():
+            self.rebuild_manifest()
 
     def _now_parts(self, dt: datetime | None = None):
         dt = dt or datetime.utcnow()
         return dt.strftime("%Y%m%d"), dt.strftime("%H")
 
+    def _share(self, twin: dict, base: Path, book_id: int | str):
+        # Identical text already stored for another book: hard-link its files instead of writing a copy.
+        src_header, src_body = Path(twin["header_path"]), Path(twin["body_path"])
+        header_path = base / f"{book_id}_header.txt"
+        body_path = base / (f"{book_id}_body" + src_body.name.split("_body", 1)[1])
+        try:
+            for src, dst in ((src_header, header_path), (src_body, body_path)):
+                dst.unlink(missing_ok=True)
+                os.link(src, dst)
+        except OSError:
+            return None
+        return header_path, body_path
+
+    @METRICS.timed('datalake_save_seconds{lake="file"}')
     def save_raw(self, book_id: int | str, raw_text: str, dt: datetime | None = None) -> dict:
+        digest = content_hash(raw_text)
+        known = self.manifest.get(book_id)
+        if known and known["hash"] == digest and Path(known["body_path"]).exists():
+            return {"book_id": int(book_id), "header_path": known["header_path"], "body_path": known["body_path"],
+                    "date": known["date"], "hour": known["hour"], "changed": False}
+
         ymd, hh = self._now_parts(dt)
         base = self.root / ymd / hh
         base.mkdir(parents=True, exist_ok=True)
+        twin = self.manifest.find_hash(digest)
+        shared = self._share(twin, base, book_id) if twin else None
+        if shared:
+            header_path, body_path = shared
+        else:
+            header_path, body_path = self._write(book_id, raw_text, base)
 
+        self.manifest.put({"book_id": int(book_id), "hash": digest, "size": len(raw_text),
+                           "header_path": str(header_path), "body_path": str(body_path), "date": ymd, "hour": hh})
+        return {"book_id": int(book_id), "header_path": str(header_path), "body_path": str(body_path),
+                "date": ymd, "hour": hh, "changed": True}
+
+    def _write(self, book_id: int | str, raw_text: str, base: Path):
         header = ""
         body = raw_text
         if START_MARKER in raw_text and END_MARKER in raw_text:
@@ -26,23 +66,59 @@ class Datalake:
             body = body_raw.strip()
 
         header_path = base / f"{book_id}_header.txt"
-        body_path   = base / f"{book_id}_body.txt"
+        body_path = base / (f"{book_id}_body.txt.{self.codec}" if self.codec else f"{book_id}_body.txt")
+        # Unlink first: the old files may be hard links shared with another book.
+        for path in (header_path, body_path):
+            path.unlink(missing_ok=True)
         header_path.write_text(header, encoding="utf-8", errors="ignore")
-        body_path.write_text(body, encoding="utf-8", errors="ignore")
+        if self.codec:
+            body_path.write_bytes(body_codec.encode(body, self.codec))
+        else:
+            body_path.write_text(body, encoding="utf-8", errors="ignore")
+        if METRICS.active:
+            METRICS.inc('datalake_bytes_written_total{lake="file"}', header_path.stat().st_size + body_path.stat().st_size)
+        return header_path, body_path
 
-        return {"book_id": int(book_id), "header_path": str(header_path), "body_path": str(body_path),
-                "date": ymd, "hour": hh}
+    def get(self, book_id: int | str) -> dict | None:
+        """Latest stored version of a book, straight from the manifest."""
+        return self.manifest.get(book_id)
 
-    def iter_books(self):
+    def _partition(self, bound):
+        return bound.strftime("%Y%m%d%H") if isinstance(bound, datetime) else bound
+
+    def iter_books(self, since: datetime | str | None = None, until: datetime | str | None = None,
+                   latest_only: bool = False):
+        """(book_id, header_path, body_path) for every stored version, oldest partition first.
+        `since`/`until` are inclusive datetimes or YYYYMMDDHH strings; `latest_only` skips superseded versions."""
+        return self.manifest.iter_versions(self._partition(since), self._partition(until), latest_only)
+
+    def rebuild_manifest(self):
+        # Lakes written before the manifest existed: walk the tree once and record what is there.
+        # The hash stays empty, so the next ingest of each book rewrites it and stores the real one.
+        self.manifest.put_many(
+            {"book_id": book_id, "hash": "", "size": None, "header_path": header_path, "body_path": body_path,
+             "date": Path(body_path).parent.parent.name, "hour": Path(body_path).parent.name}
+            for book_id, header_path, body_path in self._scan())
+
+    def _scan(self):
         if not self.root.exists():
             return
         for day_dir in sorted(self.root.iterdir()):
             if not day_dir.is_dir(): continue
             for hour_dir in sorted(day_dir.iterdir()):
                 if not hour_dir.is_dir(): continue
-                bodies = {p.name.split("_")[0]: p for p in hour_dir.glob("*_body.txt")}
+                bodies = {p.name.split("_")[0]: p for p in hour_dir.glob("*_body.txt*")}
                 for hid in hour_dir.glob("*_header.txt"):
                     book_id = hid.name.split("_")[0]
                     body = bodies.get(book_id)
                     if body:
                         yield int(book_id), str(hid), str(body)
+
+    def read_body(self, body_path: str) -> str:
+        return body_codec.read_text(body_path)
+
+    def iter_body(self, body_path: str, chunk_size: int = body_codec.CHUNK_SIZE):
+        return body_codec.iter_file(body_path, chunk_size)
+
+    def read_range(self, body_path: str, start: int, end: int | None = None) -> bytes:
+        return body_codec.read_range(body_path, start, end)
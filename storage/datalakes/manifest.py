@@ -0,0 +1,104 @@
+import hashlib
+import sqlite3
+from pathlib import Path
+
+
+def content_hash(*parts: str) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8", errors="ignore"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class Manifest:
+    """book_id -> content hash, size and stored location, kept in a small SQLite catalog next to the lake.
+
+    `manifest` holds the latest version of each book; `versions` is an append-only log of every write,
+    keyed by its YYYYMMDDHH partition, so listings never need to walk the lake's directory tree."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("PRAGMA synchronous=NORMAL;")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS manifest (
+                    book_id     INTEGER PRIMARY KEY,
+                    hash        TEXT NOT NULL,
+                    size        INTEGER,
+                    header_path TEXT,
+                    body_path   TEXT,
+                    date        TEXT,
+                    hour        TEXT
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_manifest_hash ON manifest(hash)")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS versions (
+                    book_id     INTEGER NOT NULL,
+                    partition   TEXT NOT NULL,
+                    hash        TEXT,
+                    header_path TEXT,
+                    body_path   TEXT,
+                    PRIMARY KEY (book_id, partition)
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_versions_partition ON versions(partition)")
+
+    def _rows(self, cur):
+        cols = [c[0] for c in cur.description]
+        return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+    def get(self, book_id: int) -> dict | None:
+        rows = self._rows(self.conn.execute("SELECT * FROM manifest WHERE book_id=?", (int(book_id),)))
+        return rows[0] if rows else None
+
+    def find_hash(self, digest: str) -> dict | None:
+        rows = self._rows(self.conn.execute("SELECT * FROM manifest WHERE hash=? LIMIT 1", (digest,)))
+        return rows[0] if rows else None
+
+    def put(self, entry: dict):
+        self.put_many([entry])
+
+    def put_many(self, entries):
+        entries = list(entries)
+        with self.conn:
+            self.conn.executemany("""
+                INSERT OR REPLACE INTO manifest (book_id, hash, size, header_path, body_path, date, hour)
+                VALUES (:book_id, :hash, :size, :header_path, :body_path, :date, :hour)
+            """, entries)
+            self.conn.executemany("""
+                INSERT OR REPLACE INTO versions (book_id, partition, hash, header_path, body_path)
+                VALUES (:book_id, :date || :hour, :hash, :header_path, :body_path)
+            """, entries)
+
+    def is_empty(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM versions LIMIT 1").fetchone() is None
+
+    def iter_versions(self, since: str | None = None, until: str | None = None, latest_only: bool = False):
+        """(book_id, header_path, body_path) ordered by partition; `since`/`until` are inclusive
+        YYYYMMDDHH bounds and `latest_only` keeps just the newest version of each book."""
+        if latest_only:
+            sql = "SELECT book_id, header_path, body_path, date || hour AS partition FROM manifest"
+        else:
+            sql = "SELECT book_id, header_path, body_path, partition FROM versions"
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("partition >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("partition <= ?")
+            params.append(until)
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY partition, book_id"
+        cur = self.conn.execute(sql, params)
+        while rows := cur.fetchmany(256):
+            for book_id, header_path, body_path, _ in rows:
+                yield book_id, header_path, body_path
+
+    def close(self):
+        self.conn.close()
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Iterable
+from typing import Iterable, Iterator
 
 class Datamart(ABC):
     @abstractmethod
@@ -10,3 +10,34 @@ class Datamart(ABC):
     def get_by_title(self, title: str) -> list[dict]: ...
     @abstractmethod
     def close(self) -> None: ...
+
+    @abstractmethod
+    def get_many(self, book_ids: Iterable[int]) -> dict[int, dict]:
+        """Rows for every known id, keyed by book_id, in one round trip."""
+
+    @abstractmethod
+    def get_by_authors(self, authors: Iterable[str]) -> dict[str, list[dict]]:
+        """Exact-match lookup of many authors at once; authors without books map to []."""
+
+    @abstractmethod
+    def find(self, author: str | None = None, title: str | None = None, language: str | None = None,
+             prefix: bool = False, ignore_case: bool = False,
+             after: int | None = None, limit: int | None = None) -> list[dict]:
+        """Rows matching every given filter, ordered by book_id.
+
+        `prefix` matches author/title by prefix instead of equality and `ignore_case` compares them
+        case-insensitively; `language` is always exact. Only rows with book_id > `after` are returned,
+        at most `limit` of them, which is what iter_find pages with."""
+
+    @abstractmethod
+    def search_titles(self, query: str, language: str | None = None, limit: int | None = None) -> list[dict]:
+        """Rows whose title contains every word of `query` (the last one as a prefix), case-insensitive."""
+
+    def iter_find(self, page_size: int = 100, **filters) -> Iterator[list[dict]]:
+        """Streams find() results one page at a time using keyset pagination on book_id."""
+        after = None
+        while page := self.find(after=after, limit=page_size, **filters):
+            yield page
+            if len(page) < page_size:
+                break
+            after = page[-1]["book_id"]
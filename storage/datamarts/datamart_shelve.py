@@ -1,35 +1,262 @@
+import re
 import shelve
+from collections import OrderedDict
 from .datamart_base import Datamart
-from collections import defaultdict
+
+_MISSING = object()
+_CHUNK = 1024
+_BUCKET = 256
+
+def _fold(value) -> str:
+    return (value or "").casefold()
+
+def _words(title) -> set:
+    return set(re.findall(r"\w+", _fold(title)))
 
 class DatamartShelve(Datamart):
-    def __init__(self, path: str = "datamart_shelve.db"):
-        self.db = shelve.open(path, writeback=True)
-        if "_author_index" not in self.db:
-            self.db["_author_index"] = defaultdict(set)
-        if "_title_index" not in self.db:
-            self.db["_title_index"] = defaultdict(set)
+    """Rows live under str(book_id); secondary indexes are stored as small per-value shelf entries, so an
+    upsert rewrites only the entries it adds a row to or removes a row from, whatever the catalog size.
+
+    The row keys of an author, title, language or title word are split by book_id range into chunks of
+    _CHUNK ids: "a<n>:<author>" (likewise t, l, w) holds chunk n and "a:<author>" the chunk numbers in use.
+    For prefix and case-insensitive lookups, authors, titles and title words are also filed in a prefix tree
+    of their casefolded forms: leaf "A:<p>" (likewise T, W) holds at most _BUCKET values under prefix p, and
+    a leaf that outgrows it is split by the next letter, "A/<p>" then listing the letters below p. Adding a
+    value rewrites one leaf, so its cost does not grow with the catalog. Reads go through a bounded LRU
+    cache.
+
+    dbm.dumb, the fallback when Python has no gdbm/ndbm, rewrites its whole key directory on every sync and
+    every delete. On it, upserts are only synced every `sync_every` rows and on flush() or close(), and an
+    emptied entry is kept as an empty set rather than deleted; other backends sync after every upsert_many."""
+
+    def __init__(self, path: str = "datamart_shelve.db", cache_size: int = 4096, sync_every: int = 1000):
+        self.db = shelve.open(path)
+        self._dumb = type(self.db.dict).__module__ == "dbm.dumb"
+        self.sync_every = sync_every if self._dumb else 1
+        self._unsynced = 0
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        if "_author_index" in self.db:
+            self._migrate()
+
+    def _migrate(self):
+        # Shelves written with writeback=True pickled each whole index under one key; rebuild per-value entries.
+        rows = [self.db[k] for k in list(self.db.keys()) if k.isdigit()]
+        for name in ("_author_index", "_title_index", "_language_index"):
+            if name in self.db:
+                del self.db[name]
+        self._upsert(rows, reindex=True)
+
+    def _get(self, key, default=None):
+        value = self._cache.get(key, _MISSING)
+        if value is _MISSING:
+            # Misses are cached as None, whatever default this caller passed.
+            value = self.db.get(key)
+            self._cache[key] = value
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return default if value is None else value
+
+    def _put(self, key, value):
+        self.db[key] = value
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _del(self, key):
+        if self._dumb:
+            if key in self.db:
+                self._put(key, set())
+            return
+        if key in self.db:
+            del self.db[key]
+        self._cache.pop(key, None)
+
+    def _entries(self, row) -> set:
+        n = int(row["book_id"]) // _CHUNK
+        values = [("a", row.get("author")), ("t", row.get("title")), ("l", row.get("language"))]
+        values += [("w", w) for w in _words(row.get("title"))]
+        return {f"{kind}{n}:{value or ''}" for kind, value in values}
+
+    def _leaf(self, kind, folded, grow=False):
+        # Prefix of the tree leaf that files values folding to `folded`; None when the path to it does not
+        # exist. With grow, the missing letters of the path are registered instead.
+        p = ""
+        while len(p) < len(folded):
+            children = self._get(f"{kind}/{p}")
+            if children is None:
+                break
+            c = folded[len(p)]
+            if c not in children:
+                if not grow:
+                    return None
+                self._put(f"{kind}/{p}", children | {c})
+            p += c
+        return p
+
+    def _bucket_add(self, kind, value):
+        p = self._leaf(kind, _fold(value), grow=True)
+        members = self._get(f"{kind}:{p}", set()) | {value}
+        if len(members) > _BUCKET:
+            self._split(kind, p, members)
+        else:
+            self._put(f"{kind}:{p}", members)
+
+    def _split(self, kind, p, members):
+        # Values folding to p itself stay in its leaf; the others move one letter down.
+        keep, children = set(), {}
+        for value in members:
+            folded = _fold(value)
+            if len(folded) == len(p):
+                keep.add(value)
+            else:
+                children.setdefault(folded[len(p)], set()).add(value)
+        if not children:
+            self._put(f"{kind}:{p}", members)
+            return
+        self._put(f"{kind}/{p}", set(children))
+        if keep:
+            self._put(f"{kind}:{p}", keep)
+        else:
+            self._del(f"{kind}:{p}")
+        for c, values in children.items():
+            if len(values) > _BUCKET:
+                self._split(kind, p + c, values)
+            else:
+                self._put(f"{kind}:{p + c}", values)
+
+    def _bucket_remove(self, kind, value):
+        p = self._leaf(kind, _fold(value))
+        if p is not None:
+            self._update_set(f"{kind}:{p}", set(), {value})
+
+    def _update_set(self, key, added, removed):
+        old = self._get(key, set())
+        new = (old - removed) | added
+        if new != old:
+            if new:
+                self._put(key, new)
+            else:
+                self._del(key)
+        return bool(old), bool(new)
+
+    def _upsert(self, rows, reindex=False) -> int:
+        rows = list(rows)
+        # The last row of a book_id wins; diffing every row of it against the stored one would leave the
+        # entries of the rows in between behind.
+        latest = {str(r["book_id"]): r for r in rows}
+        changes = {}
+        for key, r in latest.items():
+            old = None if reindex else self._get(key)
+            before = self._entries(old) if old else set()
+            after = self._entries(r)
+            for entry in after - before:
+                changes.setdefault(entry, (set(), set()))[0].add(key)
+            for entry in before - after:
+                changes.setdefault(entry, (set(), set()))[1].add(key)
+            self._put(key, r)
+        # postings chunks -> the chunk lists of their values -> the prefix tree, for values that appear or go
+        while changes:
+            parents = {}
+            for entry, (added, removed) in changes.items():
+                had, has = self._update_set(entry, added, removed)
+                if had == has:
+                    continue
+                kind, value = entry.split(":", 1)
+                if kind[1:].isdigit():
+                    parents.setdefault(f"{kind[0]}:{value}", (set(), set()))[0 if has else 1].add(int(kind[1:]))
+                elif kind in ("a", "t", "w"):
+                    (self._bucket_add if has else self._bucket_remove)(kind.upper(), value)
+            changes = parents
+        return len(rows)
 
     def upsert_many(self, rows):
-        count = 0
-        aidx = self.db["_author_index"]; tidx = self.db["_title_index"]
-        for r in rows:
-            key = str(r["book_id"])
-            self.db[key] = r
-            aidx[r["author"]].add(key)
-            tidx[r["title"]].add(key)
-            count += 1
-        self.db["_author_index"] = aidx; self.db["_title_index"] = tidx
-        self.db.sync()
+        count = self._upsert(rows)
+        self._unsynced += count
+        if self._unsynced >= self.sync_every:
+            self.flush()
         return count
 
+    def flush(self) -> None:
+        self.db.sync()
+        self._unsynced = 0
+
+    def _ids(self, kind, value) -> set:
+        chunks = self._get(f"{kind}:{value}", set())
+        return set().union(*(self._get(f"{kind}{n}:{value}", set()) for n in chunks))
+
+    def _rows(self, keys) -> list[dict]:
+        return [self._get(k) for k in sorted(keys, key=int)]
+
     def get_by_author(self, author: str) -> list[dict]:
-        keys = list(self.db["_author_index"].get(author, []))
-        return [self.db[k] for k in keys]
+        return self._rows(self._ids("a", author))
 
     def get_by_title(self, title: str) -> list[dict]:
-        keys = list(self.db["_title_index"].get(title, []))
-        return [self.db[k] for k in keys]
+        return self._rows(self._ids("t", title))
+
+    def get_many(self, book_ids) -> dict[int, dict]:
+        rows = ((int(b), self._get(str(b))) for b in book_ids)
+        return {b: row for b, row in rows if row is not None}
+
+    def get_by_authors(self, authors) -> dict[str, list[dict]]:
+        return {a: self.get_by_author(a) for a in authors}
+
+    def _subtree(self, kind, p):
+        yield from self._get(f"{kind}:{p}", set())
+        for c in self._get(f"{kind}/{p}", set()):
+            yield from self._subtree(kind, p + c)
+
+    def _values(self, kind, value, prefix, ignore_case):
+        kind, want = kind.upper(), _fold(value)
+        p = self._leaf(kind, want)
+        if p is None:
+            return
+        # Reaching the prefix itself, every value below it matches; a leaf above it is filtered.
+        names = self._subtree(kind, p) if prefix and p == want else self._get(f"{kind}:{p}", set())
+        fold = _fold if ignore_case else str
+        want = fold(value)
+        for name in names:
+            if fold(name).startswith(want) if prefix else fold(name) == want:
+                yield name
+
+    def _keys(self, kind, value, prefix, ignore_case) -> set:
+        if not prefix and not ignore_case:
+            return self._ids(kind, value)
+        keys = set()
+        for name in self._values(kind, value, prefix, ignore_case):
+            keys |= self._ids(kind, name)
+        return keys
+
+    def find(self, author=None, title=None, language=None, prefix=False, ignore_case=False,
+             after=None, limit=None) -> list[dict]:
+        candidates = None
+        for kind, value in (("a", author), ("t", title)):
+            if value is not None:
+                keys = self._keys(kind, value, prefix, ignore_case)
+                candidates = keys if candidates is None else candidates & keys
+        if language is not None:
+            keys = self._ids("l", language)
+            candidates = keys if candidates is None else candidates & keys
+        if candidates is None:
+            candidates = [k for k in self.db.keys() if k.isdigit()]
+        ids = sorted(int(k) for k in candidates)
+        if after is not None:
+            ids = [i for i in ids if i > after]
+        return [self._get(str(i)) for i in ids[:limit]]
+
+    def search_titles(self, query, language=None, limit=None) -> list[dict]:
+        words = re.findall(r"\w+", _fold(query))
+        if not words:
+            return []
+        keys = self._keys("w", words[-1], prefix=True, ignore_case=False)
+        for w in words[:-1]:
+            keys &= self._ids("w", w)
+        if language is not None:
+            keys &= self._ids("l", language)
+        return self._rows(keys)[:limit]
 
     def close(self) -> None:
         self.db.close()
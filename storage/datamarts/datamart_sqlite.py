@@ -1,6 +1,25 @@
 import sqlite3
+import string
+from itertools import islice
 from .datamart_base import Datamart
 
+# SQLite's default limit on bound parameters in older builds is 999; IN (...) lists are chunked below it.
+_CHUNK = 500
+# NOCASE folds ASCII letters only, so prefix bounds are folded the same way to bracket the folded values.
+_NOCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def _chunks(values):
+    values = iter(values)
+    while chunk := list(islice(values, _CHUNK)):
+        yield chunk
+
+def _fts_query(query: str) -> str:
+    # Each word quoted so FTS5 operators in user input are taken literally; the last one matches as a prefix.
+    words = ['"' + w.replace('"', '""') + '"' for w in query.split()]
+    if words:
+        words[-1] += "*"
+    return " ".join(words)
+
 class DatamartSQLite(Datamart):
     def __init__(self, db_path: str = "datamart.sqlite"):
         self.conn = sqlite3.connect(db_path)
@@ -17,8 +36,42 @@ class DatamartSQLite(Datamart):
         """)
         self.conn.execute("CREATE INDEX IF NOT EXISTS idx_author ON books(author)")
         self.conn.execute("CREATE INDEX IF NOT EXISTS idx_title  ON books(title)")
+        # (key, book_id) indexes serve prefix ranges, case-insensitive matches and keyset pages in index order.
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_author_nocase ON books(author COLLATE NOCASE, book_id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_title_nocase  ON books(title COLLATE NOCASE, book_id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_language ON books(language, book_id)")
+        self.fts = self._create_fts()
         self.conn.commit()
 
+    def _create_fts(self) -> bool:
+        exists = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name='books_fts'").fetchone()
+        try:
+            self.conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS books_fts
+                USING fts5(title, content='books', content_rowid='book_id')
+            """)
+        except sqlite3.OperationalError:
+            return False  # SQLite built without FTS5: search_titles falls back to LIKE
+        self.conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+                INSERT INTO books_fts(rowid, title) VALUES (new.book_id, new.title);
+            END;
+            CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+                INSERT INTO books_fts(books_fts, rowid, title) VALUES ('delete', old.book_id, old.title);
+            END;
+            CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title ON books BEGIN
+                INSERT INTO books_fts(books_fts, rowid, title) VALUES ('delete', old.book_id, old.title);
+                INSERT INTO books_fts(rowid, title) VALUES (new.book_id, new.title);
+            END;
+        """)
+        if not exists:
+            self.conn.execute("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+        return True
+
+    def _rows(self, cur) -> list[dict]:
+        cols = [c[0] for c in cur.description]
+        return [dict(zip(cols, r)) for r in cur.fetchall()]
+
     def upsert_many(self, rows):
         cur = self.conn.cursor()
         cur.executemany("""
@@ -41,5 +94,73 @@ class DatamartSQLite(Datamart):
         cols = [c[0] for c in cur.description]
         return [dict(zip(cols, r)) for r in cur.fetchall()]
 
+    def get_many(self, book_ids) -> dict[int, dict]:
+        out = {}
+        for chunk in _chunks(book_ids):
+            marks = ",".join("?" * len(chunk))
+            for row in self._rows(self.conn.execute(f"SELECT * FROM books WHERE book_id IN ({marks})", chunk)):
+                out[row["book_id"]] = row
+        return out
+
+    def get_by_authors(self, authors) -> dict[str, list[dict]]:
+        authors = list(dict.fromkeys(authors))
+        out = {a: [] for a in authors}
+        for chunk in _chunks(authors):
+            marks = ",".join("?" * len(chunk))
+            cur = self.conn.execute(f"SELECT * FROM books WHERE author IN ({marks}) ORDER BY book_id", chunk)
+            for row in self._rows(cur):
+                out[row["author"]].append(row)
+        return out
+
+    def find(self, author=None, title=None, language=None, prefix=False, ignore_case=False,
+             after=None, limit=None) -> list[dict]:
+        where, params = [], []
+        collate = " COLLATE NOCASE" if ignore_case else ""
+        for column, value in (("author", author), ("title", title)):
+            if value is None:
+                continue
+            if prefix and value:
+                # A range instead of LIKE so the (column, book_id) index is used whatever the collation.
+                if ignore_case:
+                    value = value.translate(_NOCASE)
+                where.append(f"{column}{collate} >= ? AND {column}{collate} < ?")
+                params += [value, value[:-1] + chr(ord(value[-1]) + 1)]
+            elif not prefix:
+                where.append(f"{column}{collate} = ?")
+                params.append(value)
+        if language is not None:
+            where.append("language = ?")
+            params.append(language)
+        if after is not None:
+            where.append("book_id > ?")
+            params.append(after)
+        sql = "SELECT * FROM books"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY book_id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._rows(self.conn.execute(sql, params))
+
+    def search_titles(self, query, language=None, limit=None) -> list[dict]:
+        if not query.split():
+            return []
+        if self.fts:
+            sql = ("SELECT b.* FROM books_fts f JOIN books b ON b.book_id = f.rowid "
+                   "WHERE books_fts MATCH ?")
+            params = [_fts_query(query)]
+        else:
+            sql = "SELECT b.* FROM books b WHERE " + " AND ".join("b.title LIKE ?" for _ in query.split())
+            params = [f"%{w}%" for w in query.split()]
+        if language is not None:
+            sql += " AND b.language = ?"
+            params.append(language)
+        sql += " ORDER BY " + ("f.rank" if self.fts else "b.book_id")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._rows(self.conn.execute(sql, params))
+
     def close(self) -> None:
         self.conn.close()
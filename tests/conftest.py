@@ -0,0 +1,69 @@
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from search.analysis import ANALYZER  # noqa: E402
+from search.indexer import PositionalInvertedIndex  # noqa: E402
+from search.postings import END  # noqa: E402
+from search.query_engine import QueryEngine  # noqa: E402
+from shared.repository import DocumentRepo  # noqa: E402
+
+VOCAB = [f"w{i}" for i in range(400)] + ["whale", "whaler", "whaling", "white", "sperm", "ship", "sea", "ahab",
+                                         "the", "of", "said", "man"]
+
+
+def make_corpus(n_docs=150, max_len=200, seed=7):
+    """(doc_id, text) pairs drawn from a Zipf-like vocabulary, with sparse ids so gaps get exercised."""
+    rng = random.Random(seed)
+    weights = [1 / (i + 1) for i in range(len(VOCAB))]
+    ids = sorted(rng.sample(range(1, 50_000), n_docs))
+    return [(d, " ".join(rng.choices(VOCAB, weights, k=rng.randint(5, max_len)))) for d in ids]
+
+
+def make_engine(docs, **kwargs):
+    pos, repo = PositionalInvertedIndex(), DocumentRepo()
+    for doc_id, text in docs:
+        pos.index_document(doc_id, text)
+        repo.add(doc_id, text)
+    return QueryEngine(pos, pos, repo, **kwargs)
+
+
+def reference_postings(docs):
+    """Brute-force reference: term -> {doc_id: positions}, straight from the analyzer."""
+    postings = {}
+    for doc_id, text in docs:
+        for pos, term in ANALYZER.analyze(text):
+            postings.setdefault(term, {}).setdefault(doc_id, []).append(pos)
+    return postings
+
+
+def walk(cursor):
+    """(doc, positions or tf) pairs read off a posting cursor with next()."""
+    out = []
+    while cursor.next() != END:
+        out.append((cursor.doc, list(cursor.positions()) if hasattr(cursor, "positions") else cursor.tf))
+    return out
+
+
+def holding(docs, term):
+    """Brute-force reference: ids of the documents whose analyzed text contains `term`."""
+    return {doc_id for doc_id, text in docs if term in ANALYZER.terms(text)}
+
+
+@pytest.fixture(scope="session")
+def corpus():
+    return make_corpus()
+
+
+@pytest.fixture
+def whales():
+    return make_engine([
+        (1, "the white whale swam past the ship"),
+        (2, "a sperm whale dove deep"),
+        (3, "white whale and sperm whale together"),
+        (4, "Call me Ishmael, said the sailor"),
+    ])
@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from search.analysis import ANALYZER, WORD_RE, Analyzer
+
+PIECES = ["whale", "The", "SEAS", "ships", "of", "naïve", "Café", "日本語", "ΟΔΟΣ", "Σ", "İstanbul", "straße", "x1_y2",
+          "don't", " ", "  ", "\n", ", ", ".", "—", "'", "_", "9", "é", "é"]
+
+
+def text(rng, n):
+    return "".join(rng.choice(PIECES) for _ in range(n))
+
+
+def chunks(rng, s):
+    cuts = sorted(rng.choices(range(len(s) + 1), k=rng.randint(0, 12)))
+    return [s[a:b] for a, b in zip([0] + cuts, cuts + [len(s)])]
+
+
+def reference(analyzer, s):
+    # Lowercase the whole text, number every word, then drop stop words.
+    out = []
+    for pos, word in enumerate(WORD_RE.findall(s.lower())):
+        term = analyzer._normalize(word)
+        if term is not None:
+            out.append((pos, term))
+    return out
+
+
+ANALYZERS = [ANALYZER, Analyzer(stemmer="s", fold=True), Analyzer(ngrams=3, cache_size=8)]
+
+
+@pytest.mark.parametrize("analyzer", ANALYZERS, ids=["default", "stem-fold", "ngrams-tiny-cache"])
+@pytest.mark.parametrize("seed", range(60))
+def test_chunked_text_analyzes_like_the_whole(analyzer, seed):
+    rng = random.Random(seed)
+    s = text(rng, rng.randint(0, 80))
+    parts = chunks(rng, s)
+    assert "".join(parts) == s
+    assert analyzer.tokens(s) == analyzer.tokens(iter(parts)) == reference(analyzer, s)
+    assert analyzer.analyze(parts) == analyzer.analyze(s)
+    assert analyzer.terms(parts) == analyzer.terms(s)
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5])
+def test_every_cut_point(size):
+    s = "The whale's ΟΔΟΣ' naïve straße, İstanbul 日本語 ships"
+    for offset in range(size):
+        parts = [s[:offset]] + [s[i:i + size] for i in range(offset, len(s), size)]
+        assert ANALYZER.tokens(parts) == ANALYZER.tokens(s), parts
+
+
+def test_stop_words_keep_their_positions():
+    assert ANALYZER.tokens("The whale and the sea") == [(1, "whale"), (4, "sea")]
+    assert ANALYZER.phrase_terms("whale of the sea") == [(0, "whale"), (3, "sea")]
+    assert Analyzer(ngrams=2).analyze("white whale of sea") == [(0, "white"), (0, "white whale"), (1, "whale"),
+                                                              (3, "sea")]
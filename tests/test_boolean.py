@@ -0,0 +1,136 @@
+import random
+
+import pytest
+
+from conftest import make_engine, reference_postings
+from search.analysis import ANALYZER
+from search.boolean import boolean_search, parse
+from search.indexer import PositionalInvertedIndex
+from search.segment import Segment
+
+WORDS = ["w0", "w1", "w2", "w3", "w5", "w8", "w13", "whale", "sea", "ship", "nosuchterm"]
+HEADER_WORDS = ["melville", "austen", "moby", "emma"]
+
+
+@pytest.fixture(scope="module", params=["memory", "segment"])
+def world(request, corpus, tmp_path_factory):
+    body, header = PositionalInvertedIndex(), PositionalInvertedIndex()
+    headers = {}
+    for doc_id, text in corpus:
+        headers[doc_id] = "Moby by Melville" if doc_id % 3 == 0 else "Emma by Austen"
+        body.index_document(doc_id, text)
+        header.index_document(doc_id, headers[doc_id])
+    term_at = {
+        "body": {d: dict(ANALYZER.analyze(t)) for d, t in corpus},
+        "header": {d: dict(ANALYZER.analyze(t)) for d, t in headers.items()},
+    }
+    indexes = {"body": body, "header": header}
+    if request.param == "segment":
+        where = tmp_path_factory.mktemp("boolean")
+        indexes = {name: Segment(idx.flush(where / f"{name}.seg")) for name, idx in indexes.items()}
+    yield indexes, term_at, {d for d, _ in corpus}
+    for idx in indexes.values():
+        getattr(idx, "close", lambda: None)()
+
+
+def phrase_docs(term_at, text):
+    pairs = ANALYZER.phrase_terms(text)
+    out = set()
+    for doc_id, at in term_at.items():
+        starts = [p for p, t in at.items() if t == pairs[0][1]]
+        if any(all(at.get(s + o - pairs[0][0]) == t for o, t in pairs) for s in starts):
+            out.add(doc_id)
+    return out
+
+
+# Random syntax trees, rendered to query text and evaluated with sets.
+
+def gen(rng, depth, field="body"):
+    words = HEADER_WORDS if field == "header" else WORDS
+    r = rng.random()
+    if depth == 0 or r < 0.3:
+        if rng.random() < 0.15:
+            return ("phrase", field, f"{rng.choice(words)} {rng.choice(words)}")
+        return ("term", field, rng.choice(words))
+    if r < 0.45:
+        return ("not", gen(rng, depth - 1, field))
+    if r < 0.5 and field == "body":
+        return ("field", gen(rng, depth - 1, "header"))
+    op = "and" if r < 0.75 else "or"
+    return (op, [gen(rng, depth - 1, field) for _ in range(rng.randint(2, 3))])
+
+
+def render(node, rng):
+    kind = node[0]
+    if kind == "term":
+        return node[2]
+    if kind == "phrase":
+        return f'"{node[2]}"'
+    if kind == "not":
+        return ("-" if rng.random() < 0.5 else "NOT ") + render(node[1], rng)
+    if kind == "field":
+        return f"header:({render(node[1], rng)})"
+    glue = rng.choice([" AND ", " "]) if kind == "and" else " OR "
+    return "(" + glue.join(render(c, rng) for c in node[1]) + ")"
+
+
+def evaluate(node, world):
+    _, term_at, every = world
+    kind = node[0]
+    if kind == "term":
+        return {d for d, at in term_at[node[1]].items() if node[2] in at.values()}
+    if kind == "phrase":
+        return phrase_docs(term_at[node[1]], node[2])
+    if kind == "not":
+        return every - evaluate(node[1], world)
+    if kind == "field":
+        return evaluate(node[1], world)
+    sets = [evaluate(c, world) for c in node[1]]
+    return set.intersection(*sets) if kind == "and" else set.union(*sets)
+
+
+@pytest.mark.parametrize("seed", range(150))
+def test_random_queries_match_set_algebra(world, seed):
+    rng = random.Random(seed)
+    tree = gen(rng, 3)
+    q = render(tree, rng)
+    docs, _ = boolean_search(world[0], q)
+    assert docs == sorted(evaluate(tree, world)), q
+
+
+@pytest.mark.parametrize("q, expected", [
+    ("w1 w2 OR w3", ("or", [("and", [("term", "body", "w1"), ("term", "body", "w2")]), ("term", "body", "w3")])),
+    ("NOT w1 w2", ("and", [("not", ("term", "body", "w1")), ("term", "body", "w2")])),
+    ('"a b"~2 header:x', ("and", [("phrase", "body", "a b", 2), ("term", "header", "x")])),
+    ("nosuch:w1", ("and", [("term", "body", "nosuch"), ("term", "body", "w1")])),
+    ("w1 AND (w2", ("and", [("term", "body", "w1"), ("term", "body", "w2")])),
+    ("()", None),
+    ("NOT", None),
+])
+def test_precedence_and_recovery(q, expected):
+    assert parse(q, ("body", "header")) == expected
+
+
+def test_stop_words_drop_out(world):
+    indexes = world[0]
+    docs, terms = boolean_search(indexes, "w1 AND the")
+    assert docs == boolean_search(indexes, "w1")[0] and terms == ["w1"]
+
+
+def test_highlight_terms_skip_negated_and_header_operands(world):
+    _, terms = boolean_search(world[0], 'whale -sea header:melville "w1 w2"')
+    assert terms == ["whale", "w1", "w2"]
+
+
+def test_matches_reference_postings(world, corpus):
+    # The index side of the reference: postings straight from the analyzer.
+    ref = reference_postings(corpus)
+    docs, _ = boolean_search(world[0], "w1 -w2")
+    assert docs == sorted(set(ref["w1"]) - set(ref["w2"]))
+
+
+def test_engine_boolean_mode_agrees(world, corpus):
+    eng = make_engine(corpus)
+    for q in ("w1 -w2", "(whale OR sea) w0", '"w0 w1" OR w3'):
+        hits = eng.search(q, "boolean")
+        assert [h["doc_id"] for h in hits] == boolean_search({"body": world[0]["body"]}, q)[0]
@@ -0,0 +1,22 @@
+import pytest
+
+from search.builder import build_index
+from search.indexer import PositionalInvertedIndex, SimpleInvertedIndex
+
+
+@pytest.mark.parametrize("duplicates", [False, True], ids=["distinct", "repeated-ids"])
+@pytest.mark.parametrize("positional", [True, False])
+def test_parallel_build_matches_a_sequential_one(corpus, positional, duplicates):
+    # Reversed, so batches finish with interleaved doc id ranges; a repeated id is folded like a
+    # document indexed twice.
+    books = corpus[::-1] + (corpus[:20] if duplicates else [])
+    built = build_index(books, workers=2, batch_size=16, positional=positional)
+    ref = PositionalInvertedIndex() if positional else SimpleInvertedIndex()
+    for doc_id, text in books:
+        ref.index_document(doc_id, text)
+    assert list(built.terms()) == list(ref.terms())
+    for term in ref.terms():
+        # Merged in doc id order: nothing left for settle() to re-sort.
+        assert not built.index.get(term).dirty
+        assert list(built.iter_postings(term)) == list(ref.iter_postings(term))
+    assert built.stats() == ref.stats()
@@ -0,0 +1,120 @@
+import random
+
+import pytest
+
+from conftest import make_engine
+from search import cache as cache_module
+from search.cache import QueryCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    return clock
+
+
+class Model:
+    """The cache's contract, spelled out: key -> (generation, expiry, value) in recency order."""
+
+    def __init__(self, maxsize, ttl, max_hits):
+        self.maxsize, self.ttl, self.max_hits = maxsize, ttl, max_hits
+        self.order = []
+        self.entries = {}
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, generation, now):
+        if key in self.entries:
+            gen, expires, value = self.entries[key]
+            self.order.remove(key)
+            if gen == generation and (expires is None or expires > now):
+                self.order.append(key)
+                self.hits += 1
+                return value
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, generation, value, now):
+        if self.maxsize <= 0 or len(value) > self.max_hits:
+            return
+        if key in self.entries:
+            self.order.remove(key)
+        self.entries[key] = (generation, None if self.ttl is None else now + self.ttl, value)
+        self.order.append(key)
+        while len(self.order) > self.maxsize:
+            del self.entries[self.order.pop(0)]
+            self.evictions += 1
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_matches_the_model(clock, seed):
+    rng = random.Random(seed)
+    maxsize, ttl, max_hits = rng.choice([0, 1, 3, 8]), rng.choice([None, 5.0]), rng.choice([2, 4])
+    cache, model = QueryCache(maxsize, ttl, max_hits), Model(maxsize, ttl, max_hits)
+    for _ in range(300):
+        key, generation = rng.randrange(12), rng.randrange(3)
+        clock.now += rng.choice([0, 0, 0.5, 2.0])
+        if rng.random() < 0.5:
+            value = [rng.randrange(100) for _ in range(rng.randrange(6))]
+            cache.put(key, generation, value)
+            model.put(key, generation, value, clock.now)
+        else:
+            assert cache.get(key, generation) == model.get(key, generation, clock.now)
+        assert list(cache._entries) == model.order
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (model.hits, model.misses, model.evictions)
+    assert stats["entries"] == len(cache) == len(model.order)
+
+
+def test_ttl_expires_entries(clock):
+    cache = QueryCache(ttl=10)
+    cache.put("q", 0, [1])
+    clock.now += 9.9
+    assert cache.get("q", 0) == [1]
+    clock.now += 0.1
+    assert cache.get("q", 0) is None and len(cache) == 0
+
+
+def test_long_results_are_not_stored():
+    cache = QueryCache(max_hits=3)
+    cache.put("short", 0, [1, 2, 3])
+    cache.put("long", 0, [1, 2, 3, 4])
+    assert cache.get("short", 0) == [1, 2, 3] and cache.get("long", 0) is None
+
+
+def test_generation_change_drops_the_entry():
+    cache = QueryCache()
+    cache.put("q", (1, 1, 0), [1])
+    assert cache.get("q", (1, 2, 0)) is None
+    assert cache.get("q", (1, 1, 0)) is None and len(cache) == 0
+
+
+def test_engine_invalidates_on_index_writes(corpus):
+    eng = make_engine(corpus[:40])
+    first = eng.search("w1", "bm25", topk=50)
+    assert eng.search("  W1 ", "bm25", topk=50) == first
+    assert eng.cache.stats()["hits"] == 1
+    # Callers get copies, so editing a result does not edit the cache.
+    first[0]["doc_id"] = -1
+    assert eng.search("w1", "bm25", topk=50)[0]["doc_id"] != -1
+    eng.pos.index_document(10**6, "w1 w1 w1 w1 w1")
+    eng.repo.add(10**6, "w1 w1 w1 w1 w1")
+    fresh = eng.search("w1", "bm25", topk=50)
+    assert fresh[0]["doc_id"] == 10**6 and fresh == make_engine(corpus[:40] + [(10**6, "w1 " * 5)]).search(
+        "w1", "bm25", topk=50)
+    # Method and topk are part of the key; caller statistics bypass the cache.
+    misses = eng.cache.stats()["misses"]
+    eng.search("w1", "tfidf", topk=50)
+    eng.search("w1", "bm25", topk=5)
+    assert eng.cache.stats()["misses"] == misses + 2 and len(eng.cache) == 3
+    eng.search("w1", "bm25", topk=50, stats=eng.term_stats(["w1"]))
+    assert eng.cache.stats()["misses"] == misses + 2
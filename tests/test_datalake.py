@@ -0,0 +1,143 @@
+import os
+import random
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from storage.datalakes.datalake_sql import DatalakeSQL
+from storage.datalakes.datalake_tria import END_MARKER, START_MARKER, Datalake
+from storage.datalakes.manifest import content_hash
+
+MAY1, MAY2 = datetime(2024, 5, 1, 9), datetime(2024, 5, 2, 17)
+
+
+def book(title, body):
+    return f"Title: {title}\n{START_MARKER}\n{body}\n{END_MARKER}\n"
+
+
+@pytest.fixture(params=[None, "lzma"])
+def lake(request, tmp_path):
+    lake = Datalake(str(tmp_path / "lake"), codec=request.param)
+    yield lake
+    lake.manifest.close()
+
+
+def files(lake):
+    return sorted(p for p in lake.root.rglob("*_*.txt*"))
+
+
+def test_unchanged_text_is_not_rewritten(lake):
+    first = lake.save_raw(1, book("Moby", "call me ishmael"), dt=MAY1)
+    assert first["changed"]
+    before = {p: p.stat().st_mtime_ns for p in files(lake)}
+    again = lake.save_raw(1, book("Moby", "call me ishmael"), dt=MAY2)
+    assert not again["changed"] and again["body_path"] == first["body_path"] and again["date"] == "20240501"
+    assert {p: p.stat().st_mtime_ns for p in files(lake)} == before
+    changed = lake.save_raw(1, book("Moby", "call me ishmael!"), dt=MAY2)
+    assert changed["changed"] and changed["date"] == "20240502"
+    assert lake.get(1)["hash"] == content_hash(book("Moby", "call me ishmael!"))
+
+
+def test_a_missing_file_is_written_again(lake):
+    first = lake.save_raw(1, book("Moby", "whale"), dt=MAY1)
+    Path(first["body_path"]).unlink()
+    again = lake.save_raw(1, book("Moby", "whale"), dt=MAY1)
+    assert again["changed"] and lake.read_body(again["body_path"]) == "whale"
+
+
+def test_identical_books_share_files(lake):
+    raw = book("Twin", "the same text twice")
+    a = lake.save_raw(1, raw, dt=MAY1)
+    b = lake.save_raw(2, raw, dt=MAY2)
+    assert b["changed"] and b["body_path"] != a["body_path"]
+    assert Path(b["body_path"]).name.startswith("2_body") and Path(b["body_path"]).suffix == Path(a["body_path"]).suffix
+    for key in ("header_path", "body_path"):
+        assert os.path.samefile(a[key], b[key])
+    assert os.stat(a["body_path"]).st_nlink == 2
+    # Rewriting one of the twins must not touch the other's copy.
+    lake.save_raw(2, book("Twin", "now different"), dt=MAY2)
+    assert lake.read_body(a["body_path"]) == "the same text twice"
+    assert lake.read_body(lake.get(2)["body_path"]) == "now different"
+    assert os.stat(a["body_path"]).st_nlink == 1
+
+
+def test_rewrite_in_the_same_partition_breaks_the_link(lake):
+    raw = book("Twin", "shared")
+    a = lake.save_raw(1, raw, dt=MAY1)
+    lake.save_raw(2, raw, dt=MAY1)
+    lake.save_raw(2, book("Twin", "mine"), dt=MAY1)
+    assert lake.read_body(a["body_path"]) == "shared" and lake.read_body(lake.get(2)["body_path"]) == "mine"
+
+
+def test_sql_skips_unchanged_rows(tmp_path):
+    sql = DatalakeSQL(str(tmp_path / "books.db"))
+    first = sql.save_raw(1, "Title: Moby", "call me ishmael", dt=MAY1)
+    assert first["changed"]
+    assert sql.save_raw(1, "Title: Moby", "call me ishmael", dt=MAY2) == {
+        "book_id": 1, "ingestion_time": MAY1.isoformat(), "changed": False}
+    # The hash covers header and body separately, so moving text across the boundary is a change.
+    assert content_hash("Title: Moby ", "call") != content_hash("Title: Moby", " call")
+    assert sql.save_raw(1, "Title: Moby", "call me ishmael!", dt=MAY2)["changed"]
+    assert sql.get_book(1)[1:] == ("Title: Moby", "call me ishmael!", MAY2.isoformat())
+    sql.conn.close()
+
+
+# Manifest listings against a record of every write.
+
+def history(lake, seed, ordered):
+    rng = random.Random(seed)
+    versions, latest = {}, {}
+    hours = sorted(datetime(2024, 5, 1 + rng.randrange(4), rng.randrange(24)) for _ in range(12))
+    for n in range(80):
+        dt = hours[n * len(hours) // 80] if ordered else rng.choice(hours)
+        book_id = rng.randint(1, 15)
+        info = lake.save_raw(book_id, book(f"b{book_id}", rng.choice(["whale", "sea", "ship", "ahab"])), dt=dt)
+        if info["changed"]:
+            entry = (book_id, info["header_path"], info["body_path"])
+            versions[(info["date"] + info["hour"], book_id)] = entry
+            latest[book_id] = (info["date"] + info["hour"], entry)
+    return versions, latest
+
+
+def listing(versions, since=None, until=None):
+    return [v for (p, _), v in sorted(versions.items()) if (since is None or p >= since) and (until is None or p <= until)]
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_iter_books_matches_the_write_history(lake, seed):
+    versions, latest = history(lake, seed, ordered=seed % 2 == 0)
+    parts = sorted({p for p, _ in versions})
+    newest = {(p, b): e for b, (p, e) in latest.items()}
+    assert list(lake.iter_books()) == listing(versions)
+    assert list(lake.iter_books(latest_only=True)) == listing(newest)
+    rng = random.Random(seed)
+    for _ in range(10):
+        since, until = sorted(rng.sample(parts, 2))
+        assert list(lake.iter_books(since, until)) == listing(versions, since, until)
+        assert list(lake.iter_books(since=since, latest_only=True)) == listing(newest, since)
+        as_dt = datetime.strptime(until, "%Y%m%d%H")
+        assert list(lake.iter_books(until=as_dt)) == listing(versions, until=until)
+    for book_id in range(1, 16):
+        got = lake.get(book_id)
+        expected = latest[book_id][1] if book_id in latest else None
+        assert (got and (book_id, got["header_path"], got["body_path"])) == expected
+
+
+@pytest.mark.parametrize("seed", range(2))
+def test_rebuilt_manifest_matches_the_tree(lake, seed):
+    versions, _ = history(lake, seed, ordered=True)
+    lake.manifest.close()
+    for path in lake.root.glob("manifest.sqlite*"):
+        path.unlink()
+    rebuilt = Datalake(str(lake.root), codec=lake.codec)
+    assert sorted(rebuilt.iter_books()) == sorted(lake._scan()) == sorted(versions.values())
+    # Every book's newest partition wins, with an empty hash so the next ingest rewrites it.
+    newest = {}
+    for (part, book_id), entry in sorted(versions.items()):
+        newest[book_id] = entry
+    assert sorted(rebuilt.iter_books(latest_only=True)) == sorted(newest.values())
+    assert {rebuilt.get(b)["hash"] for b in newest} == {""}
+    book_id, _, body_path = next(iter(newest.values()))
+    assert rebuilt.save_raw(book_id, book(f"b{book_id}", rebuilt.read_body(body_path)))["changed"]
+    lake.manifest = rebuilt.manifest  # the fixture closes it
@@ -0,0 +1,83 @@
+import random
+from datetime import datetime
+
+import pytest
+
+from storage.datalakes.datalake_sql import DatalakeSQL
+
+
+def rows(ids, seed=0):
+    rng = random.Random(seed)
+    return [{"book_id": i, "header": f"Title: {i}", "body": " ".join(rng.choices(["whale", "sea", "É"], k=30))}
+            for i in ids]
+
+
+@pytest.fixture(params=[None, "zlib"])
+def lake(request, tmp_path):
+    sql = DatalakeSQL(str(tmp_path / "sql" / "books.db"), codec=request.param)
+    yield sql
+    sql.conn.close()
+
+
+def transactions(lake, fn):
+    log = []
+    lake.conn.set_trace_callback(log.append)
+    try:
+        result = fn()
+    finally:
+        lake.conn.set_trace_callback(None)
+    return result, sum(stmt.strip().upper() == "COMMIT" for stmt in log)
+
+
+def test_pragmas_are_set_by_the_class(lake):
+    assert lake.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert lake.conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+
+
+@pytest.mark.parametrize("n, batch_size", [(10, 3), (10, 10), (10, 1), (0, 4), (7, 500)])
+def test_save_many_commits_once_per_batch(lake, n, batch_size):
+    data = rows(range(1, n + 1))
+    written, commits = transactions(lake, lambda: lake.save_many(iter(data), batch_size=batch_size))
+    assert written == [r["book_id"] for r in data]
+    assert commits == -(-n // batch_size)
+    for r in data:
+        assert lake.get_book(r["book_id"])[1:3] == (r["header"], r["body"])
+
+
+def test_save_many_matches_save_raw(lake, tmp_path):
+    data = rows(range(1, 30))
+    one = DatalakeSQL(str(tmp_path / "one.db"), codec=lake.codec)
+    dt = datetime(2024, 5, 1, 12)
+    for r in data:
+        one.save_raw(r["book_id"], r["header"], r["body"], dt=dt)
+    lake.save_many(data, dt=dt, batch_size=4)
+    assert list(lake.iter_books()) == list(one.iter_books())
+    one.conn.close()
+
+
+def test_save_many_skips_unchanged_rows(lake):
+    first = datetime(2024, 5, 1, 12)
+    lake.save_many(rows(range(1, 11)), dt=first, batch_size=3)
+    again = rows(range(1, 11))
+    for r in again[::3]:
+        r["body"] += " changed"
+    written, commits = transactions(lake, lambda: lake.save_many(again, dt=datetime(2024, 5, 2), batch_size=2))
+    assert written == [1, 4, 7, 10]
+    # The batch of 5 and 6 has nothing fresh and opens no transaction; unchanged rows keep their ingestion time.
+    assert commits == 4
+    assert lake.get_book(2)[3] == first.isoformat() and lake.get_book(4)[3] == "2024-05-02T00:00:00"
+    assert lake.save_many(again) == []
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 64])
+def test_iter_books_streams_every_row(lake, batch_size):
+    data = rows(range(1, 21))
+    lake.save_many(data[:10], dt=datetime(2024, 5, 1))
+    lake.save_many(data[10:], dt=datetime(2024, 5, 3))
+    got = list(lake.iter_books(batch_size=batch_size))
+    assert sorted((b, h, body) for b, h, body, _ in got) == [(r["book_id"], r["header"], r["body"]) for r in data]
+    bare = list(lake.iter_books(batch_size=batch_size, include_body=False))
+    assert all(body is None for _, _, body, _ in bare) and len(bare) == 20
+    for since in (datetime(2024, 5, 1), "2024-05-02T00:00:00"):
+        assert sorted(b for b, *_ in lake.iter_books(batch_size=batch_size, since=since)) == list(range(11, 21))
+    assert list(lake.iter_books(since=datetime(2024, 5, 3))) == []
@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from storage.datamarts import datamart_shelve
+from storage.datamarts.datamart_shelve import DatamartShelve
+
+SYLLABLES = ["th", "the", "a", "mo", "by", "dick", "Pri", "pre", "Ja", "ne", "É", "é", "st", "o"]
+
+
+def name(rng, words):
+    return " ".join("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3))).capitalize()
+                    for _ in range(words))
+
+
+@pytest.fixture(scope="module")
+def catalog(tmp_path_factory):
+    rng = random.Random(3)
+    rows = {i: {"book_id": i, "author": name(rng, 2), "title": name(rng, rng.randint(1, 3)),
+                "language": rng.choice(["en", "fr"])} for i in range(1, 801)}
+    dm = DatamartShelve(str(tmp_path_factory.mktemp("shelve") / "dm.db"))
+    with pytest.MonkeyPatch.context() as mp:
+        # Small leaves, so the prefix tree splits several levels deep on a small catalog.
+        mp.setattr(datamart_shelve, "_BUCKET", 8)
+        dm.upsert_many(rows.values())
+        for i in rng.sample(sorted(rows), 100):
+            rows[i] = dict(rows[i], author=name(rng, 2), title=name(rng, 2))
+            dm.upsert_many([rows[i]])
+    yield dm, rows
+    dm.close()
+
+
+def reference(rows, field, value, prefix, ignore_case):
+    fold = str.casefold if ignore_case else str
+    match = (lambda v: fold(v).startswith(fold(value))) if prefix else (lambda v: fold(v) == fold(value))
+    return [rows[i] for i in sorted(rows) if match(rows[i][field])]
+
+
+@pytest.mark.parametrize("field", ["author", "title"])
+@pytest.mark.parametrize("value", ["", "t", "T", "th", "The", "thethe", "ja", "É", "é", "Prip", "nope"])
+def test_find_matches_a_scan(catalog, field, value):
+    dm, rows = catalog
+    for prefix in (False, True):
+        for ignore_case in (False, True):
+            got = dm.find(**{field: value}, prefix=prefix, ignore_case=ignore_case)
+            assert got == reference(rows, field, value, prefix, ignore_case), (prefix, ignore_case)
+
+
+def test_search_titles_matches_a_scan(catalog):
+    dm, rows = catalog
+    for row in list(rows.values())[::40]:
+        query = row["title"].lower()[:-1] or row["title"]
+        assert row in dm.search_titles(query)
+
+
+def test_repeated_book_id_in_one_batch_keeps_only_the_last_row(tmp_path):
+    dm = DatamartShelve(str(tmp_path / "dm.db"))
+    dm.upsert_many([{"book_id": 1, "author": "Jane Austen", "title": "Emma", "language": "en"}])
+    dm.upsert_many([
+        {"book_id": 1, "author": "A. One", "title": "First", "language": "en"},
+        {"book_id": 1, "author": "B. Two", "title": "Second", "language": "fr"},
+    ])
+    assert dm.get_by_author("A. One") == [] and dm.get_by_author("Jane Austen") == []
+    assert [r["title"] for r in dm.get_by_author("B. Two")] == ["Second"]
+    assert dm.find(title="first", prefix=True, ignore_case=True) == []
+    assert dm.search_titles("emma") == [] and dm.find(language="en") == []
+    dm.close()
@@ -0,0 +1,57 @@
+import random
+import string
+
+import pytest
+
+from storage.datamarts.datamart_sqlite import DatamartSQLite
+
+SYLLABLES = ["th", "the", "a", "mo", "by", "dick", "Pri", "pre", "Ja", "ne", "É", "é", "Z", "zo", "Y", "[x", "_"]
+NOCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def name(rng, words):
+    return " ".join("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3))) for _ in range(words))
+
+
+@pytest.fixture(scope="module")
+def catalog(tmp_path_factory):
+    rng = random.Random(4)
+    rows = {i: {"book_id": i, "author": name(rng, 2), "title": name(rng, rng.randint(1, 3)),
+                "language": rng.choice(["en", "fr"]), "header_path": None, "body_path": None}
+            for i in range(1, 601)}
+    dm = DatamartSQLite(str(tmp_path_factory.mktemp("sqlite") / "dm.sqlite"))
+    dm.upsert_many(rows.values())
+    yield dm, rows
+    dm.close()
+
+
+def reference(rows, field, value, prefix, ignore_case):
+    # SQLite's NOCASE folds ASCII letters and nothing else.
+    fold = (lambda s: s.translate(NOCASE)) if ignore_case else str
+    match = (lambda v: fold(v).startswith(fold(value))) if prefix else (lambda v: fold(v) == fold(value))
+    return [i for i in sorted(rows) if match(rows[i][field])]
+
+
+@pytest.mark.parametrize("field", ["author", "title"])
+@pytest.mark.parametrize("value", ["t", "T", "The", "Z", "z", "ZO", "Y", "Pri", "É", "é", "[", "_", "nope"])
+def test_find_matches_a_scan(catalog, field, value):
+    dm, rows = catalog
+    for prefix in (False, True):
+        for ignore_case in (False, True):
+            got = [r["book_id"] for r in dm.find(**{field: value}, prefix=prefix, ignore_case=ignore_case)]
+            assert got == reference(rows, field, value, prefix, ignore_case), (prefix, ignore_case)
+
+
+def test_prefix_ending_in_a_capital_ignoring_case(catalog):
+    dm, rows = catalog
+    expected = reference(rows, "author", "Z", True, True)
+    assert expected and [r["book_id"] for r in dm.find(author="Z", prefix=True, ignore_case=True)] == expected
+
+
+def test_pages_of_a_prefix_cover_it_once(catalog):
+    dm, rows = catalog
+    expected, got, after = reference(rows, "title", "th", True, True), [], None
+    while page := dm.find(title="th", prefix=True, ignore_case=True, after=after, limit=7):
+        got += [r["book_id"] for r in page]
+        after = page[-1]["book_id"]
+    assert got == expected
@@ -0,0 +1,73 @@
+import importlib
+
+import pytest
+
+from storage.datalakes.datalake_sql import DatalakeSQL
+from storage.datalakes.datalake_tria import Datalake
+
+pytest.importorskip("requests")
+from utils.API import LocalMirror  # noqa: E402
+
+BROKEN = {5, 13}
+MISSING = {8}
+IDS = list(range(1, 21))
+
+
+def book(book_id):
+    return (f"Title: Book {book_id}\nAuthor: Someone\n"
+            f"*** START OF THE PROJECT GUTENBERG EBOOK BOOK {book_id} ***\n"
+            f"body of book {book_id} " * 20 +
+            f"\n*** END OF THE PROJECT GUTENBERG EBOOK BOOK {book_id} ***\nlicense\n")
+
+
+class FlakyMirror(LocalMirror):
+    def fetch_gutenberg_text(self, book_id):
+        if book_id in BROKEN:
+            raise OSError(f"connection reset fetching {book_id}")
+        return super().fetch_gutenberg_text(book_id)
+
+
+@pytest.fixture
+def ingest(tmp_path, monkeypatch):
+    # main builds its default lakes in the working directory when it is first imported.
+    monkeypatch.chdir(tmp_path)
+    main = importlib.import_module("main")
+    sql = DatalakeSQL(str(tmp_path / "sql" / "books.db"))
+    monkeypatch.setattr(main, "datalake_tria", Datalake(str(tmp_path / "tria")))
+    monkeypatch.setattr(main, "datalake_sql", sql)
+    mirror = tmp_path / "mirror"
+    mirror.mkdir()
+    for book_id in set(IDS) - MISSING:
+        (mirror / f"{book_id}.txt").write_text(book(book_id), encoding="utf-8")
+    yield main, FlakyMirror(str(mirror)), sql
+    sql.conn.close()
+
+
+@pytest.mark.parametrize("workers", [1, 3, 8])
+def test_failed_books_are_skipped(ingest, capsys, workers):
+    main, mirror, sql = ingest
+    changed = main.ingest_many(IDS, mirror, workers=workers)
+    assert sorted(changed) == sorted(set(IDS) - BROKEN - MISSING)
+    out = capsys.readouterr().out
+    assert all(f"[ERROR] Book {b}: OSError" in out for b in BROKEN)
+    for book_id in changed:
+        header, body = sql.get_book(book_id)[1:3]
+        assert body.startswith(f"body of book {book_id}") and f"Book {book_id}" in header
+    assert sql.get_book(5) is None and main.datalake_tria.get(5) is None
+    # Nothing changed the second time round.
+    assert main.ingest_many(IDS, mirror, workers=workers) == []
+
+
+def test_failed_writes_are_skipped(ingest, monkeypatch, capsys):
+    main, mirror, sql = ingest
+    save_raw = sql.save_raw
+
+    def failing(book_id, *args, **kwargs):
+        if book_id == 3:
+            raise RuntimeError("disk full")
+        return save_raw(book_id, *args, **kwargs)
+
+    monkeypatch.setattr(sql, "save_raw", failing)
+    changed = main.ingest_many(IDS, mirror, workers=2)
+    assert 3 not in changed and sorted(changed) == sorted(set(IDS) - BROKEN - MISSING - {3})
+    assert "[ERROR] Book 3: RuntimeError('disk full')" in capsys.readouterr().out
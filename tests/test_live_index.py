@@ -0,0 +1,135 @@
+import random
+import threading
+
+import pytest
+
+from conftest import make_corpus, reference_postings, walk
+from search import live_index
+from search.indexer import PositionalInvertedIndex
+from search.live_index import LiveIndex
+from search.segment import Segment
+
+TERMS = ["w0", "w1", "w5", "whale", "sea", "w90"]
+
+
+def assert_matches(live, docs, exact_df):
+    """`live` holds exactly `docs` ({doc_id: text}), checked against postings rebuilt from scratch."""
+    ref = reference_postings(docs.items())
+    assert sorted(live.doc_ids()) == sorted(docs)
+    assert live.doc_count == len(docs)
+    total = sum(len(p) for postings in ref.values() for p in postings.values())
+    assert live.avg_doc_len == pytest.approx(total / len(docs))
+    for term in TERMS:
+        expected = sorted(ref.get(term, {}).items())
+        cursor = live.postings(term)
+        assert (walk(cursor) if cursor is not None else []) == expected
+        # Tombstoned postings count towards df until they are compacted away.
+        df = live.doc_freq(term)
+        assert df == len(expected) if exact_df else df >= len(expected)
+    for doc_id in random.Random(0).sample(sorted(docs), 10):
+        assert live.has_doc(doc_id)
+    assert live.boolean_and(["w0", "w1"]) == set(ref["w0"]) & set(ref["w1"])
+    fresh = PositionalInvertedIndex()
+    for doc_id, text in docs.items():
+        fresh.index_document(doc_id, text)
+    assert dict(live.phrase_search("w0 w1")) == dict(fresh.phrase_search("w0 w1"))
+
+
+def mutate(live, docs, rng, n):
+    fresh = make_corpus(n, 120, seed=rng.randrange(10**6))
+    for doc_id, text in fresh:
+        action = rng.random()
+        if action < 0.4 and docs:
+            # Rewrite an existing document.
+            doc_id = rng.choice(sorted(docs))
+        elif action < 0.6 and docs:
+            doc_id = rng.choice(sorted(docs))
+            assert live.delete_document(doc_id)
+            del docs[doc_id]
+            continue
+        live.update_document(doc_id, text)
+        docs[doc_id] = text
+    assert not live.delete_document(-5)
+
+
+@pytest.fixture(params=["memory", "segment"])
+def base(request, corpus, tmp_path):
+    idx = PositionalInvertedIndex()
+    for doc_id, text in corpus:
+        idx.index_document(doc_id, text)
+    if request.param == "memory":
+        return idx
+    return Segment(idx.flush(tmp_path / "base.seg"))
+
+
+@pytest.mark.parametrize("directory", [False, True], ids=["merge-in-memory", "merge-to-segment"])
+def test_updates_deletes_and_compaction(base, corpus, tmp_path, directory):
+    rng = random.Random(11)
+    live = LiveIndex(base, directory=tmp_path / "live" if directory else None, max_delta_docs=10**6)
+    docs = dict(corpus)
+    assert_matches(live, docs, exact_df=True)
+
+    mutate(live, docs, rng, 80)
+    assert live.stats()["deleted_docs"] > 0
+    assert_matches(live, docs, exact_df=False)
+
+    live.compact(wait=True)
+    assert live.stats()["deleted_docs"] == 0 and live.stats()["delta_docs"] == 0
+    assert_matches(live, docs, exact_df=True)
+
+    # A second round, with writes landing while the compaction runs.
+    mutate(live, docs, rng, 40)
+    thread = live.compact()
+    mutate(live, docs, rng, 40)
+    thread.join()
+    assert_matches(live, docs, exact_df=False)
+    live.compact(wait=True)
+    assert_matches(live, docs, exact_df=True)
+    if directory:
+        # Each compaction replaces the previous merged segment instead of piling them up.
+        assert len(list((tmp_path / "live").glob("*.seg"))) == 1
+
+
+def test_full_delta_compacts_on_its_own(corpus):
+    live = LiveIndex(max_delta_docs=20)
+    for doc_id, text in corpus[:45]:
+        live.update_document(doc_id, text)
+    # The delta is swapped out when it fills; while that compaction runs, later writes pile up in the new one.
+    assert live.stats()["delta_docs"] <= 45 - 20
+    live.compact(wait=True)
+    assert_matches(live, dict(corpus[:45]), exact_df=False)
+    live.compact(wait=True)
+    assert_matches(live, dict(corpus[:45]), exact_df=True)
+
+
+def test_failed_compaction_loses_nothing(base, corpus, monkeypatch):
+    rng = random.Random(5)
+    live = LiveIndex(base, max_delta_docs=10**6)
+    docs = dict(corpus)
+    mutate(live, docs, rng, 60)
+    merging, fail = threading.Event(), threading.Event()
+    merge_into = live_index.merge_into
+
+    def failing_merge(add, sources):
+        # Only the compaction's own merge fails; rolling it back merges too.
+        if merging.is_set():
+            return merge_into(add, sources)
+        merging.set()
+        fail.wait(10)
+        raise OSError("disk full")
+
+    monkeypatch.setattr(live_index, "merge_into", failing_merge)
+    thread = live.compact()
+    merging.wait(10)
+    # Writes while the doomed compaction runs: some replace or delete documents of the frozen delta.
+    mutate(live, docs, rng, 40)
+    assert live.compact() is thread
+    fail.set()
+    thread.join()
+    assert "disk full" in live.stats()["compaction_error"]
+    assert_matches(live, docs, exact_df=False)
+
+    monkeypatch.undo()
+    live.compact(wait=True)
+    assert live.stats()["compaction_error"] is None and live.stats()["delta_docs"] == 0
+    assert_matches(live, docs, exact_df=True)
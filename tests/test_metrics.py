@@ -0,0 +1,14 @@
+from shared.metrics import BUCKETS, Histogram
+
+
+def test_quantile_of_an_empty_histogram_is_none():
+    assert Histogram().quantile(0.5) is None
+
+
+def test_quantile_is_the_upper_bound_of_its_bucket():
+    h = Histogram()
+    for value in (BUCKETS[0] / 2, BUCKETS[2], BUCKETS[2], BUCKETS[-1] * 2):
+        h.observe(value)
+    assert h.quantile(0.25) == BUCKETS[0]
+    assert h.quantile(0.5) == h.quantile(0.75) == BUCKETS[2]
+    assert h.quantile(1.0) is None
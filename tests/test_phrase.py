@@ -0,0 +1,81 @@
+from itertools import product
+
+import pytest
+
+from search.analysis import ANALYZER
+from search.indexer import PositionalInvertedIndex
+from search.segment import Segment
+
+PHRASES = ["white whale", "w0 w1", "w1 w0 w2", "the w0", "w2 of w3", "whale", "nosuchterm w0"]
+
+
+@pytest.fixture(scope="module")
+def term_at(corpus):
+    return {doc_id: dict(ANALYZER.analyze(text)) for doc_id, text in corpus}
+
+
+@pytest.fixture(scope="module", params=["memory", "segment"])
+def index(request, corpus, tmp_path_factory):
+    idx = PositionalInvertedIndex()
+    for doc_id, text in corpus:
+        idx.index_document(doc_id, text)
+    if request.param == "memory":
+        yield idx
+    else:
+        with Segment(idx.flush(tmp_path_factory.mktemp("phrase") / "body.seg")) as seg:
+            yield seg
+
+
+def occurrences(term_at, phrase, slop):
+    """doc -> matches of the phrase, found by trying every start position. With slop, a match is the
+    shortest in-order chain of the terms from a start, whose span may differ from the phrase's by `slop`."""
+    pairs = ANALYZER.phrase_terms(phrase)
+    offsets, terms = [o for o, _ in pairs], [t for _, t in pairs]
+    counts = {}
+    for doc_id, at in term_at.items():
+        where = {t: sorted(p for p, x in at.items() if x == t) for t in terms}
+        n = 0
+        for start in where[terms[0]]:
+            if not slop:
+                n += all(at.get(start + o - offsets[0]) == t for o, t in pairs)
+                continue
+            chains = [c for c in product(*(where[t] for t in terms[1:]))
+                      if all(a < b for a, b in zip((start,) + c, c))]
+            if chains:
+                span = min(c[-1] for c in chains) - start if len(terms) > 1 else 0
+                n += abs(span - (offsets[-1] - offsets[0])) <= slop
+        if n:
+            counts[doc_id] = n
+    return counts
+
+
+def near_docs(term_at, terms, k):
+    """Documents with one position of every term inside a window of k positions."""
+    docs = set()
+    for doc_id, at in term_at.items():
+        where = [[p for p, x in at.items() if x == t] for t in terms]
+        if all(where) and any(max(c) - min(c) <= k for c in product(*where)):
+            docs.add(doc_id)
+    return docs
+
+
+@pytest.mark.parametrize("phrase", PHRASES)
+def test_exact_phrase_counts(index, term_at, phrase):
+    assert dict(index.phrase_search(phrase)) == occurrences(term_at, phrase, 0)
+
+
+@pytest.mark.parametrize("slop", [1, 3])
+@pytest.mark.parametrize("phrase", ["w0 w1", "w1 w0 w2", "w2 of w3"])
+def test_sloppy_phrase_counts(index, term_at, phrase, slop):
+    assert dict(index.phrase_search(phrase, slop)) == occurrences(term_at, phrase, slop)
+
+
+def test_results_are_ordered_by_match_count(index):
+    counts = [n for _, n in index.phrase_search("w0 w1")]
+    assert counts and counts == sorted(counts, reverse=True)
+
+
+@pytest.mark.parametrize("k", [1, 2, 5])
+@pytest.mark.parametrize("terms", [["w0", "w1"], ["w3", "w0", "w2"], ["whale", "white"]])
+def test_near_matches_a_window_scan(index, term_at, terms, k):
+    assert {d for d, _ in index.proximity_search(terms, k)} == near_docs(term_at, terms, k)
@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+from search.cache import normalize_query
+from search.query_engine import query_kind
+
+
+def ids(hits):
+    return [h["doc_id"] for h in hits]
+
+
+@pytest.mark.parametrize("q, kind", [
+    ('"white whale"', "phrase"),
+    ('"white whale"~2', "phrase"),
+    ('"white whale" OR "sperm whale"', "boolean"),
+    ('"white whale" -"sperm whale"', "boolean"),
+    ('"white whale" "sperm whale"', "boolean"),
+    ("white NEAR/3 whale", "near"),
+    ("white whale", "ranked"),
+    ("white -whale", "boolean"),
+    ("Body:whale", "boolean"),
+    ("HEADER:melville whale", "boolean"),
+])
+def test_query_kind(q, kind):
+    assert query_kind(q) == kind
+
+
+@pytest.mark.parametrize("q", ["body:whale", "header:ahab white", "white AND whale", "white NEAR/2 whale",
+                               '"white whale"', "white -whale", "whale sea", "nobody:whale"])
+def test_queries_sharing_a_cache_key_share_a_route(q):
+    rng = random.Random(q)
+    for _ in range(20):
+        variant = "".join(c.upper() if rng.random() < 0.5 else c for c in q)
+        if normalize_query(variant) == normalize_query(q):
+            assert query_kind(variant) == query_kind(q), variant
+
+
+def test_field_prefix_routes_in_any_case(whales):
+    # Boolean hits come in doc id order without a score, whichever spelling reaches the cache first.
+    for q in ("Body:whale", "body:whale"):
+        hits = whales.search(q)
+        assert ids(hits) == [1, 2, 3] and not any("score" in h for h in hits)
+
+
+def test_single_phrase(whales):
+    assert ids(whales.search('"white whale"')) == [1, 3]
+
+
+def test_several_phrases_go_to_the_boolean_planner(whales):
+    assert ids(whales.search('"white whale" OR "sperm whale"')) == [1, 2, 3]
+    assert ids(whales.search('"white whale" -"sperm whale"')) == [1]
+    assert ids(whales.search('"white whale" "sperm whale"')) == [3]
+
+
+@pytest.mark.parametrize("q, terms", [
+    ("Who is Ishmael?", ["who", "ishmael"]),
+    ("ishmael?", ["ishmael"]),
+    ("Ishmael??", ["ishmael"]),
+])
+def test_trailing_question_mark_is_punctuation(whales, q, terms):
+    assert whales.query_terms(q) == terms
+    assert ids(whales.search(q)) == [4]
+
+
+def test_question_mark_inside_a_word_is_a_wildcard(whales):
+    assert whales.expand("body", "wh?le") == ["whale"]
+    assert whales.expand("body", "whale?") is None
+    assert sorted(ids(whales.search("whale?"))) == [1, 2, 3]
+    assert ids(whales.search("sp?rm OR ishmael?", "boolean")) == [2, 3, 4]
+
+
+def test_unmatched_pattern_falls_back_to_the_word(whales):
+    assert whales.expand("body", "swam*") == ["swam"]
+    assert whales.expand("body", "sailor*x") is None
+    assert whales.query_terms("sailor*x") == ["sailor", "x"]
+
+
+@pytest.mark.parametrize("q", ["*", "?*", "w*", "*?"])
+def test_patterns_without_enough_letters_are_rejected(whales, q):
+    with pytest.raises(ValueError):
+        whales.search(q)
@@ -0,0 +1,85 @@
+import math
+from collections import Counter
+
+import pytest
+
+from conftest import reference_postings
+from search import ranking
+from search.indexer import PositionalInvertedIndex
+from search.segment import Segment
+
+QUERIES = [["whale"], ["w1", "w2"], ["w3", "w3", "sea"], ["ahab", "w0", "w17", "w250"], ["nosuchterm", "w5"]]
+
+
+@pytest.fixture(scope="module")
+def reference(corpus):
+    postings = reference_postings(corpus)
+    lengths, norms = Counter(), Counter()
+    for docs in postings.values():
+        for doc_id, positions in docs.items():
+            lengths[doc_id] += len(positions)
+            norms[doc_id] += (1 + math.log(len(positions))) ** 2
+    return postings, lengths, {d: math.sqrt(n) for d, n in norms.items()}
+
+
+@pytest.fixture(scope="module", params=["memory", "segment"])
+def index(request, corpus, tmp_path_factory):
+    idx = PositionalInvertedIndex()
+    for doc_id, text in corpus:
+        idx.index_document(doc_id, text)
+    if request.param == "memory":
+        yield idx
+    else:
+        with Segment(idx.flush(tmp_path_factory.mktemp("rank") / "body.seg")) as seg:
+            yield seg
+
+
+def exhaustive(reference, terms, method, k1=1.2, b=0.75):
+    """Score of every document holding a query term, computed from the definitions."""
+    postings, lengths, norms = reference
+    n, avg = len(lengths), sum(lengths.values()) / len(lengths)
+    qtfs = {t: q for t, q in Counter(terms).items() if t in postings}
+    if method == "cosine":
+        weights = {t: (1 + math.log(q)) * (math.log((n + 1) / (len(postings[t]) + 1)) + 1) for t, q in qtfs.items()}
+        qnorm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+    scores = Counter()
+    for term, qtf in qtfs.items():
+        df = len(postings[term])
+        for doc_id, positions in postings[term].items():
+            tf = len(positions)
+            if method == "tfidf":
+                scores[doc_id] += qtf * (math.log((n + 1) / (df + 1)) + 1) * tf
+            elif method == "bm25":
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                scores[doc_id] += qtf * idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[doc_id] / avg))
+            else:
+                scores[doc_id] += weights[term] / qnorm * (1 + math.log(tf)) / norms[doc_id]
+    return scores
+
+
+def assert_top_k(got, scores, k):
+    """`got` is a valid top-k of `scores`: right size, true scores, descending, nothing better left out."""
+    assert len(got) == min(k, len(scores))
+    for doc_id, score in got:
+        assert score == pytest.approx(scores[doc_id])
+    assert [s for _, s in got] == sorted((s for _, s in got), reverse=True)
+    if got:
+        returned = {doc_id for doc_id, _ in got}
+        best_left = max((s for d, s in scores.items() if d not in returned), default=0.0)
+        assert best_left <= got[-1][1] + 1e-9
+
+
+@pytest.mark.parametrize("method", ["tfidf", "bm25", "cosine"])
+@pytest.mark.parametrize("k", [1, 3, 10, 1000])
+@pytest.mark.parametrize("terms", QUERIES, ids=" ".join)
+def test_wand_returns_the_exhaustive_top_k(index, reference, method, k, terms):
+    assert_top_k(ranking.rank(index, terms, k, method), exhaustive(reference, terms, method), k)
+
+
+def test_non_positive_k_returns_nothing(index):
+    assert ranking.rank(index, ["whale"], 0) == []
+
+
+def test_unknown_scorer_is_rejected(index):
+    with pytest.raises(ValueError):
+        ranking.rank(index, ["whale"], 10, "nosuchscorer")
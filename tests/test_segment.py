@@ -0,0 +1,85 @@
+import random
+from bisect import bisect_left
+
+import pytest
+
+from conftest import reference_postings, walk
+from search import segment
+from search.indexer import PositionalInvertedIndex
+from search.postings import END
+from search.segment import Segment, SegmentWriter
+
+
+@pytest.fixture(params=[segment.BLOCK_SIZE, 4], ids=["default-blocks", "small-blocks"])
+def seg(request, corpus, tmp_path, monkeypatch):
+    # Small blocks give every common term many skip entries, so advance() crosses block boundaries.
+    monkeypatch.setattr(segment, "BLOCK_SIZE", request.param)
+    idx = PositionalInvertedIndex()
+    for doc_id, text in corpus:
+        idx.index_document(doc_id, text)
+    with Segment(idx.flush(tmp_path / "body.seg")) as seg:
+        yield seg
+
+
+def test_postings_match_the_analyzer(seg, corpus):
+    ref = reference_postings(corpus)
+    assert list(seg.terms()) == sorted(ref)
+    for term, docs in ref.items():
+        assert seg.doc_freq(term) == len(docs)
+        assert walk(seg.postings(term)) == sorted(docs.items())
+    assert seg.postings("nosuchterm") is None and seg.doc_freq("nosuchterm") == 0
+
+
+def test_document_statistics(seg, corpus):
+    ref = reference_postings(corpus)
+    lengths = {doc_id: 0 for doc_id, _ in corpus}
+    for docs in ref.values():
+        for doc_id, positions in docs.items():
+            lengths[doc_id] += len(positions)
+    assert seg.doc_count == len(corpus)
+    assert sorted(seg.doc_ids()) == sorted(lengths)
+    assert seg.avg_doc_len == pytest.approx(sum(lengths.values()) / len(lengths))
+    for doc_id, length in lengths.items():
+        assert seg.has_doc(doc_id) and seg.doc_len(doc_id) == length
+    assert not seg.has_doc(-1 + min(lengths)) and seg.doc_len(10**9) == 0
+
+
+def test_advance_lands_on_the_first_doc_at_or_after_the_target(seg, corpus):
+    rng = random.Random(1)
+    ref = reference_postings(corpus)
+    for term in ("w0", "w1", "w3", "whale", "w40"):
+        docs = sorted(ref[term])
+        cursor = seg.postings(term)
+        for target in sorted(rng.sample(range(docs[-1] + 50), 40)):
+            i = bisect_left(docs, max(target, cursor.doc))
+            expected = docs[i] if i < len(docs) else END
+            assert cursor.advance(target) == expected
+            if expected != END:
+                assert cursor.positions() == ref[term][expected]
+
+
+def test_queries_match_the_in_memory_index(seg, corpus):
+    idx = PositionalInvertedIndex()
+    for doc_id, text in corpus:
+        idx.index_document(doc_id, text)
+    for terms in (["whale"], ["the", "w3"], ["w1", "w7", "sea"]):
+        assert seg.boolean_and(terms) == idx.boolean_and(terms)
+        assert seg.boolean_or(terms) == idx.boolean_or(terms)
+        assert seg.tf_idf_score(terms, 10) == pytest.approx(idx.tf_idf_score(terms, 10))
+    for text, slop in (("white whale", 0), ("the w0", 0), ("w1 w2", 2)):
+        assert seg.phrase_search(text, slop) == idx.phrase_search(text, slop)
+
+
+def test_terms_must_be_added_in_order(tmp_path):
+    with pytest.raises(ValueError):
+        with SegmentWriter(tmp_path / "x.seg") as writer:
+            writer.add("b", [(1, [0])])
+            writer.add("a", [(1, [1])])
+    assert not (tmp_path / "x.seg").exists()
+
+
+def test_rejects_a_file_that_is_not_a_segment(tmp_path):
+    path = tmp_path / "junk.seg"
+    path.write_bytes(b"\0" * 128)
+    with pytest.raises(ValueError):
+        Segment(path)
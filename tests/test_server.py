@@ -0,0 +1,134 @@
+import http.client
+import json
+import socket
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import urlencode
+
+import pytest
+
+from conftest import make_engine
+from search.server import SearchService, make_server
+
+
+@pytest.fixture
+def service(corpus):
+    service = SearchService(make_engine(corpus), workers=2, max_pending=4)
+    yield service
+    service.close()
+
+
+def test_rejected_submit_releases_its_slot(service):
+    service.pool.shutdown()
+    for _ in range(service.max_pending + 1):
+        with pytest.raises(RuntimeError):
+            service.search("whale")
+    assert service.stats()["requests"]["pending"] == 0
+
+
+@pytest.fixture
+def serve(corpus):
+    """Starts make_server for a service on a free port; returns (service, base url)."""
+    running = []
+
+    def start(**kwargs):
+        service = SearchService(make_engine(corpus), **kwargs)
+        server = make_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        running.append((server, service))
+        return service, "http://%s:%d" % server.server_address[:2]
+
+    yield start
+    for server, service in running:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+
+def call(url, body=None, method=None):
+    data = None if body is None else json.dumps(body).encode()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data, method=method), timeout=10) as r:
+            return r.status, r.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+QUERIES = [("whale", "tfidf"), ("w1 w2", "bm25"), ('"w0 w1"', "tfidf"), ("w1 -w2", "boolean"), ("wh*", "tfidf")]
+
+
+@pytest.mark.parametrize("q, method", QUERIES)
+def test_search_answers_what_the_engine_does(serve, corpus, q, method):
+    _, url = serve()
+    expected = make_engine(corpus).search(q, method, 5)
+    status, body = call(f"{url}/search?" + urlencode({"q": q, "method": method, "topk": 5}))
+    assert status == 200 and json.loads(body)["hits"] == expected
+    status, body = call(f"{url}/search", {"q": q, "method": method, "k": 5})
+    assert status == 200 and json.loads(body)["hits"] == expected
+
+
+def test_status_endpoints_and_errors(serve, corpus):
+    _, url = serve(loader=lambda: make_engine(corpus))
+    status, body = call(f"{url}/health")
+    assert status == 200 and json.loads(body)["docs"] == len(corpus)
+    status, body = call(f"{url}/stats")
+    assert status == 200 and json.loads(body)["requests"]["pending"] == 0
+    assert call(f"{url}/metrics")[0] == 200
+    assert call(f"{url}/search")[0] == 400
+    assert call(f"{url}/search?q=whale&topk=many")[0] == 400
+    assert call(f"{url}/search", [1, 2])[0] == 400
+    assert call(f"{url}/nowhere")[0] == 404
+    assert call(f"{url}/reload")[0] == 405
+    status, body = call(f"{url}/reload", {})
+    assert status in (202, 409) and json.loads(body)["reloading"]
+
+
+def test_overload_answers_503(serve):
+    _, url = serve(max_pending=0)
+    status, body = call(f"{url}/search?q=whale")
+    assert status == 503 and "pending" in json.loads(body)["error"]
+
+
+def test_swaps_under_load_answer_every_search_unchanged(serve, corpus):
+    service, url = serve(workers=4, max_pending=1000)
+    expected = {q: make_engine(corpus).search(q, m, 10) for q, m in QUERIES}
+    failures, stop = [], threading.Event()
+
+    def client(i):
+        while not stop.is_set():
+            q, method = QUERIES[i % len(QUERIES)]
+            status, body = call(f"{url}/search?" + urlencode({"q": q, "method": method}))
+            if status != 200 or json.loads(body)["hits"] != expected[q]:
+                failures.append((q, status))
+            i += 1
+
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(6)]
+    for t in clients:
+        t.start()
+    for _ in range(10):
+        service.swap(make_engine(corpus))
+    stop.set()
+    for t in clients:
+        t.join()
+    assert not failures and service.generation == 11
+    assert service.stats()["requests"]["errors"] == 0
+
+
+def test_unix_socket(corpus, tmp_path):
+    service = SearchService(make_engine(corpus), workers=2)
+    path = str(tmp_path / "search.sock")
+    server = make_server(service, socket_path=path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        sock = socket.socket(socket.AF_UNIX)
+        sock.connect(path)
+        conn = http.client.HTTPConnection("localhost")
+        conn.sock = sock
+        conn.request("GET", "/search?q=whale")
+        assert json.loads(conn.getresponse().read())["hits"] == make_engine(corpus).search("whale")
+        conn.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
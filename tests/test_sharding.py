@@ -0,0 +1,46 @@
+import pytest
+
+from conftest import make_engine
+from search.sharding import ShardedSearch
+
+QUERIES = [("whale", "tfidf"), ("w1 w2 sea", "bm25"), ("w3 w3 w0", "cosine"), ("wh*", "bm25"),
+           ('"w0 w1"', "tfidf"), ("w0 NEAR/3 w1", "tfidf"), ("(w1 OR w2) -w3", "boolean")]
+
+
+@pytest.fixture(scope="module")
+def sharded(corpus):
+    with ShardedSearch(3) as engine:
+        engine.add_documents(corpus)
+        yield engine
+
+
+def assert_same(got, expected):
+    """Same documents with the same match counts and scores, in whatever order ties came out."""
+    got, expected = (sorted((h["doc_id"], h.get("matches"), h.get("score") or 0.0) for h in hits)
+                     for hits in (got, expected))
+    assert [(d, m) for d, m, _ in got] == [(d, m) for d, m, _ in expected]
+    assert [s for _, _, s in got] == pytest.approx([s for _, _, s in expected])
+
+
+@pytest.mark.parametrize("q, method", QUERIES)
+def test_shards_answer_like_one_engine(sharded, corpus, q, method):
+    # Every match fits in topk, so ties at the cut cannot make the two differ.
+    assert_same(sharded.search(q, method, 1000), make_engine(corpus).search(q, method, 1000))
+
+
+def test_top_k_is_the_best_of_the_global_ranking(sharded, corpus):
+    full = make_engine(corpus).search("w1 w2 sea", "bm25", 1000)
+    top = sharded.search("w1 w2 sea", "bm25", 5)
+    assert [h["score"] for h in top] == pytest.approx([h["score"] for h in full[:5]])
+
+
+def test_updates_and_deletes_reach_their_shard(corpus):
+    docs = dict(corpus)
+    with ShardedSearch(2) as engine:
+        engine.add_documents(corpus)
+        engine.add_documents([(corpus[0][0], "white whale")])
+        assert engine.delete_document(corpus[1][0])
+        docs[corpus[0][0]] = "white whale"
+        del docs[corpus[1][0]]
+        assert engine.stats()["docs_indexed"] == len(docs)
+        assert_same(engine.search("whale", "tfidf", 1000), make_engine(docs.items()).search("whale", "tfidf", 1000))
@@ -0,0 +1,86 @@
+import random
+from functools import partial
+
+import pytest
+
+from search.analysis import ANALYZER, WORD_RE
+from search.indexer import PositionalInvertedIndex
+from search.snippets import snippet
+from shared.repository import CHECKPOINT, DocumentRepo
+from storage.datalakes import codec as body_codec
+from storage.datalakes.datalake_sql import DatalakeSQL
+from storage.datalakes.datalake_tria import Datalake
+
+WORDS = ["whale", "sea", "ship", "the", "of", "Ahab", "naïve", "日本", "café", "w1", "w2"]
+
+
+def text(rng, n):
+    return "".join(rng.choice(WORDS) + rng.choice([" ", "  ", ", ", ".\n", " — "]) for _ in range(n))
+
+
+@pytest.fixture(scope="module")
+def docs():
+    rng = random.Random(11)
+    return [(d, text(rng, rng.choice([5, 63, 64, 65, 300, 1500]))) for d in range(1, 25)]
+
+
+@pytest.fixture(scope="module")
+def index(docs):
+    idx = PositionalInvertedIndex()
+    for doc_id, body in docs:
+        idx.index_document(doc_id, body)
+    return idx
+
+
+@pytest.fixture(scope="module", params=["memory", "file", "file-zlib", "file-lzma", "sql", "sql-lzma"])
+def repo(request, docs, tmp_path_factory):
+    kind, _, codec = request.param.partition("-")
+    repo = DocumentRepo()
+    if kind == "memory":
+        for doc_id, body in docs:
+            repo.add(doc_id, body)
+        yield repo
+        return
+    # Small frames, so the byte ranges cross frame boundaries.
+    mp = pytest.MonkeyPatch()
+    mp.setattr(body_codec.encode, "__defaults__", ("zlib", 100))
+    where = tmp_path_factory.mktemp(request.param)
+    if kind == "file":
+        lake = Datalake(str(where / "lake"), codec=codec or None)
+        for doc_id, body in docs:
+            repo.add(doc_id, body, source=partial(lake.read_range, lake.save_raw(doc_id, body)["body_path"]))
+    else:
+        lake = DatalakeSQL(str(where / "books.db"), codec=codec or None)
+        for doc_id, body in docs:
+            lake.save_raw(doc_id, "", body)
+            repo.add(doc_id, body, source=partial(lake.read_range, doc_id))
+    mp.undo()
+    yield repo
+    (lake.manifest if kind == "file" else lake).conn.close()
+
+
+def test_read_tokens_returns_exactly_the_requested_words(repo, docs):
+    rng = random.Random(2)
+    for doc_id, body in docs:
+        words = WORD_RE.findall(body)
+        assert repo.get(doc_id) == body
+        probes = [(0, 0), (CHECKPOINT - 1, CHECKPOINT), (len(words) - 1, len(words) + 5)]
+        probes += [sorted(rng.sample(range(len(words) + 3), 2)) for _ in range(15)]
+        for first, last in probes:
+            piece, spans = repo.read_tokens(doc_id, first, last)
+            assert [piece[s:e] for s, e in spans] == words[first:last + 1], (doc_id, first, last)
+
+
+@pytest.mark.parametrize("query", [["whale"], ["ship", "ahab"], ["日本", "café"], ["nosuchterm"]])
+def test_snippets_match_the_in_memory_text(repo, docs, index, query):
+    terms = [ANALYZER.term(w) for w in query]
+    memory = DocumentRepo()
+    for doc_id, body in docs:
+        memory.add(doc_id, body)
+    for doc_id, _ in docs:
+        got = snippet(repo, index, doc_id, terms, width=12)
+        assert got == snippet(memory, index, doc_id, terms, width=12)
+        marked = [w[2:-2] for w in got.split() if w.startswith("**")]
+        assert all(ANALYZER.term(WORD_RE.search(w)[0]) in terms for w in marked)
+        if any(t in dict(ANALYZER.analyze(docs[doc_id - 1][1])).values() for t in terms):
+            assert marked
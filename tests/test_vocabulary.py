@@ -0,0 +1,90 @@
+import random
+import re
+
+import pytest
+
+from search import vocabulary
+from search.analysis import ANALYZER
+from search.vocabulary import MIN_LITERALS, Vocabulary
+
+PATTERNS = ["ab*", "*ba", "a*b", "?bc*", "*cab*", "ab?c", "a?*?a", "*b*c*a*", "abc", "c?b", "zz*", "*aa?"]
+
+
+def distance(a, b):
+    row = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        prev, row[0] = row[0], i
+        for j, y in enumerate(b, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (x != y))
+    return row[-1]
+
+
+def brute_fuzzy(terms, word, edits):
+    """(term, distance) within `edits` of `word`, closest first, then alphabetical."""
+    found = sorted((distance(word, t), t) for t in terms)
+    return [(t, d) for d, t in found if d <= edits]
+
+
+def brute_wildcard(terms, pattern):
+    regex = "".join(".*" if c == "*" else "." if c == "?" else re.escape(c) for c in pattern)
+    return sorted(t for t in terms if re.fullmatch(regex, t))
+
+
+@pytest.fixture(scope="module")
+def terms():
+    rng = random.Random(3)
+    return sorted({"".join(rng.choice("abc") for _ in range(rng.randint(1, 7))) for _ in range(2500)})
+
+
+@pytest.fixture(params=[vocabulary.SMALL_RANGE, 0], ids=["head-scan", "reversed-or-grams"])
+def vocab(request, terms, monkeypatch):
+    # With SMALL_RANGE at 0 every pattern goes through the reversed list or the k-gram index.
+    monkeypatch.setattr(vocabulary, "SMALL_RANGE", request.param)
+    return Vocabulary(terms)
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_wildcard_matches_a_full_scan(vocab, terms, pattern):
+    assert vocab.wildcard(pattern, limit=10**6) == brute_wildcard(terms, pattern)
+
+
+@pytest.mark.parametrize("pattern", ["ab*", "*ba", "a*c*b"])
+def test_wildcard_limit_returns_a_sorted_subset(vocab, terms, pattern):
+    every = brute_wildcard(terms, pattern)
+    got = vocab.wildcard(pattern, limit=5)
+    assert len(got) == min(5, len(every)) and got == sorted(got) and set(got) <= set(every)
+
+
+@pytest.mark.parametrize("pattern", ["*", "**", "a*", "?*", "*?"])
+def test_wildcard_needs_literal_letters(vocab, pattern):
+    assert len(pattern.strip("*?")) < MIN_LITERALS
+    with pytest.raises(ValueError):
+        vocab.wildcard(pattern)
+
+
+@pytest.mark.parametrize("prefix", ["", "a", "ab", "cba", "ccccccc", "d"])
+def test_prefix_is_a_range_of_the_term_list(vocab, terms, prefix):
+    assert vocab.prefix(prefix, limit=10**6) == [t for t in terms if t.startswith(prefix)]
+    assert vocab.prefix(prefix, limit=3) == [t for t in terms if t.startswith(prefix)][:3]
+
+
+@pytest.mark.parametrize("word, edits", [("abc", 1), ("abcab", 2), ("c", 1), ("bbbbbbbbb", 2), ("abca", 0)])
+def test_fuzzy_matches_brute_force_edit_distance(vocab, terms, word, edits):
+    expected = brute_fuzzy(terms, word, edits)
+    assert vocab.fuzzy(word, edits, limit=10**6) == expected
+    assert vocab.fuzzy(word, edits, limit=4) == expected[:4]
+
+
+def test_expand_on_analyzed_terms():
+    words = ["whale", "whales", "whaling", "whaler", "white", "while", "wheel", "ship", "sea"]
+    vocab = Vocabulary(sorted({ANALYZER.term(w) for w in words}))
+    # Fuzzy words are stemmed first, wildcard patterns are matched as typed.
+    stem = ANALYZER.term("whales")
+    assert vocab.expand("Whales~1", ANALYZER) == [t for t, _ in brute_fuzzy(vocab.terms, stem, 1)]
+    stem = ANALYZER.term("whaling")
+    assert vocab.expand("whaling~", ANALYZER) == [t for t, _ in brute_fuzzy(vocab.terms, stem, vocabulary.auto_edits(stem))]
+    assert vocab.expand("wh*", ANALYZER) == brute_wildcard(vocab.terms, "wh*")
+    assert vocab.expand("wh?le") == brute_wildcard(vocab.terms, "wh?le")
+    # A trailing "?" ends a question; it is not a one-letter wildcard.
+    assert vocab.expand("ship?") is None and vocab.expand("wh*?") == vocab.expand("wh*")
+    assert vocab.expand("whale") is None
@@ -1,4 +1,30 @@
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Spaces requests to the same host at least 1/rate seconds apart, across threads."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host: str):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
 
 class API:
     URL_CANDIDATES = [
@@ -7,21 +33,70 @@ class API:
         "https://www.gutenberg.org/files/{id}/{id}.txt",
     ]
 
-    def __init__(self, timeout=10):
+    def __init__(self, timeout=10, max_connections=16, rate_limit=None, retries=3, backoff=0.5):
         self.timeout = timeout
         self.headers = {"User-Agent": "D-SearchEngine/1.0 (student project)"}
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_connections)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._preferred = 0
+
+    def _candidates(self):
+        # The template that worked last is tried first; most books share the same layout.
+        first = self._preferred
+        return [first] + [i for i in range(len(self.URL_CANDIDATES)) if i != first]
+
+    def _get(self, url: str):
+        for attempt in range(self.retries + 1):
+            if self.limiter:
+                self.limiter.wait(urlsplit(url).netloc)
+            try:
+                r = self.session.get(url, headers=self.headers, timeout=self.timeout, allow_redirects=True)
+            except requests.RequestException:
+                if attempt == self.retries:
+                    raise
+            else:
+                if r.status_code not in RETRY_STATUS or attempt == self.retries:
+                    return r
+            time.sleep(self.backoff * 2 ** attempt)
 
     def fetch_gutenberg_text(self, book_id: int) -> str | None:
         last_err = None
-        for tpl in self.URL_CANDIDATES:
-            url = tpl.format(id=book_id)
+        for i in self._candidates():
+            url = self.URL_CANDIDATES[i].format(id=book_id)
             try:
-                r = requests.get(url, headers=self.headers, timeout=self.timeout, allow_redirects=True)
+                r = self._get(url)
                 ctype = (r.headers.get("Content-Type") or "").lower()
                 if r.status_code == 200 and "html" not in ctype and r.text.strip():
+                    self._preferred = i
                     return r.text
             except requests.RequestException as e:
                 last_err = e
                 continue
         print(f"[SKIP] {book_id}: no encontrado como texto plano. Último error: {last_err}")
         return None
+
+    def close(self):
+        self.session.close()
+
+
+class LocalMirror:
+    """Offline stand-in for API that serves books from a directory of `<id>.txt` / `pg<id>.txt` files."""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def fetch_gutenberg_text(self, book_id: int) -> str | None:
+        for name in (f"{book_id}.txt", f"pg{book_id}.txt", f"{book_id}-0.txt"):
+            path = self.root / name
+            if path.is_file():
+                return path.read_text(encoding="utf-8", errors="ignore")
+        print(f"[SKIP] {book_id}: no existe en el mirror {self.root}")
+        return None
+
+    def close(self):
+        pass